@@ -38,7 +38,7 @@ grid = """
 
 # Options are used only for the next game
 options = {
-    "replay_file": "my_replay",  # Save replay as my_replay.pkl
+    "replay_file": "my_replay",  # Save replay as my_replay.npz
     "grid": grid,  # Use the custom map
 }
 
@@ -24,7 +24,7 @@ env = gym.make(
 
 # Options are used only for the next game
 options = {
-    "replay_file": "my_replay",  # Save replay as my_replay.pkl
+    "replay_file": "my_replay",  # Save replay as my_replay.npz
 }
 
 observation, info = env.reset(options=options)
@@ -3,16 +3,19 @@ from gymnasium.envs.registration import register
 from generals.agents import AgentFactory
 from generals.core.exceptions import GeneralsBotError
 from generals.core.grid import Grid, GridFactory
-from generals.core.replay import Replay
+from generals.core.grid_pool import GridPool
+from generals.core.replay import Replay, ReplayWriter
 from generals.envs.pettingzoo_generals import PettingZooGenerals
 from generals.remote.exceptions import GeneralsIOClientError, RegisterAgentError
 
 __all__ = [
     "AgentFactory",
     "GridFactory",
+    "GridPool",
     "PettingZooGenerals",
     "Grid",
     "Replay",
+    "ReplayWriter",
     "GeneralsBotError",
     "GeneralsIOClientError",
     "RegisterAgentError",
@@ -23,6 +26,7 @@ def _register_gym_generals_envs():
     register(
         id="gym-generals-v0",
         entry_point="generals.envs.gymnasium_generals:GymnasiumGenerals",
+        vector_entry_point="generals.envs.vector_generals:GeneralsVectorEnv",
     )
 
     register(
@@ -3,6 +3,7 @@
 from .agent import Agent
 from .agent_factory import AgentFactory
 from .expander_agent import ExpanderAgent
+from .mcts_agent import MCTSAgent
 from .random_agent import RandomAgent
 
 # You can also define an __all__ list if you want to restrict what gets imported with *
@@ -11,5 +12,6 @@ __all__ = [
     "AgentFactory",
     "RandomAgent",
     "ExpanderAgent",
+    "MCTSAgent",
     "AgentFactory",
 ]
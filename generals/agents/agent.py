@@ -1,4 +1,7 @@
 from abc import ABC, abstractmethod
+from typing import Any
+
+import numpy as np
 
 from generals.core.game import Action, Observation
 
@@ -8,9 +11,17 @@ class Agent(ABC):
     Base class for all agents.
     """
 
-    def __init__(self, id: str = "NPC", color: tuple[int, int, int] = (67, 70, 86)):
+    def __init__(self, id: str = "NPC", color: tuple[int, int, int] = (67, 70, 86), seed: int | None = None):
         self.id = id
         self.color = color
+        self.seed(seed)
+
+    def seed(self, seed: int | None = None) -> None:
+        """
+        Resets the random number generator `rng` that random agents should use instead of `np.random`,
+        so that their actions are reproducible. Environments seed their NPCs on `reset(seed=...)`.
+        """
+        self.rng = np.random.default_rng(seed)
 
     @abstractmethod
     def act(self, observation: Observation) -> Action:
@@ -20,6 +31,21 @@ class Agent(ABC):
         """
         raise NotImplementedError
 
+    def act_batch(self, observation: dict[str, Any]) -> np.ndarray:
+        """
+        Selects actions in a batch of games, e.g. for `GeneralsVectorEnv`.
+        Observation holds stacked observations of all games, i.e. the action mask
+        has shape (B, H, W, 4), grids (B, H, W) and scalars (B,). Returns (B, 5) array of actions.
+
+        This default implementation calls `act` for every game, override it with
+        a vectorized version if the agent supports it.
+        """
+        actions = []
+        for b in range(len(observation["action_mask"])):
+            _observation = {key: value[b] for key, value in observation["observation"].items()}
+            actions.append(self.act({"observation": _observation, "action_mask": observation["action_mask"][b]}))
+        return np.array(actions, dtype=int)
+
     @abstractmethod
     def reset(self):
         """
@@ -30,3 +56,13 @@ class Agent(ABC):
 
     def __str__(self):
         return self.id
+
+
+def as_batch(observation: Observation) -> dict[str, Any]:
+    """
+    Turns an observation of one game into a batch of one game, as accepted by `Agent.act_batch`.
+    """
+    return {
+        "observation": {key: np.asarray(value)[None] for key, value in observation["observation"].items()},
+        "action_mask": np.asarray(observation["action_mask"])[None],
+    }
@@ -1,5 +1,6 @@
 from .agent import Agent
 from .expander_agent import ExpanderAgent
+from .mcts_agent import MCTSAgent
 from .random_agent import RandomAgent
 
 
@@ -20,5 +21,7 @@ class AgentFactory:
             return RandomAgent(**kwargs)
         elif agent_type == "Expander":
             return ExpanderAgent(**kwargs)
+        elif agent_type == "MCTS":
+            return MCTSAgent(**kwargs)
         else:
             raise ValueError(f"Unknown agent type: {agent_type}")
@@ -1,58 +1,61 @@
+from typing import Any
+
 import numpy as np
 
-from generals.core.config import Direction
 from generals.core.game import Action
 from generals.core.observation import Observation
 
-from .agent import Agent
+from .agent import Agent, as_batch
 
 
 class ExpanderAgent(Agent):
-    def __init__(self, id: str = "Expander", color: tuple[int, int, int] = (0, 130, 255)):
-        super().__init__(id, color)
+    def __init__(self, id: str = "Expander", color: tuple[int, int, int] = (0, 130, 255), seed: int | None = None):
+        super().__init__(id, color, seed)
 
     def act(self, observation: Observation) -> Action:
         """
         Heuristically selects a valid (expanding) action.
         Prioritizes capturing opponent and then neutral cells.
         """
-        mask = observation["action_mask"]
-        observation = observation["observation"]
+        return self.act_batch(as_batch(observation))[0]
 
-        valid_actions = np.argwhere(mask == 1)
-        if len(valid_actions) == 0:  # No valid actions
-            return np.array([1, 0, 0, 0, 0])
+    def act_batch(self, observation: dict[str, Any]) -> np.ndarray:
+        """
+        Heuristically selects a valid (expanding) action in each game of a batch.
+        Within the highest priority class (capturing opponent, capturing neutral, any other) the action is random.
+        """
+        mask = observation["action_mask"].astype(bool)
+        observation = observation["observation"]
+        n_games = len(mask)
 
+        # Values of destination cells of each action, out of grid destinations are masked anyway
         army = observation["armies"]
-        opponent = observation["opponent_cells"]
-        neutral = observation["neutral_cells"]
-
-        # Find actions that capture opponent or neutral cells
-        actions_capture_opponent = np.zeros(len(valid_actions))
-        actions_capture_neutral = np.zeros(len(valid_actions))
-
-        directions = [Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT]
-        for i, action in enumerate(valid_actions):
-            di, dj = action[:-1] + directions[action[-1]].value  # Destination cell indices
-            if army[action[0], action[1]] <= army[di, dj] + 1:  # Can't capture
-                continue
-            elif opponent[di, dj]:
-                actions_capture_opponent[i] = 1
-            elif neutral[di, dj]:
-                actions_capture_neutral[i] = 1
-
-        if np.any(actions_capture_opponent):  # Capture random opponent cell if possible
-            action_index = np.random.choice(np.nonzero(actions_capture_opponent)[0])
-            action = valid_actions[action_index]
-        elif np.any(actions_capture_neutral):  # Capture random neutral cell if possible
-            action_index = np.random.choice(np.nonzero(actions_capture_neutral)[0])
-            action = valid_actions[action_index]
-        else:  # Otherwise, select a random valid action
-            action_index = np.random.choice(len(valid_actions))
-            action = valid_actions[action_index]
-
-        action = np.array([0, action[0], action[1], action[2], 0])
-        return action
+        can_capture = army[..., None] > _destination_values(army) + 1
+        # Priority of capturing a cell is 2 for opponent cells and 1 for neutral cells
+        cell_priority = 2 * np.asarray(observation["opponent_cells"], dtype=np.int8) + observation["neutral_cells"]
+        priority = _destination_values(cell_priority) * can_capture
+
+        # Random scores in [0, 1) are added to priorities, so the valid action with the highest score
+        # is a uniformly random action of the highest priority class
+        scores = np.where(mask, priority + self.rng.random(mask.shape), -1).reshape(n_games, -1)
+        i, j, direction = np.unravel_index(np.argmax(scores, axis=1), mask.shape[1:])
+
+        actions = np.stack([np.zeros(n_games, dtype=int), i, j, direction, np.zeros(n_games, dtype=int)], axis=1)
+        actions[~mask.reshape(n_games, -1).any(axis=1)] = [1, 0, 0, 0, 0]  # No valid actions
+        return actions
 
     def reset(self):
         pass
+
+
+def _destination_values(grid: np.ndarray) -> np.ndarray:
+    """
+    For (..., H, W) grid returns (..., H, W, 4) values of neighbouring cells in each direction
+    (up, down, left, right), out of grid neighbours are zero.
+    """
+    values = np.zeros(grid.shape + (4,), dtype=grid.dtype)
+    values[..., 1:, :, 0] = grid[..., :-1, :]
+    values[..., :-1, :, 1] = grid[..., 1:, :]
+    values[..., :, 1:, 2] = grid[..., :, :-1]
+    values[..., :, :-1, 3] = grid[..., :, 1:]
+    return values
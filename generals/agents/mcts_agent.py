@@ -0,0 +1,279 @@
+import math
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+import numpy as np
+
+from generals.core.config import GENERAL_CODE, MAX_CITY_ARMY, MOUNTAIN_CODE, PASSABLE_CODE
+from generals.core.game import Action, ForwardModel
+from generals.core.grid import Grid
+from generals.core.observation import Observation
+
+from .agent import Agent
+from .expander_agent import ExpanderAgent
+
+PASS_ACTION = (1, 0, 0, 0, 0)
+
+
+class Node:
+    """
+    Node of the search tree of `MCTSAgent`. Children are our candidate moves, the opponent moves
+    are sampled from the rollout policy whenever the tree is traversed (open-loop search).
+    """
+
+    def __init__(self, action: tuple[int, ...] = PASS_ACTION):
+        self.action = action
+        self.children: list[Node] | None = None  # None until the node is expanded
+        self.visits = 0
+        self.value_sum = 0.0
+
+    def uct_child(self, exploration: float) -> "Node":
+        """
+        Returns the child with the highest upper confidence bound, unvisited children first (in order of priors).
+        """
+        assert self.children
+        log_visits = math.log(max(self.visits, 1))
+        best, best_score = self.children[0], -math.inf
+        for child in self.children:
+            if child.visits == 0:
+                return child
+            score = child.value_sum / child.visits + exploration * math.sqrt(log_visits / child.visits)
+            if score > best_score:
+                best, best_score = child, score
+        return best
+
+    def most_visited_child(self) -> "Node":
+        assert self.children
+        return max(self.children, key=lambda child: child.visits)
+
+
+class MCTSAgent(Agent):
+    def __init__(
+        self,
+        id: str = "MCTS",
+        color: tuple[int, int, int] = (255, 165, 0),
+        time_budget: float | None = 0.4,
+        max_iterations: int | None = None,
+        rollout_depth: int = 10,
+        max_children: int = 16,
+        exploration: float = 0.7,
+        rollout_policy: type[Agent] = ExpanderAgent,
+        n_workers: int = 1,
+        executor: Executor | None = None,
+        seed: int | None = None,
+    ):
+        """
+        Monte Carlo tree search over a determinization of the observation: cells in fog are neutral and empty,
+        structures in fog are mountains and an unseen opponent general is placed in the farthest reachable fog cell.
+
+        Args:
+            time_budget: seconds of search per move, generals.io turns last 0.5 s
+            max_iterations: maximum number of rollouts per move, searches are limited by both if both are set
+            rollout_depth: number of turns simulated by the rollout policy after leaving the tree
+            max_children: number of candidate moves of a node, the best ones by a one-step `Game.lookahead`
+            exploration: exploration constant of UCT
+            rollout_policy: agent class playing both sides in rollouts and the opponent in the tree
+            n_workers: number of rollouts run in parallel, on a thread pool unless `executor` is given,
+                the thread pool is created on the first move and shut down by `close` (and `reset`)
+            executor: pool for rollouts, e.g. a `ProcessPoolExecutor` (rollouts and their arguments are picklable),
+                it is left to the caller to shut it down
+        """
+        super().__init__(id, color, seed)
+        assert time_budget is not None or max_iterations is not None, "Search must be limited by time or iterations."
+        self.time_budget = time_budget
+        self.max_iterations = max_iterations
+        self.rollout_depth = rollout_depth
+        self.max_children = max_children
+        self.exploration = exploration
+        self.rollout_policy = rollout_policy
+        self.n_workers = n_workers
+        self.executor = executor
+        self._thread_pool: ThreadPoolExecutor | None = None
+        self.reset()
+
+    def reset(self):
+        self.close()
+        # Subtree of the previous move, reused if the next observation follows it
+        self.root: Node | None = None
+        self.root_timestep = -1
+        self.iterations = 0
+
+    def close(self) -> None:
+        """
+        Shuts down the thread pool created by the agent, an `executor` passed to the agent is not shut down.
+        """
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown()
+            self._thread_pool = None
+
+    def act(self, observation: Observation) -> Action:
+        """
+        Searches for the best move within the time budget and returns the most visited one.
+        """
+        model = self.determinize(observation)
+        opponent = model.agents[1]
+        if self.root is None or observation["observation"]["timestep"] != self.root_timestep + 1:
+            self.root = Node()
+        root = self.root
+        root_snapshot = model.snapshot()
+        opponent_policy = self.rollout_policy(id=opponent, seed=self.rng.integers(2**32))
+        executor = self.executor
+        if executor is None and self.n_workers > 1:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(self.n_workers)
+            executor = self._thread_pool
+
+        deadline = None if self.time_budget is None else time.perf_counter() + self.time_budget
+        self.iterations = 0
+        while (self.max_iterations is None or self.iterations < self.max_iterations) and (
+            deadline is None or time.perf_counter() < deadline
+        ):
+            # Select a batch of leaves, visits are counted before rollouts finish (virtual loss),
+            # so that parallel rollouts explore different leaves
+            jobs = []
+            for _ in range(self.n_workers):
+                model.restore(root_snapshot)
+                path = self._select(root, model, opponent_policy)
+                seed = self.rng.integers(2**32)
+                jobs.append((path, (model.clone(), self.id, self.rollout_policy, self.rollout_depth, seed)))
+            if executor is None:
+                values = [_rollout(*args) for _, args in jobs]
+            else:
+                values = list(executor.map(_rollout, *zip(*(args for _, args in jobs))))
+            for (path, _), value in zip(jobs, values):
+                for node in path:
+                    node.value_sum += value
+            self.iterations += len(jobs)
+
+        if not root.children:
+            self.root = None
+            return np.array(PASS_ACTION)
+        best = root.most_visited_child()
+        self.root, self.root_timestep = best, observation["observation"]["timestep"]
+        return np.array(best.action)
+
+    def _select(self, root: Node, model: ForwardModel, opponent_policy: Agent) -> list[Node]:
+        """
+        Descends the tree from the root by UCT, playing the moves in the model, and expands the reached leaf.
+        Returns the path of visited nodes.
+        """
+        opponent = model.agents[1]
+        node, path = root, [root]
+        root.visits += 1
+        while node.children and not model.is_done():
+            node = node.uct_child(self.exploration)
+            opponent_action = opponent_policy.act(model.agent_observation(opponent).as_dict())
+            model.apply_actions({self.id: np.array(node.action), opponent: opponent_action})
+            node.visits += 1
+            path.append(node)
+        if node.children is None and not model.is_done():
+            node.children = [Node(action) for action in self._candidate_moves(model)]
+        return path
+
+    def _candidate_moves(self, model: ForwardModel) -> list[tuple[int, ...]]:
+        """
+        Returns up to `max_children` moves ordered by a one-step lookahead, passing is always a candidate.
+        """
+        outcomes = model.lookahead(self.id)
+        channels = model.channels
+        opponent_index = channels.owner_index(model.agents[1])
+        di, dj = outcomes.destination.T
+        _, si, sj, _, split = outcomes.actions.T
+        captured_opponent = outcomes.captured & (channels.owners[di, dj] == opponent_index)
+        moved = np.where(split == 1, channels.armies[si, sj] // 2, channels.armies[si, sj] - 1)
+        priors = (
+            100 * outcomes.won
+            + 10 * captured_opponent
+            + 5 * outcomes.captured
+            + moved / max(int(moved.max(initial=1)), 1)
+            + 0.01 * self.rng.random(len(moved))
+        )
+        order = np.argsort(-priors)[: self.max_children - 1]
+        return [tuple(int(x) for x in outcomes.actions[k]) for k in order] + [PASS_ACTION]
+
+    def determinize(self, observation: Observation) -> ForwardModel:
+        """
+        Builds a forward model from the observation of the agent, the opponent is the second agent of the model.
+        """
+        _observation = observation["observation"]
+        owned = np.asarray(_observation["owned_cells"], dtype=bool)
+        opponent_cells = np.asarray(_observation["opponent_cells"], dtype=bool)
+        armies = np.asarray(_observation["armies"], dtype=int).copy()
+        generals = np.asarray(_observation["generals"], dtype=bool)
+        fog_structures = np.asarray(_observation["structures_in_fog"], dtype=bool)
+
+        codes = np.full(armies.shape, PASSABLE_CODE, dtype=np.int8)
+        codes[np.asarray(_observation["cities"], dtype=bool)] = MAX_CITY_ARMY
+        codes[np.asarray(_observation["mountains"], dtype=bool) | fog_structures] = MOUNTAIN_CODE
+        own_general = np.argwhere(generals & owned)[0]
+        codes[tuple(own_general)] = GENERAL_CODE
+
+        visible_generals = np.argwhere(generals & ~owned)
+        if len(visible_generals) > 0:
+            opponent_general = visible_generals[0]
+        else:
+            # The opponent general is unseen, guess the fog cell farthest from our general, preferably a reachable one.
+            # Without fog (e.g. the opponent was defeated) it is guessed among reachable cells, preferably not ours
+            components, _ = Grid.connected_components(codes)
+            reachable = components == components[tuple(own_general)]
+            reachable[tuple(own_general)] = False
+            fog = np.asarray(_observation["fog_cells"], dtype=bool)
+            candidates = next(mask for mask in [fog & reachable, fog, reachable & ~owned, reachable] if mask.any())
+            cells = np.argwhere(candidates)
+            opponent_general = cells[np.argmax(np.abs(cells - own_general).sum(axis=1))]
+            owned, opponent_cells = owned.copy(), opponent_cells.copy()
+            owned[tuple(opponent_general)], opponent_cells[tuple(opponent_general)] = False, True
+            # Army of the opponent we do not see is kept in its general
+            hidden_army = int(_observation["opponent_army_count"]) - int(armies[opponent_cells].sum())
+            armies[tuple(opponent_general)] = max(hidden_army, 1)
+        if not Grid.verify_grid_connectivity(_with_general(codes, opponent_general)):
+            # Structures in fog separate the generals, some of them are cities then
+            codes[fog_structures] = MAX_CITY_ARMY
+            armies[fog_structures] = MAX_CITY_ARMY
+
+        opponent = "opponent" if self.id != "opponent" else "opponent_"
+        model = ForwardModel(Grid(_with_general(codes, opponent_general)), [self.id, opponent])
+        model.channels.owners = np.where(owned, 1, np.where(opponent_cells, 2, 0))
+        model.channels.armies = armies
+        model.time = int(_observation["timestep"])
+        if not _observation["priority"]:
+            model.agent_order = model.agent_order[::-1]
+        return model
+
+
+def _with_general(codes: np.ndarray, general: np.ndarray) -> np.ndarray:
+    codes = codes.copy()
+    codes[tuple(general)] = GENERAL_CODE - 1
+    return codes
+
+
+def _rollout(model: ForwardModel, agent: str, policy: type[Agent], depth: int, seed: int) -> float:
+    """
+    Plays `depth` turns by the policy on both sides and returns the value of the reached state for the agent.
+    """
+    rng = np.random.default_rng(seed)
+    policies = {id: policy(id=id, seed=rng.integers(2**32)) for id in model.agents}
+    observations = {id: Observation.allocate(model.grid_dims) for id in model.agents}
+    for _ in range(depth):
+        if model.is_done():
+            break
+        actions = {
+            id: policies[id].act(model.agent_observation(id, out=observations[id]).as_dict()) for id in model.agents
+        }
+        model.apply_actions(actions)
+    return evaluate(model, agent)
+
+
+def evaluate(model: ForwardModel, agent: str) -> float:
+    """
+    Value of a state for an agent in [0, 1], 1 for a win, 0 for a loss and otherwise
+    the mean of its shares of army and land of both agents.
+    """
+    if model.is_done():
+        return float(model.agent_won(agent))
+    army, land = model.channels.player_stats()
+    indices = [model.channels.owner_index(id) for id in model.agents]
+    agent_index = model.channels.owner_index(agent)
+    army_share = army[agent_index] / max(int(army[indices].sum()), 1)
+    land_share = land[agent_index] / max(int(land[indices].sum()), 1)
+    return float(army_share + land_share) / 2
@@ -1,3 +1,5 @@
+from typing import Any
+
 import numpy as np
 
 from generals.core.game import Action
@@ -13,8 +15,9 @@ class RandomAgent(Agent):
         color: tuple[int, int, int] = (242, 61, 106),
         split_prob: float = 0.25,
         idle_prob: float = 0.05,
+        seed: int | None = None,
     ):
-        super().__init__(id, color)
+        super().__init__(id, color, seed)
 
         self.idle_probability = idle_prob
         self.split_probability = split_prob
@@ -23,21 +26,32 @@ class RandomAgent(Agent):
         """
         Randomly selects a valid action.
         """
-        mask = observation["action_mask"]
-        observation = observation["observation"]
-
-        valid_actions = np.argwhere(mask == 1)
+        mask = np.asarray(observation["action_mask"])
+        valid_actions = np.flatnonzero(mask)
         if len(valid_actions) == 0:  # No valid actions
-            return [1, 0, 0, 0, 0]
-        pass_turn = 0 if np.random.rand() > self.idle_probability else 1
-        split_army = 0 if np.random.rand() > self.split_probability else 1
-
-        action_index = np.random.choice(len(valid_actions))
-        cell = valid_actions[action_index][:2]
-        direction = valid_actions[action_index][2]
+            return np.array([1, 0, 0, 0, 0])
+        i, j, direction = np.unravel_index(valid_actions[self.rng.integers(len(valid_actions))], mask.shape)
+        pass_turn = int(self.rng.random() < self.idle_probability)
+        split_army = int(self.rng.random() < self.split_probability)
+        return np.array([pass_turn, i, j, direction, split_army])
 
-        action = [pass_turn, cell[0], cell[1], direction, split_army]
-        return action
+    def act_batch(self, observation: dict[str, Any]) -> np.ndarray:
+        """
+        Randomly selects a valid action in each game of a batch.
+        """
+        mask = observation["action_mask"]
+        n_games = len(mask)
+        flat_mask = mask.reshape(n_games, -1).astype(bool)
+
+        # The valid action with the highest random score is a uniformly random valid action
+        scores = np.where(flat_mask, self.rng.random(flat_mask.shape), -1)
+        i, j, direction = np.unravel_index(np.argmax(scores, axis=1), mask.shape[1:])
+        pass_turn = (self.rng.random(n_games) < self.idle_probability).astype(int)
+        split_army = (self.rng.random(n_games) < self.split_probability).astype(int)
+
+        actions = np.stack([pass_turn, i, j, direction, split_army], axis=1)
+        actions[~flat_mask.any(axis=1)] = [1, 0, 0, 0, 0]  # No valid actions
+        return actions
 
     def reset(self):
         pass
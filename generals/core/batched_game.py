@@ -0,0 +1,241 @@
+from typing import Any, TypeAlias
+
+import numpy as np
+from scipy.ndimage import maximum_filter  # type: ignore
+
+from .channels import NEUTRAL_OWNER, Channels
+from .config import DIRECTIONS, GENERAL_CODE
+from .grid import Grid
+from .observation import compute_action_mask
+
+# Type aliases
+BatchedAction: TypeAlias = np.ndarray  # (B, 5) array of actions, one per game
+BatchedInfo: TypeAlias = dict[str, np.ndarray]
+
+# Row and column offsets of each direction, indexed by direction id
+DIRECTION_OFFSETS = np.array([direction.value for direction in DIRECTIONS], dtype=int)
+
+
+class BatchedGame:
+    """
+    Vectorized version of `Game` that advances B independent games at once.
+
+    All games share the same grid dimensions and agents. The state of every game
+    is held in stacked (B, H, W) arrays and moves, combat, army growth and win checks
+    are resolved for all games with a fixed number of numpy operations per step.
+
+    armies - army size in each cell
+    owners - owner of each cell (0 is neutral, i + 1 is the i-th agent)
+    generals, mountains, cities, passable - static masks of the map
+    """
+
+    def __init__(self, grids: list[Grid], agents: list[str]):
+        assert len(grids) > 0, "At least one grid is required."
+        assert len(agents) == 2, "BatchedGame supports exactly two agents."
+
+        # Agents
+        self.agents = agents
+
+        # Grids
+        self.n_games = len(grids)
+        self.grid_dims = (grids[0].codes.shape[0], grids[0].codes.shape[1])
+        batch_dims = (self.n_games,) + self.grid_dims
+        self.armies = np.zeros(batch_dims, dtype=int)
+        self.owners = np.zeros(batch_dims, dtype=np.int8)
+        self.generals = np.zeros(batch_dims, dtype=bool)
+        self.mountains = np.zeros(batch_dims, dtype=bool)
+        self.cities = np.zeros(batch_dims, dtype=bool)
+        self.passable = np.zeros(batch_dims, dtype=bool)
+        self.passable_directions = np.zeros(batch_dims + (4,), dtype=bool)
+        self.general_positions = np.zeros((self.n_games, len(agents), 2), dtype=int)
+
+        # Time stuff, agent_order[b] holds indices of agents in order of their priority in game b
+        self.time = np.zeros(self.n_games, dtype=int)
+        self.agent_order = np.tile(np.arange(len(agents)), (self.n_games, 1))
+        self.increment_rate = 50
+
+        # Limits
+        self.max_army_value = 100_000
+        self.max_land_value = np.prod(self.grid_dims)
+        self.max_timestep = 100_000
+
+        self._game_indices = np.arange(self.n_games)
+        for index, grid in enumerate(grids):
+            self.reset_game(index, grid)
+
+    def reset_game(self, index: int, grid: Grid) -> None:
+        """
+        Start a new game on a given grid in place of game `index`.
+        """
+        codes = grid.codes
+        assert codes.shape == self.grid_dims, "All grids in a batch must have the same dimensions."
+        channels = Channels(codes, self.agents)
+        self.armies[index] = channels.armies
+        self.generals[index] = channels.generals
+        self.mountains[index] = channels.mountains
+        self.cities[index] = channels.cities
+        self.passable[index] = channels.passable
+        self.passable_directions[index] = channels.passable_directions
+        self.owners[index] = channels.owners
+        for i in range(len(self.agents)):
+            self.general_positions[index, i] = np.argwhere(codes == GENERAL_CODE - i)[0]
+        self.time[index] = 0
+        self.agent_order[index] = np.arange(len(self.agents))
+
+    def step(self, actions: dict[str, BatchedAction], active: np.ndarray | None = None) -> dict[str, BatchedInfo]:
+        """
+        Perform one step of all games.
+
+        Actions are given per agent as (B, 5) arrays in the same format as in `Game.step`.
+        Unlike `Game.step`, observations are not built here, use `agent_observation` to obtain them.
+        If (B,) mask `active` is given, only games marked in it are stepped, the others are left untouched.
+        """
+        games = self._game_indices
+        active = np.ones(self.n_games, dtype=bool) if active is None else np.asarray(active, dtype=bool)
+        done_before_actions = self.is_done()
+
+        # Process validity of moves, whether agents want to pass the turn,
+        # and calculate intended amount of army to move (all available or split)
+        moves = np.stack([np.asarray(actions[agent], dtype=int) for agent in self.agents], axis=1)
+        pass_turn, source_i, source_j, direction, split_army = np.moveaxis(moves, -1, 0)
+        source_army = self.armies[games[:, None], source_i, source_j]
+        intended_army = np.where(split_army == 1, source_army // 2, source_army - 1)
+        wants_to_move = (pass_turn != 1) & (intended_army >= 1) & active[:, None]
+
+        for priority in range(len(self.agents)):
+            agent = self.agent_order[:, priority]
+            si, sj = source_i[games, agent], source_j[games, agent]
+
+            # Cap the amount of army to move (previous moves may have lowered available army)
+            army_to_move = np.minimum(intended_army[games, agent], self.armies[games, si, sj] - 1)
+            army_to_stay = self.armies[games, si, sj] - army_to_move
+
+            # Agent must still own the source cell and the destination must be passable and in bounds
+            di = si + DIRECTION_OFFSETS[direction[games, agent], 0]
+            dj = sj + DIRECTION_OFFSETS[direction[games, agent], 1]
+            in_bounds = (di >= 0) & (di < self.grid_dims[0]) & (dj >= 0) & (dj < self.grid_dims[1])
+            di, dj = np.where(in_bounds, di, 0), np.where(in_bounds, dj, 0)
+            valid = (
+                wants_to_move[games, agent]
+                & (self.owners[games, si, sj] == agent + 1)
+                & (army_to_move >= 1)
+                & in_bounds
+                & self.passable[games, di, dj]
+            )
+
+            b = games[valid]
+            si, sj, di, dj = si[valid], sj[valid], di[valid], dj[valid]
+            army_to_move, army_to_stay, mover = army_to_move[valid], army_to_stay[valid], agent[valid] + 1
+
+            # Resolve the fight for the destination cell
+            target_army = self.armies[b, di, dj]
+            target_owner = self.owners[b, di, dj]
+            owned_target = target_owner == mover
+            captured = owned_target | (target_army < army_to_move)
+            self.armies[b, di, dj] = np.where(
+                owned_target, target_army + army_to_move, np.abs(target_army - army_to_move)
+            )
+            self.armies[b, si, sj] = army_to_stay
+            self.owners[b, di, dj] = np.where(captured, mover, target_owner)
+
+        # Swap agent order (because priority is alternating)
+        self.agent_order = np.where(active[:, None], self.agent_order[:, ::-1], self.agent_order)
+
+        self.time += ~done_before_actions & active
+
+        done = self.is_done()
+        # give all cells of loser to winner
+        winner = np.where(self.agent_won(self.agents[0]), 1, 2)
+        transfer = done[:, None, None] & (self.owners != NEUTRAL_OWNER)
+        self.owners = np.where(transfer, winner[:, None, None], self.owners).astype(np.int8)
+        self._global_game_update(~done & active)
+
+        return self.get_infos()
+
+    def _global_game_update(self, active: np.ndarray) -> None:
+        """
+        Update state of active games globally.
+        """
+        owned = self.owners != NEUTRAL_OWNER
+
+        # every `increment_rate` steps, increase army size in each cell
+        land_update = active & (self.time % self.increment_rate == 0)
+        self.armies += owned & land_update[:, None, None]
+
+        # Increment armies on general and city cells, but only if they are owned by player
+        structure_update = active & (self.time % 2 == 0) & (self.time > 0)
+        self.armies += owned & (self.generals | self.cities) & structure_update[:, None, None]
+
+    def agent_won(self, agent: str) -> np.ndarray:
+        """
+        Returns (B,) mask of games won by the agent.
+        """
+        owner = self.agents.index(agent) + 1
+        positions = self.general_positions
+        general_owners = self.owners[self._game_indices[:, None], positions[..., 0], positions[..., 1]]
+        return np.all(general_owners == owner, axis=1)
+
+    def is_done(self) -> np.ndarray:
+        """
+        Returns (B,) mask of games that are over.
+        """
+        return np.logical_or.reduce([self.agent_won(agent) for agent in self.agents])
+
+    def get_infos(self) -> dict[str, BatchedInfo]:
+        """
+        Returns a dictionary of player statistics with the same keys as `Game.get_infos`,
+        where each value is a (B,) array.
+        """
+        players_stats = {}
+        for i, agent in enumerate(self.agents):
+            ownership = self.owners == i + 1
+            players_stats[agent] = {
+                "army": np.sum(self.armies * ownership, axis=(1, 2)),
+                "land": np.sum(ownership, axis=(1, 2)),
+                "is_winner": self.agent_won(agent),
+            }
+        return players_stats
+
+    def get_visibility(self, agent: str) -> np.ndarray:
+        ownership = self.owners == self.agents.index(agent) + 1
+        return maximum_filter(ownership, size=(1, 3, 3)).astype(bool)
+
+    def action_mask(self, agent: str) -> np.ndarray:
+        """
+        Returns (B, H, W, 4) mask of valid actions of the agent in all games.
+        """
+        owned_cells = self.owners == self.agents.index(agent) + 1
+        return compute_action_mask(self.armies, owned_cells, self.passable_directions)
+
+    def agent_observation(self, agent: str) -> dict[str, Any]:
+        """
+        Returns stacked observations of a given agent in all games.
+        Keys are the same as in `Observation.as_dict(with_mask=False)`, grids have
+        shape (B, H, W) and scalars have shape (B,).
+        """
+        agent_index = self.agents.index(agent)
+        opponent_index = 1 - agent_index
+        infos = self.get_infos()
+        opponent = self.agents[opponent_index]
+
+        visible = self.get_visibility(agent)
+        invisible = ~visible
+        structures_in_fog = invisible & (self.mountains | self.cities)
+
+        return {
+            "armies": self.armies * visible,
+            "generals": self.generals & visible,
+            "cities": self.cities & visible,
+            "mountains": self.mountains & visible,
+            "neutral_cells": (self.owners == NEUTRAL_OWNER) & self.passable & visible,
+            "owned_cells": (self.owners == agent_index + 1) & visible,
+            "opponent_cells": (self.owners == opponent_index + 1) & visible,
+            "fog_cells": invisible & ~structures_in_fog,
+            "structures_in_fog": structures_in_fog,
+            "owned_land_count": infos[agent]["land"],
+            "owned_army_count": infos[agent]["army"],
+            "opponent_land_count": infos[opponent]["land"],
+            "opponent_army_count": infos[opponent]["army"],
+            "timestep": self.time.copy(),
+            "priority": (self.agent_order[:, 0] == agent_index).astype(int),
+        }
@@ -1,9 +1,22 @@
+from collections.abc import Iterator, Mapping
+
 import numpy as np
-from scipy.ndimage import maximum_filter  # type: ignore
+from scipy.ndimage import correlate  # type: ignore
+
+from .config import GENERAL_CODE, MIN_CITY_ARMY, MOUNTAIN_CODE
+from .hashing import MASK_64, compute_hash, zobrist_keys
+from .observation import compute_passable_directions
 
-from .config import MOUNTAIN, PASSABLE
+NEUTRAL_OWNER = 0  # Owner index of neutral cells, i-th agent has owner index i + 1
 
-valid_generals = ["A", "B"]  # Generals are represented by A and B
+# Fields of the state buffer of `Channels`, each is stored in attribute with a leading underscore
+STATE_FIELDS = ("armies", "army_counts", "land_counts", "owners", "visibility_counts", "visibility", "hash")
+# Fields exposed by properties as read-only views, stored in attributes `_<field>_readonly`
+READONLY_FIELDS = ("armies", "owners")
+
+# Values of the `structure_types` channel
+NO_STRUCTURE, GENERAL_STRUCTURE, CITY_STRUCTURE, MOUNTAIN_STRUCTURE = 0, 1, 2, 3
+N_STRUCTURE_TYPES = 4
 
 
 class Channels:
@@ -13,33 +26,312 @@ class Channels:
     mountains - mountain mask (1 if cell is mountain, 0 otherwise)
     cities - city mask (1 if cell is city, 0 otherwise)
     passable - passable mask (1 if cell is passable, 0 otherwise)
+    owners - owner index of each cell (0 if cell is neutral or mountain, i + 1 if i-th agent owns it)
     ownership_i - ownership mask for player i (1 if player i owns cell, 0 otherwise)
     ownership_neutral - ownership mask for neutral cells that are
     passable (1 if cell is neutral, 0 otherwise)
+
+    Ownership masks are derived from the `owners` channel on access.
+    Visibility of every agent is maintained incrementally as cells change owners.
+
+    `armies` and `owners` are read-only views, because player stats, visibility and the hash follow every change
+    of cells. Change cells by `set_cell` or by assigning whole channels, e.g. `channels.armies = armies`.
+
+    Everything that changes during a game (armies, owners, visibility and player stats) are views
+    into one contiguous state buffer, so `snapshot` and `restore` copy a single block of memory.
+    Static channels (generals, mountains, cities, passable) are not part of the state.
+
+    The state also holds a Zobrist-style hash of armies, owners and structures of all cells
+    (see `generals.core.hashing.ZobristKeys`), which is updated incrementally as cells change.
     """
 
+    # Views into the state buffer `_state`, see `STATE_FIELDS`
+    _state: np.ndarray
+    _armies: np.ndarray
+    _army_counts: np.ndarray
+    _land_counts: np.ndarray
+    _owners: np.ndarray
+    _visibility_counts: np.ndarray
+    _visibility: np.ndarray
+    _hash: np.ndarray
+    _armies_readonly: np.ndarray
+    _owners_readonly: np.ndarray
+
     def __init__(self, grid: np.ndarray, _agents: list[str]):
-        self._armies: np.ndarray = np.where(np.isin(grid, valid_generals), 1, 0).astype(int)
-        self._generals: np.ndarray = np.where(np.isin(grid, valid_generals), 1, 0).astype(bool)
-        self._mountains: np.ndarray = np.where(grid == MOUNTAIN, 1, 0).astype(bool)
-        self._passable: np.ndarray = (grid != MOUNTAIN).astype(bool)
-        self._cities: np.ndarray = np.where(np.char.isdigit(grid), 1, 0).astype(bool)
-        self._cities = (self._cities + np.where(grid == "x", 1, 0)).astype(bool)  # city with value 50 is marked as x
-
-        self._ownership: dict[str, np.ndarray] = {
-            "neutral": ((grid == PASSABLE) | (np.char.isdigit(grid)) | (grid == "x")).astype(bool)
-        }
+        """
+        Args:
+            grid: (H, W) int8 cell codes of a grid, see `Grid.encode_grid`
+            _agents: ids of agents, i-th agent starts at the general coded as GENERAL_CODE - i
+        """
+        self._generals: np.ndarray = grid <= GENERAL_CODE
+        self._mountains: np.ndarray = grid == MOUNTAIN_CODE
+        self._passable: np.ndarray = ~self._mountains
+        self._passable_directions: np.ndarray = compute_passable_directions(self._passable)
+        self._cities: np.ndarray = grid >= MIN_CITY_ARMY
+
+        self._owner_indices: dict[str, int] = {"neutral": NEUTRAL_OWNER}
         for i, agent in enumerate(_agents):
-            self._ownership[agent] = np.where(grid == chr(ord("A") + i), 1, 0).astype(bool)
+            self._owner_indices[agent] = i + 1
+        self._allocate_state(grid.shape)
+        for i in range(len(_agents)):
+            self._owners[grid == GENERAL_CODE - i] = i + 1
+
+        # Generals start with 1 army, cities are coded by their initial army
+        self._armies[...] = np.where(self._cities, grid, self._generals)
+
+        self._structure_indices: np.ndarray = np.flatnonzero(self._generals | self._cities)
+        self._structure_types: np.ndarray = self.compute_structure_types()
+        self._reset_player_stats()
+        self.recompute_visibility()
+        self._hash[0] = self.recompute_hash()
+
+    def _allocate_state(self, shape: tuple[int, ...]) -> None:
+        """
+        Allocates a zeroed state buffer for the grid shape and current owners, and binds its fields.
+        """
+        n_owners = len(self._owner_indices)
+        agents_shape = (n_owners - 1,) + tuple(shape)
+        dtype = np.dtype(
+            [
+                ("armies", np.int64, shape),
+                ("army_counts", np.int64, (n_owners,)),
+                ("land_counts", np.int64, (n_owners,)),
+                ("owners", np.int8, shape),
+                ("visibility_counts", np.int8, agents_shape),
+                ("visibility", np.bool_, agents_shape),
+                ("hash", np.uint64, (1,)),
+            ]
+        )
+        self._bind_state(np.zeros((), dtype=dtype))
+
+    def _bind_state(self, state: np.ndarray) -> None:
+        """
+        Makes fields of a state buffer, e.g. `_armies` or `_owners`, views into the buffer.
+        """
+        self._state = state
+        for name in STATE_FIELDS:
+            setattr(self, "_" + name, state[name])
+        for name in READONLY_FIELDS:
+            view = state[name].view()
+            view.flags.writeable = False
+            setattr(self, f"_{name}_readonly", view)
+
+    def _reset_player_stats(self) -> None:
+        self._army_counts[...], self._land_counts[...] = self.recompute_player_stats()
+
+    def snapshot(self) -> np.ndarray:
+        """
+        Returns a copy of the state buffer, see `restore`.
+        """
+        return self._state.copy()
+
+    def restore(self, snapshot: np.ndarray) -> None:
+        """
+        Restores state saved by `snapshot` of these (or equally shaped) channels in place.
+        """
+        np.copyto(self._state, snapshot)
+
+    def copy(self) -> "Channels":
+        """
+        Returns channels with a copy of the state, static channels are shared.
+        """
+        channels = Channels.__new__(Channels)
+        channels.__dict__.update(self.__dict__)
+        channels._bind_state(self.snapshot())
+        return channels
+
+    def __getstate__(self) -> dict:
+        # Fields are views into the state buffer, they are bound again when unpickled
+        return {
+            key: value
+            for key, value in self.__dict__.items()
+            if key.removeprefix("_").removesuffix("_readonly") not in STATE_FIELDS
+        }
 
-        # City costs are 40 + digit in the cell
-        city_costs = np.where(np.char.isdigit(grid), grid, "0").astype(int)
-        city_costs += np.where(grid == "x", 10, 0)
-        self.armies += 40 * self.cities + city_costs
+    def __setstate__(self, state: dict) -> None:
+        if "_state" in state:
+            self.__dict__.update(state)
+            self._bind_state(self._state)
+            return
+
+        # Channels pickled before the introduction of the owners channel store a dict of ownership masks
+        if "_ownership" in state:
+            ownership = state.pop("_ownership")
+            state["_owner_indices"] = {owner: i for i, owner in enumerate(ownership)}
+            state["_owners"] = np.zeros(state["_armies"].shape, dtype=np.int8)
+            for owner, mask in ownership.items():
+                if owner != "neutral":
+                    state["_owners"][mask.astype(bool)] = state["_owner_indices"][owner]
+        self.__dict__.update(state)
+        # Running player stats and structure indices are not stored in older pickles either
+        if "_army_counts" not in state:
+            self._structure_indices = np.flatnonzero(self._generals | self._cities)
+            self._army_counts, self._land_counts = self.recompute_player_stats()
+        if "_visibility" not in state:
+            self.recompute_visibility()
+        if "_passable_directions" not in state:
+            self._passable_directions = compute_passable_directions(self._passable)
+        if "_structure_types" not in state:
+            self._structure_types = self.compute_structure_types()
+        # Older pickles store separate arrays, move them into a state buffer
+        fields = {name: getattr(self, "_" + name) for name in STATE_FIELDS if name != "hash"}
+        self._allocate_state(fields["armies"].shape)
+        for name, value in fields.items():
+            getattr(self, "_" + name)[...] = value
+        self._hash[0] = self.recompute_hash()
 
     def get_visibility(self, agent_id: str) -> np.ndarray:
-        channel = self._ownership[agent_id]
-        return maximum_filter(channel, size=3).astype(bool)
+        """
+        Returns a read-only mask of cells visible to the agent,
+        i.e. cells owned by the agent and their 8 neighbours.
+        """
+        visibility = self._visibility[self._owner_indices[agent_id] - 1].view()
+        visibility.flags.writeable = False
+        return visibility
+
+    def recompute_visibility(self) -> None:
+        """
+        Computes visibility of all agents from scratch.
+
+        For every agent we keep a count of owned cells in the 3x3 neighbourhood
+        of each cell, so that a change of owner updates only the 3x3 window around it.
+        """
+        n_agents = len(self._owner_indices) - 1
+        if "_state" not in self.__dict__:
+            # Unpickling older channels, the state buffer is allocated afterwards
+            self._visibility_counts = np.zeros((n_agents,) + self._owners.shape, dtype=np.int8)
+            self._visibility = np.zeros((n_agents,) + self._owners.shape, dtype=np.bool_)
+        for agent_index in range(n_agents):
+            ownership = (self._owners == agent_index + 1).astype(np.int8)
+            self._visibility_counts[agent_index] = correlate(ownership, np.ones((3, 3), dtype=np.int8), mode="constant")
+        np.greater(self._visibility_counts, 0, out=self._visibility)
+
+    def _update_visibility(self, i: int, j: int, old_owner: int, new_owner: int) -> None:
+        window = (slice(max(i - 1, 0), i + 2), slice(max(j - 1, 0), j + 2))
+        for owner, change in ((old_owner, -1), (new_owner, 1)):
+            if owner == NEUTRAL_OWNER:
+                continue
+            counts = self._visibility_counts[owner - 1]
+            counts[window] += change
+            self._visibility[owner - 1][window] = counts[window] > 0
+
+    def owner_index(self, owner: str) -> int:
+        """
+        Returns index of an owner ("neutral" or agent id) in the `owners` channel.
+        """
+        return self._owner_indices[owner]
+
+    @property
+    def owner_indices(self) -> dict[str, int]:
+        return self._owner_indices
+
+    def player_stats(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns total army and land of every owner, indexed by owner index.
+        Totals are maintained incrementally, so this is O(1).
+        """
+        return self._army_counts, self._land_counts
+
+    def recompute_player_stats(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Computes total army and land of every owner from scratch.
+        """
+        owners = self._owners.ravel()
+        minlength = len(self._owner_indices)
+        army = np.bincount(owners, weights=self._armies.ravel(), minlength=minlength).astype(int)
+        land = np.bincount(owners, minlength=minlength)
+        return army, land
+
+    def verify_player_stats(self) -> None:
+        """
+        Checks that running player stats match stats computed from scratch.
+        """
+        army, land = self.recompute_player_stats()
+        assert (army == self._army_counts).all(), f"Army totals {self._army_counts} do not match {army}"
+        assert (land == self._land_counts).all(), f"Land totals {self._land_counts} do not match {land}"
+
+    @property
+    def state_hash(self) -> int:
+        """
+        Zobrist hash of armies and owners of all cells (and the static structures), maintained incrementally.
+        """
+        return int(self._hash[0])
+
+    def recompute_hash(self) -> int:
+        """
+        Computes the hash of all cells from scratch, see `state_hash`.
+        """
+        keys = zobrist_keys(self._armies.shape)
+        return compute_hash(keys, self._armies, self._owners, self._structure_types)
+
+    def verify_hash(self) -> None:
+        """
+        Checks that the running state hash matches the hash computed from scratch.
+        """
+        state_hash = self.recompute_hash()
+        assert self.state_hash == state_hash, f"State hash {self.state_hash} does not match {state_hash}"
+
+    def set_cell(self, i: int, j: int, army: int, owner: int) -> None:
+        """
+        Sets army and owner index of a cell and updates player stats and hash accordingly.
+        """
+        old_owner = self._owners[i, j]
+        keys = zobrist_keys(self._armies.shape)
+        hash_change = int(keys.army[i, j]) * (int(army) - int(self._armies[i, j]))
+        hash_change += int(keys.owner[i, j, owner]) - int(keys.owner[i, j, old_owner])
+        self._hash[0] = (int(self._hash[0]) + hash_change) & MASK_64
+        self._army_counts[old_owner] -= self._armies[i, j]
+        self._land_counts[old_owner] -= 1
+        self._armies[i, j] = army
+        self._owners[i, j] = owner
+        self._army_counts[owner] += army
+        self._land_counts[owner] += 1
+        if old_owner != owner:
+            self._update_visibility(i, j, old_owner, owner)
+
+    def transfer_cells(self, old_owner: int, new_owner: int) -> None:
+        """
+        Gives all cells of one owner to another owner.
+        """
+        self._owners[self._owners == old_owner] = new_owner
+        self._army_counts[new_owner] += self._army_counts[old_owner]
+        self._land_counts[new_owner] += self._land_counts[old_owner]
+        self._army_counts[old_owner] = 0
+        self._land_counts[old_owner] = 0
+        self.recompute_visibility()
+        self._hash[0] = self.recompute_hash()
+
+    def increment_land_armies(self, amount: int = 1) -> None:
+        """
+        Adds `amount` armies to every cell owned by an agent.
+        """
+        owned = self._owners != NEUTRAL_OWNER
+        self._armies += owned * amount
+        keys_sum = int(np.sum(zobrist_keys(self._armies.shape).army[owned], dtype=np.uint64))
+        self._hash[0] = (int(self._hash[0]) + keys_sum * amount) & MASK_64
+        self._army_counts[NEUTRAL_OWNER + 1 :] += self._land_counts[NEUTRAL_OWNER + 1 :] * amount
+
+    def increment_structure_armies(self, amount: int = 1) -> None:
+        """
+        Adds `amount` armies to every general and city owned by an agent.
+        """
+        structure_owners = self._owners.flat[self._structure_indices]
+        owned = structure_owners != NEUTRAL_OWNER
+        indices = self._structure_indices[owned]
+        self._armies.flat[indices] += amount
+        keys_sum = int(np.sum(zobrist_keys(self._armies.shape).army.flat[indices], dtype=np.uint64))
+        self._hash[0] = (int(self._hash[0]) + keys_sum * amount) & MASK_64
+        self._army_counts += np.bincount(structure_owners[owned], minlength=len(self._army_counts)) * amount
+
+    def compute_structure_types(self) -> np.ndarray:
+        """
+        Returns type of structure in each cell, see `structure_types`.
+        """
+        structure_types = np.zeros(self._armies.shape, dtype=np.int8)
+        structure_types[self._generals.astype(bool)] = GENERAL_STRUCTURE
+        structure_types[self._cities.astype(bool)] = CITY_STRUCTURE
+        structure_types[self._mountains.astype(bool)] = MOUNTAIN_STRUCTURE
+        return structure_types
 
     @staticmethod
     def channel_to_indices(channel: np.ndarray) -> np.ndarray:
@@ -49,20 +341,35 @@ class Channels:
         return np.argwhere(channel != 0)
 
     @property
-    def ownership(self) -> dict[str, np.ndarray]:
-        return self._ownership
+    def owners(self) -> np.ndarray:
+        return self._owners_readonly
+
+    @owners.setter
+    def owners(self, value):
+        self._owners[...] = value
+        self._reset_player_stats()
+        self.recompute_visibility()
+        self._hash[0] = self.recompute_hash()
+
+    @property
+    def ownership(self) -> "Ownership":
+        return Ownership(self)
 
     @ownership.setter
     def ownership(self, value):
-        self._ownership = value
+        ownership = self.ownership
+        for owner, mask in value.items():
+            ownership[owner] = mask
 
     @property
     def armies(self) -> np.ndarray:
-        return self._armies
+        return self._armies_readonly
 
     @armies.setter
     def armies(self, value):
-        self._armies = value
+        self._armies[...] = value
+        self._reset_player_stats()
+        self._hash[0] = self.recompute_hash()
 
     @property
     def generals(self) -> np.ndarray:
@@ -71,6 +378,9 @@ class Channels:
     @generals.setter
     def generals(self, value):
         self._generals = value
+        self._structure_types = self.compute_structure_types()
+        self._hash[0] = self.recompute_hash()
+        self._structure_indices = np.flatnonzero(self._generals | self._cities)
 
     @property
     def mountains(self) -> np.ndarray:
@@ -79,6 +389,8 @@ class Channels:
     @mountains.setter
     def mountains(self, value):
         self._mountains = value
+        self._structure_types = self.compute_structure_types()
+        self._hash[0] = self.recompute_hash()
 
     @property
     def cities(self) -> np.ndarray:
@@ -87,6 +399,9 @@ class Channels:
     @cities.setter
     def cities(self, value):
         self._cities = value
+        self._structure_types = self.compute_structure_types()
+        self._hash[0] = self.recompute_hash()
+        self._structure_indices = np.flatnonzero(self._generals | self._cities)
 
     @property
     def passable(self) -> np.ndarray:
@@ -95,11 +410,63 @@ class Channels:
     @passable.setter
     def passable(self, value):
         self._passable = value
+        self._passable_directions = compute_passable_directions(self._passable)
+
+    @property
+    def structure_types(self) -> np.ndarray:
+        """
+        Type of structure in each cell, 0 for no structure, 1 for general, 2 for city and 3 for mountain.
+        """
+        return self._structure_types
+
+    @property
+    def passable_directions(self) -> np.ndarray:
+        """
+        (H, W, 4) mask telling whether a move from a cell in a given direction
+        stays in the grid and lands on a passable cell.
+        """
+        return self._passable_directions
 
     @property
     def ownership_neutral(self) -> np.ndarray:
-        return self._ownership["neutral"]
+        return self.ownership["neutral"]
 
     @ownership_neutral.setter
     def ownership_neutral(self, value):
-        self._ownership["neutral"] = value
+        self.ownership["neutral"] = value
+
+
+class Ownership(Mapping):
+    """
+    Dictionary-like view of ownership masks derived from the `owners` channel.
+
+    Masks are computed on access and returned read-only, writing into them (e.g. `ownership[agent][i, j] = 1`)
+    raises an error. Assigning a mask to an owner makes the owner own exactly the cells of the mask.
+    """
+
+    def __init__(self, channels: Channels):
+        self._channels = channels
+
+    def __getitem__(self, owner: str) -> np.ndarray:
+        index = self._channels.owner_index(owner)
+        mask = self._channels.owners == index
+        if index == NEUTRAL_OWNER:
+            mask &= self._channels.passable
+        # Masks are copies, so in-place writes would be silently lost
+        mask.flags.writeable = False
+        return mask
+
+    def __setitem__(self, owner: str, mask: np.ndarray) -> None:
+        index = self._channels.owner_index(owner)
+        mask = np.asarray(mask).astype(bool)
+        owners = self._channels.owners.copy()
+        if index != NEUTRAL_OWNER:
+            owners[(owners == index) & ~mask] = NEUTRAL_OWNER
+        owners[mask] = index
+        self._channels.owners = owners
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._channels.owner_indices)
+
+    def __len__(self) -> int:
+        return len(self._channels.owner_indices)
@@ -6,6 +6,12 @@ from typing import Literal
 PASSABLE: Literal["."] = "."
 MOUNTAIN: Literal["#"] = "#"
 
+# Integer codes of grid cells, cities are coded by their initial army (40 - 50)
+PASSABLE_CODE = 0
+MOUNTAIN_CODE = -1
+GENERAL_CODE = -2  # i-th general is coded as GENERAL_CODE - i
+MIN_CITY_ARMY, MAX_CITY_ARMY = 40, 50
+
 
 class Dimension(IntEnum):
     SQUARE_SIZE = 50
@@ -1,30 +1,75 @@
-from typing import Any, TypeAlias
+from collections.abc import Sequence
+from typing import Any, NamedTuple, TypeAlias
 
 import gymnasium as gym
 import numpy as np
 
-from .channels import Channels
-from .config import DIRECTIONS
+from .batched_game import DIRECTION_OFFSETS
+from .channels import CITY_STRUCTURE, GENERAL_STRUCTURE, MOUNTAIN_STRUCTURE, N_STRUCTURE_TYPES, NEUTRAL_OWNER, Channels
+from .config import DIRECTIONS, GENERAL_CODE
 from .grid import Grid
-from .observation import Observation
+from .hashing import AGENT_ORDER_KEY, FOG_OWNER, MASK_64, STATS_KEYS, TIME_PARITY_KEY, compute_hash, zobrist_keys
+from .observation import OBSERVATION_CHANNELS, Observation, compute_action_mask
 
 # Type aliases
 Action: TypeAlias = np.ndarray
 Info: TypeAlias = dict[str, Any]
 
 
+class GameSnapshot(NamedTuple):
+    """
+    State of a game saved by `Game.snapshot`.
+    """
+
+    state: np.ndarray  # copy of the state buffer of channels, see `Channels.snapshot`
+    time: int
+    agent_order: tuple[str, ...]
+
+
+class MoveOutcomes(NamedTuple):
+    """
+    Outcomes of N candidate moves of one agent evaluated by `Game.lookahead`, each is the state after
+    a step in which the agent makes the move and the other agent passes. A move changes only its source
+    and destination cell (apart from army growth of all owned cells and the transfer of cells at the end of a game).
+    """
+
+    actions: np.ndarray  # (N, 5) evaluated actions
+    valid: np.ndarray  # (N,) whether the move is carried out, invalid moves are passes
+    destination: np.ndarray  # (N, 2) destination cell, the source cell for invalid moves
+    source_army: np.ndarray  # (N,) army left in the source cell
+    destination_army: np.ndarray  # (N,) army in the destination cell
+    destination_owner: np.ndarray  # (N,) owner index of the destination cell
+    captured: np.ndarray  # (N,) whether the destination cell was taken from another owner
+    won: np.ndarray  # (N,) whether the move wins the game
+    army: np.ndarray  # (N, owners) total army of every owner, indexed by owner index
+    land: np.ndarray  # (N, owners) total land of every owner
+
+
 class Game:
-    def __init__(self, grid: Grid, agents: list[str]):
+    def __init__(self, grid: Grid, agents: list[str], check_stats: bool = False):
+        """
+        Args:
+            grid: grid to play on
+            agents: ids of agents
+            check_stats: if True, running player stats and the state hash are checked against
+                values computed from scratch after every step (slow, meant for testing)
+        """
+        self._init_state(grid, agents, check_stats)
+        self._init_spaces()
+
+    def _init_state(self, grid: Grid, agents: list[str], check_stats: bool) -> None:
+        self.check_stats = check_stats
+
         # Agents
         self.agents = agents
         self.agent_order = self.agents[:]
 
         # Grid
-        _grid = grid.grid
-        self.channels = Channels(_grid, self.agents)
-        self.grid_dims = (_grid.shape[0], _grid.shape[1])
+        codes = grid.codes
+        self.channels = Channels(codes, self.agents)
+        self.grid_dims = (codes.shape[0], codes.shape[1])
         self.general_positions = {
-            agent: np.argwhere(_grid == chr(ord("A") + i))[0] for i, agent in enumerate(self.agents)
+            agent: np.argwhere(codes == GENERAL_CODE - i)[0] for i, agent in enumerate(self.agents)
         }
 
         # Time stuff
@@ -33,10 +78,16 @@ class Game:
 
         # Limits
         self.max_army_value = 100_000
-        self.max_land_value = np.prod(self.grid_dims)
+        self.max_land_value = int(np.prod(self.grid_dims))
         self.max_timestep = 100_000
 
-        # Spaces
+        # Buffers for `agent_observation_tensor`: tables, cell codes with a scratch for owners,
+        # and masks of owned and movable cells for the action mask
+        self._observation_tables: dict[tuple, np.ndarray] = {}
+        self._observation_codes = np.empty((2,) + self.grid_dims, dtype=np.intp)
+        self._observation_masks = np.empty((2,) + self.grid_dims, dtype=bool)
+
+    def _init_spaces(self) -> None:
         grid_multi_binary = gym.spaces.MultiBinary(self.grid_dims)
         grid_discrete = np.ones(self.grid_dims, dtype=int) * self.max_army_value
         self.observation_space = gym.spaces.Dict(
@@ -67,10 +118,92 @@ class Game:
         # Action format is: [pass, cell_i, cell_j, direction, split]
         self.action_space = gym.spaces.MultiDiscrete([2, self.grid_dims[0], self.grid_dims[1], 4, 2])
 
+    def snapshot(self) -> GameSnapshot:
+        """
+        Returns a snapshot of the game state, which can be restored by `restore`.
+        The state of channels lives in one contiguous buffer, so this is a single copy.
+        """
+        return GameSnapshot(self.channels.snapshot(), self.time, tuple(self.agent_order))
+
+    def restore(self, snapshot: GameSnapshot) -> None:
+        """
+        Restores the game state saved by `snapshot` of this (or another game on the same grid) in place.
+        """
+        self.channels.restore(snapshot.state)
+        self.time = snapshot.time
+        self.agent_order = list(snapshot.agent_order)
+
+    @property
+    def state_hash(self) -> int:
+        """
+        64-bit Zobrist hash of the game state: armies and owners of all cells, time parity and agent order.
+        It is maintained incrementally as cells change, so reading it is O(1).
+        """
+        return self._extend_hash(self.channels.state_hash)
+
+    def recompute_state_hash(self) -> int:
+        """
+        Computes `state_hash` from scratch, e.g. to verify the incremental hash.
+        """
+        return self._extend_hash(self.channels.recompute_hash())
+
+    def _extend_hash(self, cells_hash: int) -> int:
+        if self.time % 2 == 1:
+            cells_hash ^= TIME_PARITY_KEY
+        if self.agent_order[0] != self.agents[0]:
+            cells_hash ^= AGENT_ORDER_KEY
+        return cells_hash
+
+    def observation_hash(self, agent: str) -> int:
+        """
+        64-bit hash of what an agent observes: cells it sees (owners from its perspective), structures in fog
+        (cities look like mountains), stats in its observation, time parity and its priority.
+        Equal observations hash equally, no matter the hidden part of the state or which agent observes.
+        """
+        channels = self.channels
+        agent_index = channels.owner_index(agent)
+        opponent = self.agents[0] if agent == self.agents[1] else self.agents[1]
+        opponent_index = channels.owner_index(opponent)
+        visible = channels.get_visibility(agent)
+
+        # Own cells have owner 1 and cells of the opponent owner 2, invisible cells have owner `FOG_OWNER`
+        owners = np.select(
+            [~visible, channels.owners == agent_index, channels.owners == opponent_index], [FOG_OWNER, 1, 2], 0
+        )
+        fog_structures = np.where(channels.mountains | channels.cities, MOUNTAIN_STRUCTURE, 0)
+        structures = np.where(visible, channels.structure_types, fog_structures)
+        armies = np.where(visible, channels.armies, 0)
+        observation_hash = compute_hash(zobrist_keys(self.grid_dims), armies, owners, structures)
+
+        army, land = channels.player_stats()
+        stats = [land[agent_index], army[agent_index], land[opponent_index], army[opponent_index]]
+        observation_hash += sum(key * int(value) for key, value in zip(STATS_KEYS, stats))
+        observation_hash &= MASK_64
+        if self.time % 2 == 1:
+            observation_hash ^= TIME_PARITY_KEY
+        if self.agent_order[0] == agent:
+            observation_hash ^= AGENT_ORDER_KEY
+        return observation_hash
+
+    def forward_model(self) -> "ForwardModel":
+        """
+        Returns a `ForwardModel` in the current state of the game.
+        """
+        return ForwardModel.from_game(self)
+
     def step(self, actions: dict[str, Action]) -> tuple[dict[str, Observation], dict[str, Any]]:
         """
         Perform one step of the game
         """
+        self.apply_actions(actions)
+        observations = {agent: self.agent_observation(agent) for agent in self.agents}
+        infos = self.get_infos()
+        return observations, infos
+
+    def apply_actions(self, actions: dict[str, Action]) -> None:
+        """
+        Perform one step of the game, without building observations and infos.
+        """
         done_before_actions = self.is_done()
         # Process validity of moves, whether agents want to pass the turn,
         # and calculate intended amount of army to move (all available or split)
@@ -98,7 +231,8 @@ class Game:
             army_to_stay = self.channels.armies[si, sj] - army_to_move
 
             # Check if the current agent still owns the source cell and has more than 1 army
-            if self.channels.ownership[agent][si, sj] == 0 or army_to_move < 1:
+            agent_index = self.channels.owner_index(agent)
+            if self.channels.owners[si, sj] != agent_index or army_to_move < 1:
                 continue
 
             di, dj = (
@@ -114,22 +248,16 @@ class Game:
 
             # Figure out the target square owner and army size
             target_square_army = self.channels.armies[di, dj]
-            target_square_owner_idx = np.argmax(
-                [self.channels.ownership[agent][di, dj] for agent in ["neutral"] + self.agents]
-            )
-            target_square_owner = (["neutral"] + self.agents)[target_square_owner_idx]
-            if target_square_owner == agent:
-                self.channels.armies[di, dj] += army_to_move
-                self.channels.armies[si, sj] = army_to_stay
+            target_square_owner = self.channels.owners[di, dj]
+            if target_square_owner == agent_index:
+                self.channels.set_cell(di, dj, target_square_army + army_to_move, agent_index)
+                self.channels.set_cell(si, sj, army_to_stay, agent_index)
             else:
                 # Calculate resulting army, winner and update channels
                 remaining_army = np.abs(target_square_army - army_to_move)
-                square_winner = agent if target_square_army < army_to_move else target_square_owner
-                self.channels.armies[di, dj] = remaining_army
-                self.channels.armies[si, sj] = army_to_stay
-                self.channels.ownership[square_winner][di, dj] = 1
-                if square_winner != target_square_owner:
-                    self.channels.ownership[target_square_owner][di, dj] = 0
+                square_winner = agent_index if target_square_army < army_to_move else target_square_owner
+                self.channels.set_cell(di, dj, remaining_army, square_winner)
+                self.channels.set_cell(si, sj, army_to_stay, agent_index)
 
         # Swap agent order (because priority is alternating)
         self.agent_order = self.agent_order[::-1]
@@ -141,32 +269,168 @@ class Game:
             # give all cells of loser to winner
             winner = self.agents[0] if self.agent_won(self.agents[0]) else self.agents[1]
             loser = self.agents[1] if winner == self.agents[0] else self.agents[0]
-            self.channels.ownership[winner] += self.channels.ownership[loser]
-            self.channels.ownership[loser] = (self.channels.passable * 0).astype(bool)
+            self.channels.transfer_cells(self.channels.owner_index(loser), self.channels.owner_index(winner))
         else:
             self._global_game_update()
 
-        observations = {agent: self.agent_observation(agent) for agent in self.agents}
-        infos = self.get_infos()
-        return observations, infos
+        if self.check_stats:
+            self.channels.verify_player_stats()
+            self.channels.verify_hash()
+
+    def advance(self, k: int) -> None:
+        """
+        Advances the game by `k` turns in which both agents pass, i.e. the same as `k` calls of `apply_actions({})`.
+        Army growth is deterministic when nobody moves, so growth of all `k` turns is applied at once in O(H * W).
+        """
+        assert k >= 0, "Number of turns must be non-negative."
+        # Priority alternates every turn, finished games do not advance time
+        if k % 2 == 1:
+            self.agent_order = self.agent_order[::-1]
+        if k == 0 or self.is_done():
+            return
+
+        start, self.time = self.time, self.time + k
+        # Land grows on multiples of `increment_rate` and structures on even turns in (start, start + k]
+        land_increments = self.time // self.increment_rate - start // self.increment_rate
+        structure_increments = self.time // 2 - start // 2
+        if land_increments > 0:
+            self.channels.increment_land_armies(land_increments)
+        if structure_increments > 0:
+            self.channels.increment_structure_armies(structure_increments)
+
+        if self.check_stats:
+            self.channels.verify_player_stats()
+            self.channels.verify_hash()
+
+    def legal_moves(self, agent: str) -> np.ndarray:
+        """
+        Returns (N, 5) array of all moves of an agent allowed by its action mask, with and without split.
+        """
+        channels = self.channels
+        mask = compute_action_mask(
+            channels.armies, channels.owners == channels.owner_index(agent), channels.passable_directions
+        )
+        cells = np.argwhere(mask)
+        moves = np.zeros((2 * len(cells), 5), dtype=int)
+        moves[:, 1:4] = np.tile(cells, (2, 1))
+        moves[len(cells) :, 4] = 1
+        return moves
+
+    def lookahead(self, agent: str, actions: np.ndarray | None = None) -> MoveOutcomes:
+        """
+        Evaluates candidate moves of an agent in one vectorized pass, as if each was played by `apply_actions`
+        while the other agent passes. The game itself is not changed.
+
+        Args:
+            agent: id of the moving agent
+            actions: (N, 5) candidate actions, all legal moves (see `legal_moves`) by default
+        """
+        channels = self.channels
+        actions = self.legal_moves(agent) if actions is None else np.asarray(actions, dtype=int).reshape(-1, 5)
+        n = len(actions)
+        rows = np.arange(n)
+        agent_index = channels.owner_index(agent)
+        pass_turn, si, sj, direction, split_army = actions.T
+
+        # Moves are resolved by the same rules as in `apply_actions`
+        source_army = channels.armies[si, sj]
+        army_to_move = np.where(split_army == 1, source_army // 2, source_army - 1)
+        di = si + DIRECTION_OFFSETS[direction, 0]
+        dj = sj + DIRECTION_OFFSETS[direction, 1]
+        in_bounds = (di >= 0) & (di < self.grid_dims[0]) & (dj >= 0) & (dj < self.grid_dims[1])
+        valid = (
+            (pass_turn != 1)
+            & (army_to_move >= 1)
+            & (channels.owners[si, sj] == agent_index)
+            & in_bounds
+            & channels.passable[np.where(in_bounds, di, 0), np.where(in_bounds, dj, 0)]
+        )
+        di, dj = np.where(valid, di, si), np.where(valid, dj, sj)
+        army_to_move = np.where(valid, army_to_move, 0)
+
+        target_army = channels.armies[di, dj]
+        target_owner = channels.owners[di, dj]
+        owned_target = target_owner == agent_index
+        destination_army = np.where(owned_target, target_army + army_to_move, np.abs(target_army - army_to_move))
+        destination_owner = np.where(owned_target | (target_army < army_to_move), agent_index, target_owner)
+        destination_army = np.where(valid, destination_army, target_army)
+        destination_owner = np.where(valid, destination_owner, target_owner).astype(np.int8)
+        source_army = np.where(valid, source_army - army_to_move, source_army)
+        captured = valid & (destination_owner != target_owner)
+
+        # Player stats after the move, the source cell stays with the agent
+        army_counts, land_counts = channels.player_stats()
+        army = np.tile(army_counts, (n, 1))
+        land = np.tile(land_counts, (n, 1))
+        army[rows, agent_index] -= army_to_move
+        army[rows, target_owner] -= target_army
+        army[rows, destination_owner] += destination_army
+        land[rows, target_owner] -= captured
+        land[rows, destination_owner] += captured
+
+        # The move wins if it takes the last general the agent does not own
+        generals = tuple(np.array(list(self.general_positions.values())).T)
+        missing_generals = np.sum(channels.owners[generals] != agent_index)
+        destination_general = channels.generals[di, dj].astype(bool)
+        done_before_actions = self.is_done()
+        won = captured & destination_general & (missing_generals == 1) & (not done_before_actions)
+
+        time = self.time if done_before_actions else self.time + 1
+        cells = np.stack([source_army, destination_army], axis=1)
+        cell_owners = np.stack([channels.owners[si, sj], destination_owner], axis=1)
+        growing = ~won & (not done_before_actions)
+        if growing.any():
+            owned = cell_owners != NEUTRAL_OWNER
+            if time % self.increment_rate == 0:
+                army[:, NEUTRAL_OWNER + 1 :] += land[:, NEUTRAL_OWNER + 1 :] * growing[:, None]
+                cells += owned * growing[:, None]
+            if time % 2 == 0 and time > 0:
+                # Owned structures grow, the destination may have changed the owner of one
+                structures = channels.generals | channels.cities
+                structure_owners = channels.owners[structures]
+                counts = np.bincount(structure_owners, minlength=army.shape[1])
+                structure_counts = np.tile(counts, (n, 1))
+                moved_structure = captured & structures[di, dj]
+                structure_counts[rows, target_owner] -= moved_structure
+                structure_counts[rows, destination_owner] += moved_structure
+                structure_counts[:, NEUTRAL_OWNER] = 0
+                army += structure_counts * growing[:, None]
+                is_structure = np.stack([structures[si, sj], structures[di, dj]], axis=1)
+                cells += (owned & is_structure) * growing[:, None]
+
+        # Winner takes all cells of the loser
+        for owner in range(NEUTRAL_OWNER + 1, army.shape[1]):
+            if owner != agent_index:
+                army[won, agent_index] += army[won, owner]
+                land[won, agent_index] += land[won, owner]
+                army[won, owner] = 0
+                land[won, owner] = 0
+
+        return MoveOutcomes(
+            actions=actions,
+            valid=valid,
+            destination=np.stack([di, dj], axis=1),
+            source_army=cells[:, 0],
+            destination_army=cells[:, 1],
+            destination_owner=destination_owner,
+            captured=captured,
+            won=won,
+            army=army,
+            land=land,
+        )
 
     def _global_game_update(self) -> None:
         """
         Update game state globally.
         """
 
-        owners = self.agents
-
         # every `increment_rate` steps, increase army size in each cell
         if self.time % self.increment_rate == 0:
-            for owner in owners:
-                self.channels.armies += self.channels.ownership[owner]
+            self.channels.increment_land_armies()
 
         # Increment armies on general and city cells, but only if they are owned by player
         if self.time % 2 == 0 and self.time > 0:
-            update_mask = self.channels.generals + self.channels.cities
-            for owner in owners:
-                self.channels.armies += update_mask * self.channels.ownership[owner]
+            self.channels.increment_structure_armies()
 
     def is_done(self) -> bool:
         """
@@ -181,73 +445,298 @@ class Game:
         - army: total army size
         - land: total land size
         """
+        army, land = self.channels.player_stats()
         players_stats = {}
         for agent in self.agents:
-            army_size = np.sum(self.channels.armies * self.channels.ownership[agent]).astype(int)
-            land_size = np.sum(self.channels.ownership[agent]).astype(int)
+            agent_index = self.channels.owner_index(agent)
             players_stats[agent] = {
-                "army": army_size,
-                "land": land_size,
+                "army": army[agent_index],
+                "land": land[agent_index],
                 "is_winner": self.agent_won(agent),
             }
         return players_stats
 
-    def agent_observation(self, agent: str) -> Observation:
+    def agent_observation(self, agent: str, out: Observation | None = None) -> Observation:
         """
         Returns an observation for a given agent.
+
+        If `out` (e.g. created by `Observation.allocate`) is given, the observation is written
+        into its buffers in place and returned, so no new arrays are allocated.
+        Keep in mind that the next call with the same `out` overwrites its content.
         """
-        scores = {}
-        for _agent in self.agents:
-            army_size = np.sum(self.channels.armies * self.channels.ownership[_agent]).astype(int)
-            land_size = np.sum(self.channels.ownership[_agent]).astype(int)
-            scores[_agent] = {
-                "army": army_size,
-                "land": land_size,
-            }
+        if out is None:
+            out = Observation.allocate(self.grid_dims)
+        channels = self.channels
+        agent_index = channels.owner_index(agent)
+        opponent = self.agents[0] if agent == self.agents[1] else self.agents[1]
+        opponent_index = channels.owner_index(opponent)
+        visible = channels.get_visibility(agent)
+
+        out.armies.fill(0)
+        np.copyto(out.armies, channels.armies, where=visible)
+        np.logical_and(channels.mountains, visible, out=out.mountains)
+        np.logical_and(channels.generals, visible, out=out.generals)
+        np.logical_and(channels.cities, visible, out=out.cities)
+        np.equal(channels.owners, NEUTRAL_OWNER, out=out.neutral_cells)
+        np.logical_and(out.neutral_cells, channels.passable, out=out.neutral_cells)
+        np.logical_and(out.neutral_cells, visible, out=out.neutral_cells)
+        np.equal(channels.owners, agent_index, out=out.owned_cells)
+        np.logical_and(out.owned_cells, visible, out=out.owned_cells)
+        np.equal(channels.owners, opponent_index, out=out.opponent_cells)
+        np.logical_and(out.opponent_cells, visible, out=out.opponent_cells)
+        # Structures in fog are invisible mountains and cities, fog cells are the remaining invisible cells
+        np.logical_or(channels.mountains, channels.cities, out=out.structures_in_fog)
+        np.greater(out.structures_in_fog, visible, out=out.structures_in_fog)
+        np.logical_or(visible, out.structures_in_fog, out=out.fog_cells)
+        np.logical_not(out.fog_cells, out=out.fog_cells)
+
+        army, land = channels.player_stats()
+        out.owned_land_count = land[agent_index]
+        out.owned_army_count = army[agent_index]
+        out.opponent_land_count = land[opponent_index]
+        out.opponent_army_count = army[opponent_index]
+        out.timestep = self.time
+        out.priority = 1 if agent == self.agent_order[0] else 0
+        out.passable_directions = channels.passable_directions
+        return out
+
+    def observation_normalization(self) -> dict[str, float]:
+        """
+        Returns default divisors of observation tensor channels, that scale them to [0, 1].
+        """
+        return {
+            "armies": self.max_army_value,
+            "owned_land_count": self.max_land_value,
+            "owned_army_count": self.max_army_value,
+            "opponent_land_count": self.max_land_value,
+            "opponent_army_count": self.max_army_value,
+            "timestep": self.max_timestep,
+        }
 
-        visible = self.channels.get_visibility(agent)
-        invisible = 1 - visible
+    def observation_tensor_space(
+        self,
+        channels: Sequence[str] = OBSERVATION_CHANNELS,
+        normalization: dict[str, float] | None = None,
+        dtype: type = np.float32,
+    ) -> gym.spaces.Dict:
+        """
+        Returns space of observations created by `agent_observation_tensor` with the same arguments.
+        """
+        limits = self.observation_normalization()  # default divisors are the maximal values
+        if np.issubdtype(dtype, np.integer):
+            # Integer tensors are not normalized, only clipped
+            normalization = {}
+        elif normalization is None:
+            normalization = limits
+        high = np.ones(len(channels))
+        for i, channel in enumerate(channels):
+            if channel in limits:
+                high[i] = limits[channel] / normalization.get(channel, 1)
+        if np.issubdtype(dtype, np.integer):
+            high = np.minimum(high, np.iinfo(dtype).max)
+        shape = self.grid_dims + (len(channels),)
+        return gym.spaces.Dict(
+            {
+                "observation": gym.spaces.Box(low=0, high=np.broadcast_to(high, shape).astype(dtype), dtype=dtype),
+                "action_mask": gym.spaces.MultiBinary(self.grid_dims + (4,)),
+            }
+        )
 
+    def agent_observation_tensor(
+        self,
+        agent: str,
+        channels: Sequence[str] = OBSERVATION_CHANNELS,
+        normalization: dict[str, float] | None = None,
+        out: np.ndarray | None = None,
+        action_mask_out: np.ndarray | None = None,
+    ) -> dict[str, np.ndarray]:
+        """
+        Returns an observation of a given agent as a stacked (H, W, C) tensor, written directly
+        from the game channels, together with the action mask.
+
+        Binary channels of a cell depend only on its structure, owner and visibility, so they are
+        looked up in a small table indexed by a code of these three, and armies and scalars are
+        filled in afterwards. This takes a handful of numpy calls regardless of the channel count.
+
+        Args:
+            channels: names of channels to stack, see `OBSERVATION_CHANNELS`
+            normalization: divisor of each channel, defaults to `observation_normalization()`,
+                pass an empty dict to get raw values; it is applied only to floating point tensors,
+                integer tensors are clipped to the range of their dtype instead
+            out: optional preallocated C-contiguous (H, W, C) tensor to write into, float32 otherwise
+            action_mask_out: optional preallocated (H, W, 4) action mask to write into
+        """
+        if out is None:
+            out = np.empty(self.grid_dims + (len(channels),), dtype=np.float32)
+        normalization = self.observation_normalization() if normalization is None else normalization
+        integer_tensor = np.issubdtype(out.dtype, np.integer)
+        value_limit = np.iinfo(out.dtype).max if integer_tensor else np.inf
+
+        game_channels = self.channels
+        agent_index = game_channels.owner_index(agent)
         opponent = self.agents[0] if agent == self.agents[1] else self.agents[1]
+        opponent_index = game_channels.owner_index(opponent)
+        visible = game_channels.get_visibility(agent)
+        army, land = game_channels.player_stats()
+        scalars = {
+            "owned_land_count": land[agent_index],
+            "owned_army_count": army[agent_index],
+            "opponent_land_count": land[opponent_index],
+            "opponent_army_count": army[opponent_index],
+            "timestep": self.time,
+            "priority": 1 if agent == self.agent_order[0] else 0,
+        }
 
-        armies = self.channels.armies.astype(int) * visible
-        mountains = self.channels.mountains * visible
-        generals = self.channels.generals * visible
-        cities = self.channels.cities * visible
-        neutral_cells = self.channels.ownership_neutral * visible
-        owned_cells = self.channels.ownership[agent] * visible
-        opponent_cells = self.channels.ownership[opponent] * visible
-        structures_in_fog = invisible * (self.channels.mountains + self.channels.cities)
-        fog_cells = invisible - structures_in_fog
-        owned_land_count = scores[agent]["land"]
-        owned_army_count = scores[agent]["army"]
-        opponent_land_count = scores[opponent]["land"]
-        opponent_army_count = scores[opponent]["army"]
-        timestep = self.time
-        priority = 1 if agent == self.agent_order[0] else 0
-
-        return Observation(
-            armies=armies,
-            generals=generals,
-            cities=cities,
-            mountains=mountains,
-            neutral_cells=neutral_cells,
-            owned_cells=owned_cells,
-            opponent_cells=opponent_cells,
-            fog_cells=fog_cells,
-            structures_in_fog=structures_in_fog,
-            owned_land_count=owned_land_count,
-            owned_army_count=owned_army_count,
-            opponent_land_count=opponent_land_count,
-            opponent_army_count=opponent_army_count,
-            timestep=timestep,
-            priority=priority,
+        table = self._observation_table(agent, tuple(channels), out.dtype)
+        for i, channel in enumerate(channels):
+            if channel in scalars:
+                value = scalars[channel]
+                table[:, i] = min(value, value_limit) if integer_tensor else value / normalization.get(channel, 1)
+
+        # Code of a cell is ((structure type * 2) + visibility) * number of owners + owner. Channels are cast
+        # by copies into buffers of the index type, casting in arithmetic would allocate temporary buffers
+        codes, scratch = self._observation_codes
+        n_owners = len(game_channels.owner_indices)
+        np.copyto(codes, game_channels.structure_types)
+        np.multiply(codes, 2 * n_owners, out=codes)
+        np.add(codes, n_owners, out=codes, where=visible)
+        np.copyto(scratch, game_channels.owners)
+        np.add(codes, scratch, out=codes)
+        np.take(table, codes, axis=0, out=out, mode="clip")
+
+        if "armies" in channels:
+            plane = out[..., channels.index("armies")]
+            if integer_tensor:
+                np.minimum(game_channels.armies, value_limit, out=scratch)
+                np.copyto(plane, scratch, casting="unsafe", where=visible)
+            else:
+                np.copyto(plane, game_channels.armies, casting="unsafe", where=visible)
+                np.divide(plane, normalization.get("armies", 1), out=plane, where=visible)
+
+        owned_cells, movable_cells = self._observation_masks
+        np.equal(game_channels.owners, agent_index, out=owned_cells)
+        action_mask = compute_action_mask(
+            game_channels.armies,
+            owned_cells,
+            game_channels.passable_directions,
+            out=action_mask_out,
+            scratch=movable_cells,
         )
+        return {"observation": out, "action_mask": action_mask}
+
+    def buffered_observation_tensor(
+        self,
+        agent: str,
+        channels: Sequence[str] = OBSERVATION_CHANNELS,
+        normalization: dict[str, float] | None = None,
+        dtype: type = np.float32,
+        buffers: dict[str, tuple[np.ndarray, np.ndarray]] | None = None,
+    ) -> dict[str, np.ndarray]:
+        """
+        Returns `agent_observation_tensor` of a given dtype. If `buffers` is given, the tensor and the action mask
+        are written into buffers of the agent kept in it, which are allocated only when the grid dimensions change.
+        """
+        agent_buffers = None if buffers is None else buffers.get(agent)
+        if agent_buffers is None or agent_buffers[1].shape[:2] != self.grid_dims:
+            agent_buffers = (
+                np.empty(self.grid_dims + (len(channels),), dtype=dtype),
+                np.empty(self.grid_dims + (4,), dtype=bool),
+            )
+            if buffers is not None:
+                buffers[agent] = agent_buffers
+        return self.agent_observation_tensor(
+            agent, channels, normalization, out=agent_buffers[0], action_mask_out=agent_buffers[1]
+        )
+
+    def _observation_table(self, agent: str, channels: tuple[str, ...], dtype: np.dtype) -> np.ndarray:
+        """
+        Returns table of channel values of an observation tensor indexed by cell codes,
+        see `agent_observation_tensor`. Tables are cached, only scalar channels are rewritten on each use.
+        """
+        key = (agent, channels, dtype)
+        if key in self._observation_tables:
+            return self._observation_tables[key]
+
+        n_owners = len(self.channels.owner_indices)
+        codes = np.arange(N_STRUCTURE_TYPES * 2 * n_owners)
+        owners, visible, structure_types = codes % n_owners, (codes // n_owners) % 2 == 1, codes // (2 * n_owners)
+        opponent = self.agents[0] if agent == self.agents[1] else self.agents[1]
+        fog_structure = np.isin(structure_types, [CITY_STRUCTURE, MOUNTAIN_STRUCTURE]) & ~visible
+        binary_channels = {
+            "generals": (structure_types == GENERAL_STRUCTURE) & visible,
+            "cities": (structure_types == CITY_STRUCTURE) & visible,
+            "mountains": (structure_types == MOUNTAIN_STRUCTURE) & visible,
+            "neutral_cells": (owners == NEUTRAL_OWNER) & (structure_types != MOUNTAIN_STRUCTURE) & visible,
+            "owned_cells": (owners == self.channels.owner_index(agent)) & visible,
+            "opponent_cells": (owners == self.channels.owner_index(opponent)) & visible,
+            "fog_cells": ~visible & ~fog_structure,
+            "structures_in_fog": fog_structure,
+        }
+        # Armies and scalar channels are filled on every use
+        filled_channels = [
+            "armies",
+            "owned_land_count",
+            "owned_army_count",
+            "opponent_land_count",
+            "opponent_army_count",
+            "timestep",
+            "priority",
+        ]
+        table = np.zeros((len(codes), len(channels)), dtype=dtype)
+        for i, channel in enumerate(channels):
+            if channel in binary_channels:
+                table[:, i] = binary_channels[channel]
+            elif channel not in filled_channels:
+                raise ValueError(f"Unknown observation channel: {channel}")
+        self._observation_tables[key] = table
+        return table
 
     def agent_won(self, agent: str) -> bool:
         """
         Returns True if the agent won the game, False otherwise.
         """
+        agent_index = self.channels.owner_index(agent)
         return all(
-            self.channels.ownership[agent][general[0], general[1]] == 1 for general in self.general_positions.values()
+            self.channels.owners[general[0], general[1]] == agent_index for general in self.general_positions.values()
         )
+
+
+class ForwardModel(Game):
+    """
+    Cheap game for simulating moves in search, e.g. by `snapshot`/`restore` or `clone` many times per move.
+
+    It shares the grid (static channels) with the game it was created from and does not build
+    gym spaces, so `observation_space` and `action_space` are not available. Use `apply_actions`
+    to advance it, `step` additionally builds observations of both agents.
+    """
+
+    def __init__(self, grid: Grid, agents: list[str], check_stats: bool = False):
+        self._init_state(grid, agents, check_stats)
+
+    @classmethod
+    def from_game(cls, game: Game) -> "ForwardModel":
+        """
+        Returns a forward model in the state of a game, the game is not affected by the model.
+        """
+        model = cls.__new__(cls)
+        model.check_stats = game.check_stats
+        model.agents = game.agents
+        model.agent_order = game.agent_order[:]
+        model.channels = game.channels.copy()
+        model.grid_dims = game.grid_dims
+        model.general_positions = game.general_positions
+        model.time = game.time
+        model.increment_rate = game.increment_rate
+        model.max_army_value = game.max_army_value
+        model.max_land_value = game.max_land_value
+        model.max_timestep = game.max_timestep
+        model._observation_tables = {}
+        model._observation_codes = np.empty((2,) + game.grid_dims, dtype=np.intp)
+        model._observation_masks = np.empty((2,) + game.grid_dims, dtype=bool)
+        return model
+
+    def clone(self) -> "ForwardModel":
+        """
+        Returns an independent copy of the model.
+        """
+        return ForwardModel.from_game(self)
@@ -1,43 +1,116 @@
 import numpy as np
 from numpy.random import Generator
+from scipy.ndimage import generate_binary_structure, label  # type: ignore
 
-from .config import MOUNTAIN, PASSABLE
+from .config import GENERAL_CODE, MAX_CITY_ARMY, MIN_CITY_ARMY, MOUNTAIN, MOUNTAIN_CODE, PASSABLE, PASSABLE_CODE
+
+# Neighbourhood of cells connected to each other, i.e. cells sharing an edge
+FOUR_CONNECTIVITY = generate_binary_structure(2, 1)
+
+GENERALS = ["A", "B"]  # Generals are represented by A and B
+
+
+# Integer code of every ASCII character of the string format, unknown characters are passable
+_CHARACTER_CODES = np.full(128, PASSABLE_CODE, dtype=np.int8)
+_CHARACTER_CODES[ord(MOUNTAIN)] = MOUNTAIN_CODE
+for _i, _general in enumerate(GENERALS):
+    _CHARACTER_CODES[ord(_general)] = GENERAL_CODE - _i
+for _digit in range(10):
+    _CHARACTER_CODES[ord("0") + _digit] = MIN_CITY_ARMY + _digit
+_CHARACTER_CODES[ord("x")] = MAX_CITY_ARMY  # city with value 50 is marked as x
 
 
 class Grid:
+    """
+    Map of a game. Cells are stored as integer codes (see `encode_grid`), the string format
+    of maps is used only to create grids and to print them.
+    """
+
+    _characters: np.ndarray | None
+
     def __init__(self, grid: str | np.ndarray):
         self.grid = grid
 
     def __eq__(self, other):
-        return np.array_equal(self.grid, other.grid)
+        return np.array_equal(self.codes, other.codes)
+
+    def __getstate__(self) -> dict:
+        return {"_codes": self._codes}
+
+    def __setstate__(self, state: dict) -> None:
+        # Grids pickled before the introduction of integer codes store the map as characters
+        if "_grid" in state:
+            state = {"_codes": Grid.encode_grid(state["_grid"])}
+        self.__dict__.update(state)
+        self._characters = None
+
+    @property
+    def codes(self) -> np.ndarray:
+        """
+        Returns (H, W) int8 array of cell codes.
+        """
+        return self._codes
 
     @property
-    def grid(self):
-        return self._grid
+    def grid(self) -> np.ndarray:
+        """
+        Returns (H, W) array of cells in the string format, decoded on first access.
+        """
+        if self._characters is None:
+            self._characters = Grid.decode_grid(self._codes)
+        return self._characters
 
     @grid.setter
     def grid(self, grid: str | np.ndarray):
         match grid:
             case str(grid):
-                grid = grid.strip()
-                grid = Grid.numpify_grid(grid)
+                codes = Grid.encode_grid(Grid.numpify_grid(grid))
+            case np.ndarray() if np.issubdtype(grid.dtype, np.integer):
+                codes = grid.astype(np.int8)
             case np.ndarray():
-                pass
+                codes = Grid.encode_grid(grid)
             case _:
                 raise ValueError("Grid must be encoded as a string or a numpy array.")
-        if not Grid.verify_grid_connectivity(grid):
+        if not Grid.verify_grid_connectivity(codes):
             raise ValueError("Invalid grid layout - generals cannot reach each other.")
         # check that exactly one 'A' and one 'B' are present in the grid
-        first_general = np.argwhere(np.isin(grid, ["A"]))
-        second_general = np.argwhere(np.isin(grid, ["B"]))
-        if len(first_general) != 1 or len(second_general) != 1:
+        if np.count_nonzero(codes == GENERAL_CODE) != 1 or np.count_nonzero(codes == GENERAL_CODE - 1) != 1:
             raise ValueError("Exactly one 'A' and one 'B' should be present in the grid.")
 
-        self._grid = grid
+        self._codes = codes
+        self._characters = None
+
+    @staticmethod
+    def encode_grid(grid: np.ndarray | str) -> np.ndarray:
+        """
+        Converts a map in the string format to int8 codes:
+            PASSABLE_CODE (0) - passable cell
+            MOUNTAIN_CODE (-1) - mountain
+            GENERAL_CODE - i (-2, -3) - general of i-th agent
+            40 - 50 - city, coded by its initial army
+        """
+        if isinstance(grid, str):
+            grid = Grid.numpify_grid(grid)
+        code_points = np.ascontiguousarray(grid, dtype="U1").view(np.uint32)
+        return np.take(_CHARACTER_CODES, code_points, mode="clip")
+
+    @staticmethod
+    def decode_grid(codes: np.ndarray) -> np.ndarray:
+        """
+        Converts int8 codes back to a map in the string format.
+        """
+        code_points = np.full(codes.shape, ord(PASSABLE), dtype=np.uint32)
+        code_points[codes == MOUNTAIN_CODE] = ord(MOUNTAIN)
+        generals = codes <= GENERAL_CODE
+        code_points[generals] = ord(GENERALS[0]) + GENERAL_CODE - codes[generals]
+        cities = codes >= MIN_CITY_ARMY
+        code_points[cities] = ord("0") + codes[cities] - MIN_CITY_ARMY
+        code_points[codes == MAX_CITY_ARMY] = ord("x")
+        return code_points.view("U1")
 
     @staticmethod
     def generals_distance(grid: "Grid") -> int:
-        generals = np.argwhere(np.isin(grid.grid, ["A", "B"]))
+        generals = np.argwhere(grid.codes <= GENERAL_CODE)
         return abs(generals[0][0] - generals[1][0]) + abs(generals[0][1] - generals[1][1])
 
     @staticmethod
@@ -46,39 +119,47 @@ class Grid:
 
     @staticmethod
     def stringify_grid(grid: np.ndarray) -> str:
+        if np.issubdtype(grid.dtype, np.integer):
+            grid = Grid.decode_grid(grid)
         return "\n".join(["".join(row) for row in grid])
 
+    @staticmethod
+    def connectivity_mask(grid: np.ndarray) -> np.ndarray:
+        """
+        Returns mask of cells that can be traversed when checking connectivity,
+        i.e. cells that are neither mountains nor cities with a digit cost.
+        """
+        if not np.issubdtype(grid.dtype, np.integer):
+            grid = Grid.encode_grid(grid)
+        return (grid != MOUNTAIN_CODE) & ((grid < MIN_CITY_ARMY) | (grid == MAX_CITY_ARMY))
+
+    @staticmethod
+    def connected_components(grid: np.ndarray | str) -> tuple[np.ndarray, int]:
+        """
+        Labels 4-connected components of cells in `connectivity_mask`.
+        Returns (H, W) array of component ids (0 for blocked cells, 1.. for components)
+        and the number of components.
+        """
+        if isinstance(grid, str):
+            grid = Grid.encode_grid(grid)
+        components, n_components = label(Grid.connectivity_mask(grid), structure=FOUR_CONNECTIVITY)
+        return components, n_components
+
     @staticmethod
     def verify_grid_connectivity(grid: np.ndarray | str) -> bool:
         """
         Verify grid layout (can generals reach each other?)
         Returns True if grid is valid, False otherwise
         """
-        if isinstance(grid, str):
-            grid = Grid.numpify_grid(grid)
-
-        height, width = grid.shape
+        if isinstance(grid, str) or not np.issubdtype(grid.dtype, np.integer):
+            grid = Grid.encode_grid(grid)
 
-        def dfs(grid, visited, square):
-            i, j = square
-            if i < 0 or i >= height or j < 0 or j >= width or visited[i, j]:
-                return
-            if grid[i, j] == MOUNTAIN or str(grid[i, j]).isdigit():  # mountain or city
-                return
-            visited[i, j] = True
-            for di, dj in [[-1, 0], [1, 0], [0, -1], [0, 1]]:
-                new_square = (i + di, j + dj)
-                dfs(grid, visited, new_square)
-
-        generals = np.argwhere(np.isin(grid, ["A", "B"]))
-        start, end = generals[0], generals[1]
-
-        visited = np.zeros_like(grid, dtype=bool)
-        dfs(grid, visited, start)
-        return visited[end[0], end[1]]
+        components, _ = Grid.connected_components(grid)
+        generals = np.flatnonzero(grid <= GENERAL_CODE)
+        return bool(components.flat[generals[0]] == components.flat[generals[1]])
 
     def __str__(self):
-        return Grid.stringify_grid(self._grid)
+        return Grid.stringify_grid(self._codes)
 
 
 class GridFactory:
@@ -89,12 +170,19 @@ class GridFactory:
         city_density: float = 0.05,
         general_positions: list[tuple[int, int]] | None = None,
         seed: int | None = None,
+        max_attempts: int = 1000,
     ):
+        """
+        Args:
+            max_attempts: number of sampled grids after which generation gives up,
+                if none of them was valid (generals could not reach each other)
+        """
         self.grid_height = grid_dims[0]
         self.grid_width = grid_dims[1]
         self.mountain_density = mountain_density
         self.city_density = city_density
         self.general_positions = general_positions
+        self.max_attempts = max_attempts
         self._rng = np.random.default_rng(seed)
 
     @property
@@ -105,6 +193,11 @@ class GridFactory:
     def rng(self, number_generator: Generator):
         self._rng = number_generator
 
+    def close(self) -> None:
+        """
+        Releases resources of the factory, e.g. the producer thread of `GridPool`. Environments call it on `close`.
+        """
+
     def grid_from_string(self, grid: str) -> Grid:
         return Grid(grid)
 
@@ -122,43 +215,46 @@ class GridFactory:
             mountain_density = self.mountain_density
         if city_density is None:
             city_density = self.city_density
-        if general_positions is None:
-            general_positions = self.general_positions
         if seed is not None:
             self.rng = np.random.default_rng(seed)
 
+        # Sample grids until generals can reach each other
+        for _ in range(self.max_attempts):
+            grid = GridFactory.sample_grid(self.rng, grid_dims, mountain_density, city_density)
+            if grid is not None:
+                return grid
+        raise ValueError(f"Could not generate a valid grid in {self.max_attempts} attempts.")
+
+    @staticmethod
+    def sample_grid(
+        rng: Generator, grid_dims: tuple[int, int], mountain_density: float, city_density: float
+    ) -> Grid | None:
+        """
+        Samples one grid, returns None if generals cannot reach each other.
+        """
         # Probabilities of each cell type
         p_neutral = 1 - mountain_density - city_density
         probs = [p_neutral, mountain_density] + [city_density / 10] * 10
 
-        # Place cells on the map
-        map = self.rng.choice(
-            [PASSABLE, MOUNTAIN, "0", "1", "2", "3", "4", "5", "6", "7", "8", "9"],
+        # Place cells on the map, cities have random cost 40 - 49
+        map = rng.choice(
+            np.array([PASSABLE_CODE, MOUNTAIN_CODE] + list(range(MIN_CITY_ARMY, MIN_CITY_ARMY + 10)), dtype=np.int8),
             size=grid_dims,
             p=probs,
         )
 
         # Place generals on random squares, they should be atleast some distance apart
         min_distance = max(grid_dims) // 2
-        p1 = self.rng.integers(0, grid_dims[0]), self.rng.integers(0, grid_dims[1])
+        p1 = rng.integers(0, grid_dims[0]), rng.integers(0, grid_dims[1])
         while True:
-            p2 = self.rng.integers(0, grid_dims[0]), self.rng.integers(0, grid_dims[1])
+            p2 = rng.integers(0, grid_dims[0]), rng.integers(0, grid_dims[1])
             if abs(p1[0] - p2[0]) + abs(p1[1] - p2[1]) >= min_distance:
                 break
         general_positions = [p1, p2]
         for i, idx in enumerate(general_positions):
-            map[idx[0], idx[1]] = chr(ord("A") + i)
-
-        # Convert map to string
-        map_string = "\n".join(["".join(row) for row in map.astype(str)])
+            map[idx[0], idx[1]] = GENERAL_CODE - i
 
         try:
-            return Grid(map_string)
+            return Grid(map)
         except ValueError:
-            return self.grid_from_generator(
-                grid_dims=grid_dims,
-                mountain_density=mountain_density,
-                city_density=city_density,
-                general_positions=general_positions,
-                seed=None,
-            )
+            return None
@@ -0,0 +1,171 @@
+import queue
+import threading
+import time
+from copy import deepcopy
+
+import numpy as np
+from numpy.random import Generator
+
+from .grid import Grid, GridFactory
+
+
+class GridPool(GridFactory):
+    """
+    Grid factory that pre-generates validated grids in a background thread.
+
+    Generated grids wait in a bounded queue, so `grid_from_generator` usually returns instantly.
+    The producer thread draws from its own copy of `rng` and every pooled grid carries the generator
+    state after it was generated, which is restored into `rng` when the grid is taken. Hence the pool
+    yields exactly the same sequence of grids as a `GridFactory` with the same generator, regardless of timing.
+    Setting a new generator (e.g. when an environment is reset with a seed) discards pooled grids
+    and restarts the producer from the new generator.
+    """
+
+    def __init__(
+        self,
+        grid_dims: tuple[int, int] = (10, 10),
+        mountain_density: float = 0.2,
+        city_density: float = 0.05,
+        general_positions: list[tuple[int, int]] | None = None,
+        seed: int | None = None,
+        max_attempts: int = 1000,
+        pool_size: int = 32,
+    ):
+        """
+        Args:
+            pool_size: maximal number of pre-generated grids waiting in the pool
+        """
+        assert max_attempts >= 1 and pool_size >= 1, "Number of attempts and pool size must be positive."
+        super().__init__(grid_dims, mountain_density, city_density, general_positions, seed, max_attempts)
+        self.pool_size = pool_size
+        self._producer: threading.Thread | None = None
+        self._start_producer()
+
+    def __getstate__(self) -> dict:
+        # Threads and queues cannot be copied, copies start their own producer from the current generator
+        state = self.__dict__.copy()
+        for key in ["_producer", "_pool", "_stop", "_stats_lock"]:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._producer = None
+        self._start_producer()
+
+    @property
+    def rng(self):
+        return self._rng
+
+    @rng.setter
+    def rng(self, number_generator: Generator):
+        # Environments set their generator on every reset, the pool is restarted only when it changes
+        if number_generator is not self._rng:
+            self._rng = number_generator
+            self._start_producer()
+
+    def _start_producer(self) -> None:
+        self.close()
+        self._pool: queue.Queue[tuple[Grid | Exception, dict]] = queue.Queue(maxsize=self.pool_size)
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._attempts = 0
+        self._generated = 0
+        self._generation_time = 0.0
+        self._served = 0
+        self._wait_time = 0.0
+        self._producer = threading.Thread(
+            target=self._produce, args=(deepcopy(self._rng), self._pool, self._stop), daemon=True
+        )
+        self._producer.start()
+
+    def _produce(self, rng: Generator, pool: queue.Queue, stop: threading.Event) -> None:
+        grid_dims = (self.grid_height, self.grid_width)
+        while not stop.is_set():
+            start = time.perf_counter()
+            grid: Grid | Exception | None = None
+            attempt = 0
+            try:
+                for attempt in range(1, self.max_attempts + 1):
+                    grid = GridFactory.sample_grid(rng, grid_dims, self.mountain_density, self.city_density)
+                    if grid is not None:
+                        break
+            except Exception as e:  # noqa: BLE001
+                # Errors are raised by `grid_from_generator`, a dead producer would leave it waiting forever
+                grid = e
+            if grid is None:
+                grid = ValueError(f"Could not generate a valid grid in {self.max_attempts} attempts.")
+            with self._stats_lock:
+                self._attempts += attempt
+                self._generated += isinstance(grid, Grid)
+                self._generation_time += time.perf_counter() - start
+
+            # Wait for a free slot, but give up when the producer is stopped
+            while not stop.is_set():
+                try:
+                    pool.put((grid, rng.bit_generator.state), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if isinstance(grid, Exception):
+                return
+
+    def grid_from_generator(
+        self,
+        grid_dims: tuple[int, int] | None = None,
+        mountain_density: float | None = None,
+        city_density: float | None = None,
+        general_positions: list[tuple[int, int]] | None = None,
+        seed: int | None = None,
+    ) -> Grid:
+        """
+        Returns the next pre-generated grid. Grids with parameters different from the parameters
+        of the pool are generated synchronously, as by `GridFactory`.
+        """
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        if any(argument is not None for argument in [grid_dims, mountain_density, city_density]):
+            grid = super().grid_from_generator(grid_dims, mountain_density, city_density, general_positions)
+            # Pooled grids were drawn from the generator state before this grid, so they are discarded
+            self._start_producer()
+            return grid
+
+        if self._producer is None:
+            # The pool was closed, e.g. with an environment, it continues from the current generator
+            self._start_producer()
+        start = time.perf_counter()
+        pooled, state = self._pool.get()
+        self._rng.bit_generator.state = state
+        with self._stats_lock:
+            self._served += 1
+            self._wait_time += time.perf_counter() - start
+        if isinstance(pooled, Exception):
+            raise pooled
+        return pooled
+
+    def stats(self) -> dict[str, float]:
+        """
+        Returns statistics of the pool since the producer was (re)started:
+            pooled - number of grids currently waiting in the pool
+            generated - number of valid grids generated
+            acceptance_rate - fraction of sampled grids that were valid
+            generation_latency - mean time (seconds) to generate one valid grid, including rejected samples
+            wait_latency - mean time (seconds) `grid_from_generator` waited for a grid
+        """
+        with self._stats_lock:
+            return {
+                "pooled": self._pool.qsize(),
+                "generated": self._generated,
+                "acceptance_rate": self._generated / self._attempts if self._attempts else 1.0,
+                "generation_latency": self._generation_time / self._generated if self._generated else 0.0,
+                "wait_latency": self._wait_time / self._served if self._served else 0.0,
+            }
+
+    def close(self) -> None:
+        """
+        Stops the producer thread.
+        """
+        if self._producer is not None:
+            self._stop.set()
+            self._producer.join()
+            self._producer = None
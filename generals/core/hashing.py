@@ -0,0 +1,53 @@
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+# Zobrist keys are drawn from a fixed seed, so hashes of equal states match across games and processes
+ZOBRIST_SEED = 0x5EED
+MASK_64 = (1 << 64) - 1
+
+# Number of owner codes with a key, owner indices of agents start at 1 and invisible cells are coded by `FOG_OWNER`
+N_OWNER_CODES = 8
+FOG_OWNER = N_OWNER_CODES - 1
+
+# Keys of state that is not stored in cells
+TIME_PARITY_KEY = 0x2545F4914F6CDD1D
+AGENT_ORDER_KEY = 0x6A09E667F3BCC909
+# Keys of owned land, owned army, opponent land and opponent army in observation hashes
+STATS_KEYS = (0x3C6EF372FE94F82B, 0xA54FF53A5F1D36F1, 0x510E527FADE682D1, 0x9B05688C2B3E6C1F)
+
+
+class ZobristKeys(NamedTuple):
+    """
+    Random 64-bit keys of a grid shape. Hash of a state is the sum (modulo 2^64) of `army` keys multiplied
+    by armies, `owner` keys of owners and `structure` keys multiplied by structure types of all cells.
+    Unlike XOR of keys of (cell, value) pairs, the sum handles unbounded armies and an increment
+    of armies in many cells changes the hash by the sum of their army keys.
+    """
+
+    army: np.ndarray  # (H, W)
+    owner: np.ndarray  # (H, W, N_OWNER_CODES)
+    structure: np.ndarray  # (H, W)
+
+
+@lru_cache(maxsize=16)
+def zobrist_keys(shape: tuple[int, int]) -> ZobristKeys:
+    """
+    Returns read-only keys of a grid shape.
+    """
+    rng = np.random.default_rng([ZOBRIST_SEED, *shape])
+    keys = rng.integers(0, np.iinfo(np.uint64).max, size=shape + (N_OWNER_CODES + 2,), dtype=np.uint64, endpoint=True)
+    keys.flags.writeable = False
+    return ZobristKeys(army=keys[..., 0], owner=keys[..., 2:], structure=keys[..., 1])
+
+
+def compute_hash(keys: ZobristKeys, armies: np.ndarray, owners: np.ndarray, structures: np.ndarray) -> int:
+    """
+    Computes hash of (H, W) armies, owners and structure types from scratch.
+    """
+    # Arithmetic of uint64 arrays wraps around modulo 2^64
+    army_hash = np.sum(keys.army * armies.astype(np.uint64), dtype=np.uint64)
+    owner_hash = np.sum(np.take_along_axis(keys.owner, owners[..., None].astype(np.intp), axis=-1), dtype=np.uint64)
+    structure_hash = np.sum(keys.structure * structures.astype(np.uint64), dtype=np.uint64)
+    return (int(army_hash) + int(owner_hash) + int(structure_hash)) & MASK_64
@@ -1,6 +1,66 @@
 import numpy as np
 
-from generals.core.config import DIRECTIONS
+# Channels of stacked observation tensors, in the order used by `ObservationAsImageWrapper`
+OBSERVATION_CHANNELS = (
+    "armies",
+    "generals",
+    "cities",
+    "mountains",
+    "neutral_cells",
+    "owned_cells",
+    "opponent_cells",
+    "fog_cells",
+    "structures_in_fog",
+    "owned_land_count",
+    "owned_army_count",
+    "opponent_land_count",
+    "opponent_army_count",
+    "timestep",
+    "priority",
+)
+
+
+def compute_passable_directions(passable: np.ndarray) -> np.ndarray:
+    """
+    For each cell and direction (UP, DOWN, LEFT, RIGHT), computes whether
+    moving from the cell in that direction stays in the grid and lands on a passable cell.
+
+    Works on (H, W) as well as batched (B, H, W) passable masks, returning (..., H, W, 4) masks.
+    Since the result depends only on the map, it can be computed once per map.
+    """
+    passable = passable.astype(bool)
+    directions = np.zeros(passable.shape + (4,), dtype=bool)
+    directions[..., 1:, :, 0] = passable[..., :-1, :]  # UP
+    directions[..., :-1, :, 1] = passable[..., 1:, :]  # DOWN
+    directions[..., :, 1:, 2] = passable[..., :, :-1]  # LEFT
+    directions[..., :, :-1, 3] = passable[..., :, 1:]  # RIGHT
+    return directions
+
+
+def compute_action_mask(
+    armies: np.ndarray,
+    owned_cells: np.ndarray,
+    passable_directions: np.ndarray,
+    out: np.ndarray | None = None,
+    scratch: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Computes mask of valid actions from (..., H, W) armies and ownership, so it works for
+    single observations as well as batched (B, H, W) ones. `passable_directions` is the
+    (..., H, W, 4) output of `compute_passable_directions`.
+    If `out` is given, the mask is written into it, and if also a (..., H, W) boolean `scratch`
+    (other than `owned_cells`) is given, nothing is allocated.
+    """
+    if out is None:
+        out = np.empty(passable_directions.shape, dtype=bool)
+    movable = np.greater(armies, 1, out=scratch)
+    np.logical_and(movable, owned_cells, out=movable)
+    # All directions are written at once, which is much faster than writing each strided direction
+    # channel separately. A broadcasting copy is followed by an elementwise operation, as operations
+    # broadcasting an operand allocate temporary buffers
+    np.copyto(out, movable[..., None])
+    np.logical_and(out, passable_directions, out=out)
+    return out
 
 
 class Observation:
@@ -21,6 +81,7 @@ class Observation:
         opponent_army_count: int,
         timestep: int,
         priority: int = 0,
+        passable_directions: np.ndarray | None = None,
     ):
         self.armies = armies
         self.generals = generals
@@ -37,8 +98,39 @@ class Observation:
         self.opponent_army_count = opponent_army_count
         self.timestep = timestep
         self.priority = priority
+        # Optional precomputed output of `compute_passable_directions` for the map, derived from mountains otherwise
+        self.passable_directions = passable_directions
+        # Optional preallocated (H, W, 4) array that `action_mask` writes into and its (H, W) scratch mask
+        self.action_mask_buffer: np.ndarray | None = None
+        self.action_mask_scratch: np.ndarray | None = None
         # armies, generals, cities, mountains, empty, owner, fogged, structure in fog
 
+    @classmethod
+    def allocate(cls, grid_dims: tuple[int, int]) -> "Observation":
+        """
+        Creates an observation with preallocated buffers, that can be filled in place
+        by `Game.agent_observation(agent, out=observation)`.
+        """
+        observation = cls(
+            armies=np.zeros(grid_dims, dtype=int),
+            generals=np.zeros(grid_dims, dtype=bool),
+            cities=np.zeros(grid_dims, dtype=bool),
+            mountains=np.zeros(grid_dims, dtype=bool),
+            neutral_cells=np.zeros(grid_dims, dtype=bool),
+            owned_cells=np.zeros(grid_dims, dtype=bool),
+            opponent_cells=np.zeros(grid_dims, dtype=bool),
+            fog_cells=np.zeros(grid_dims, dtype=bool),
+            structures_in_fog=np.zeros(grid_dims, dtype=bool),
+            owned_land_count=0,
+            owned_army_count=0,
+            opponent_land_count=0,
+            opponent_army_count=0,
+            timestep=0,
+        )
+        observation.action_mask_buffer = np.zeros(grid_dims + (4,), dtype=bool)
+        observation.action_mask_scratch = np.zeros(grid_dims, dtype=bool)
+        return observation
+
     def action_mask(self) -> np.ndarray:
         """
         Function to compute valid actions from a given ownership mask.
@@ -51,37 +143,15 @@ class Observation:
 
             I.e. valid_action_mask[i, j, k] is 1 if action k is valid in cell (i, j).
         """
-        height, width = self.owned_cells.shape
-
-        ownership_channel = self.owned_cells
-        more_than_1_army = (self.armies > 1) * ownership_channel
-        owned_cells_indices = np.argwhere(more_than_1_army)
-        valid_action_mask = np.zeros((height, width, 4), dtype=bool)
-
-        if np.sum(ownership_channel) == 0:
-            return valid_action_mask
-
-        for channel_index, direction in enumerate(DIRECTIONS):
-            destinations = owned_cells_indices + direction.value
-
-            # check if destination is in grid bounds
-            in_first_boundary = np.all(destinations >= 0, axis=1)
-            in_height_boundary = destinations[:, 0] < height
-            in_width_boundary = destinations[:, 1] < width
-            destinations = destinations[in_first_boundary & in_height_boundary & in_width_boundary]
-
-            # check if destination is road
-            passable_cells = 1 - self.mountains
-            # assert that every value is either 0 or 1 in passable cells
-            assert np.all(np.isin(passable_cells, [0, 1])), f"{passable_cells}"
-            passable_cell_indices = passable_cells[destinations[:, 0], destinations[:, 1]] == 1
-            action_destinations = destinations[passable_cell_indices]
-
-            # get valid action mask for a given direction
-            valid_source_indices = action_destinations - direction.value
-            valid_action_mask[valid_source_indices[:, 0], valid_source_indices[:, 1], channel_index] = 1.0
-
-        return valid_action_mask
+        if self.passable_directions is None:
+            self.passable_directions = compute_passable_directions(self.mountains == 0)
+        return compute_action_mask(
+            self.armies,
+            self.owned_cells,
+            self.passable_directions,
+            out=self.action_mask_buffer,
+            scratch=self.action_mask_scratch,
+        )
 
     def as_dict(self, with_mask=True):
         _obs = {
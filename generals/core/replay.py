@@ -1,42 +1,425 @@
+import os
 import pickle
+import queue
+import threading
 import time
-from copy import deepcopy
+import zipfile
+import zlib
+from collections.abc import Iterator
 from typing import Any
 
+import numpy as np
+
 from generals.core.channels import Channels
-from generals.core.game import Game
+from generals.core.game import Action, Game
 from generals.core.grid import Grid
 from generals.gui import GUI
 from generals.gui.event_handler import ReplayCommand
-from generals.gui.properties import GuiMode
+from generals.gui.properties import GuiMode, Properties
+from generals.gui.rendering import Renderer
+
+# Version of the binary replay format, increased whenever the stored arrays change
+REPLAY_FORMAT_VERSION = 3
+PASS_ACTION = np.array([1, 0, 0, 0, 0], dtype=np.int16)
+# Channels of frame stacks, see `Replay.frames`
+FRAME_CHANNELS = ["armies", "owners"]
+
+
+def frame_checksum(armies: np.ndarray, owners: np.ndarray) -> int:
+    """
+    Returns CRC32 checksum of armies and owners of a frame.
+    """
+    checksum = zlib.crc32(np.ascontiguousarray(armies, dtype=np.int32).tobytes())
+    return zlib.crc32(np.ascontiguousarray(owners, dtype=np.int8).tobytes(), checksum)
+
+
+def _read_array(data: Any, key: str) -> np.ndarray | None:
+    """
+    Returns array `key` of a replay archive, or None if it is missing.
+    Arrays written by `ReplayWriter` are split into chunks `key_00000`, `key_00001`, ...
+    """
+    if key in data.files:
+        return data[key]
+    chunks = sorted(name for name in data.files if name.startswith(key + "_") and name[len(key) + 1 :].isdigit())
+    if not chunks:
+        return None
+    return np.concatenate([data[name] for name in chunks])
+
+
+def _write_array(archive: zipfile.ZipFile, key: str, array: Any) -> None:
+    # Members are stored in the same way as by np.savez, so the archive can be read by np.load
+    with archive.open(key + ".npy", "w", force_zip64=True) as f:
+        np.lib.format.write_array(f, np.asanyarray(array), allow_pickle=False)
 
 
 class Replay:
-    def __init__(self, name: str, grid: Grid, agent_data: dict[str, Any]):
+    """
+    Replay of a game. The grid is stored once, frames are stored in one of two ways:
+        - action log: actions of every step, frames are rebuilt by re-simulating the game
+          from the nearest keyframe, which is stored every `keyframe_interval` frames
+        - diffs: every frame as a sparse diff against the previous frame, i.e. indices of cells
+          that changed and their new armies and owners, used when actions of the game are not known
+    Other channels than armies and owners do not change during a game.
+
+    Replays are stored as compressed `.npz` archives, which are loaded without pickle.
+    Replays pickled by older versions (`.pkl`) can still be loaded.
+    Optionally, all frames are stored also as a `.frames.npy` stack, which is memory-mapped on load,
+    so `replay[t]` reads only the `t`-th frame from disk.
+    """
+
+    def __init__(self, name: str, grid: Grid, agent_data: dict[str, Any], keyframe_interval: int = 50):
+        """
+        Args:
+            keyframe_interval: number of frames between keyframes of stored action logs,
+                seeking a frame re-simulates at most this many steps
+        """
+        assert keyframe_interval >= 1, "Keyframe interval must be positive."
         self.name = name
         self.grid = grid
         self.agent_data = agent_data
+        self.keyframe_interval = keyframe_interval
+        self._n_frames = 0
+
+        self._indices: list[np.ndarray] = []
+        self._armies: list[np.ndarray] = []
+        self._owners: list[np.ndarray] = []
+        # Armies and owners of the last added frame, diffs of new frames are computed against them
+        initial_armies, initial_owners = self._initial_state()
+        self._last_armies, self._last_owners = initial_armies.copy(), initial_owners.copy()
+        self._cursor = (-1, initial_armies, initial_owners)
+
+        # Actions of every step, None if some frame was added without them
+        self._actions: list[np.ndarray] | None = []
+        # Keyframes and checksums are stored only in loaded action logs, recorded replays derive them from diffs
+        self._keyframes: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+        self._checksums: np.ndarray | None = None
+        # Game re-simulated by `_frame_from_actions` and the frame it is in, the game time stops when the game ends
+        self._game: Game | None = None
+        self._game_frame = 0
+        # Memory-mapped frame stack of loaded replays
+        self._frames: np.ndarray | None = None
+
+    def __setstate__(self, state: dict) -> None:
+        # Replays pickled by older versions store full copies of channels of every frame
+        game_states = state.pop("game_states", None)
+        if game_states is None:
+            self.__dict__.update(state)
+            return
+        replay = Replay(state["name"], state["grid"], state["agent_data"])
+        for channels in game_states:
+            replay.add_state(channels)
+        self.__dict__.update(replay.__dict__)
+
+    def __len__(self) -> int:
+        return self._n_frames
+
+    def __getitem__(self, t: int) -> Channels:
+        return self.frame(t + len(self) if t < 0 else t)
+
+    @property
+    def agents(self) -> list[str]:
+        return list(self.agent_data.keys())
+
+    @property
+    def has_actions(self) -> bool:
+        """
+        True if actions of all steps are known, so frames can be re-simulated.
+        """
+        return self._actions is not None and len(self._actions) == max(len(self) - 1, 0)
+
+    def _initial_state(self) -> tuple[np.ndarray, np.ndarray]:
+        channels = Channels(self.grid.codes, self.agents)
+        return channels.armies.flatten(), channels.owners.flatten()
+
+    def add_state(self, state: Channels, actions: dict[str, Action] | None = None) -> None:
+        """
+        Records channels of the next frame, only cells that changed since the previous frame are stored.
+
+        Args:
+            state: channels of the frame
+            actions: actions of agents that led from the previous frame to this one,
+                agents missing in `actions` passed the turn
+        """
+        armies, owners = state.armies.ravel(), state.owners.ravel()
+        changed = np.flatnonzero((armies != self._last_armies) | (owners != self._last_owners))
+        self._indices.append(changed.astype(np.int32))
+        self._armies.append(armies[changed].astype(np.int32))
+        self._owners.append(owners[changed].astype(np.int8))
+        self._last_armies[changed] = armies[changed]
+        self._last_owners[changed] = owners[changed]
+
+        if self._n_frames > 0 and self._actions is not None:
+            if actions is None:
+                self._actions = None
+            else:
+                self._actions.append(np.array([actions.get(agent, PASS_ACTION) for agent in self.agents], np.int16))
+        self._n_frames += 1
+
+    def _iterate_diffs(self) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+        """
+        Yields (t, armies, owners) of all frames rebuilt from diffs, arrays are modified in place.
+        """
+        armies, owners = self._initial_state()
+        for t in range(len(self)):
+            armies[self._indices[t]] = self._armies[t]
+            owners[self._indices[t]] = self._owners[t]
+            yield t, armies, owners
+
+    def _frame_from_diffs(self, t: int) -> tuple[np.ndarray, np.ndarray]:
+        # Diffs are applied from the last requested frame, so playing a replay forward is incremental
+        cursor, armies, owners = self._cursor
+        if t < cursor:
+            cursor, (armies, owners) = -1, self._initial_state()
+        armies, owners = armies.copy(), owners.copy()
+        for frame in range(cursor + 1, t + 1):
+            armies[self._indices[frame]] = self._armies[frame]
+            owners[self._indices[frame]] = self._owners[frame]
+        self._cursor = (t, armies, owners)
+        return armies, owners
+
+    def _step_actions(self, t: int) -> dict[str, Action]:
+        """
+        Returns actions of the step from frame `t` to frame `t + 1`.
+        """
+        assert self._actions is not None
+        return dict(zip(self.agents, self._actions[t]))
+
+    def _idle_steps(self, start: int, stop: int) -> int:
+        """
+        Returns the number of consecutive steps from frame `start` (up to frame `stop`) in which all agents pass,
+        they are fast-forwarded by `Game.advance`.
+        """
+        assert self._actions is not None
+        n = 0
+        while start + n < stop and (self._actions[start + n][:, 0] == 1).all():
+            n += 1
+        return n
+
+    def _frame_from_actions(self, t: int) -> tuple[np.ndarray, np.ndarray]:
+        # The game is re-simulated from the nearest keyframe, or continued if it is already closer to `t`
+        keyframe = t - t % self.keyframe_interval
+        game, frame = self._game, self._game_frame
+        if game is None or not keyframe <= frame <= t:
+            game = Game(self.grid, self.agents)
+            armies, owners = self._keyframes[keyframe]
+            game.channels.armies = armies.reshape(game.grid_dims).astype(int)
+            game.channels.owners = owners.reshape(game.grid_dims).copy()
+            game.time = frame = keyframe
+            # Priority of agents alternates every step
+            game.agent_order = self.agents[::-1] if keyframe % 2 else self.agents[:]
+        while frame < t:
+            idle_steps = self._idle_steps(frame, t)
+            if idle_steps > 0:
+                game.advance(idle_steps)
+                frame += idle_steps
+            else:
+                game.apply_actions(self._step_actions(frame))
+                frame += 1
+        self._game, self._game_frame = game, frame
+        return game.channels.armies.ravel(), game.channels.owners.ravel()
+
+    def _frame_state(self, t: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns flat armies and owners of frame `t`.
+        """
+        if not 0 <= t < len(self):
+            raise IndexError(f"Frame {t} is out of range of a replay with {len(self)} frames.")
+        if self._frames is not None:
+            return self._frames[t, 0].ravel(), self._frames[t, 1].ravel()
+        if len(self._indices) == len(self):
+            return self._frame_from_diffs(t)
+        return self._frame_from_actions(t)
+
+    def frame(self, t: int) -> Channels:
+        """
+        Returns channels of frame `t`.
+        """
+        channels = Channels(self.grid.codes, self.agents)
+        armies, owners = self._frame_state(t)
+        channels.armies = armies.reshape(channels.armies.shape).astype(channels.armies.dtype)
+        channels.owners = owners.reshape(channels.owners.shape).copy()
+        return channels
+
+    def _iterate_frames(self) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+        """
+        Yields (t, armies, owners) of all frames in order, arrays must not be modified.
+        """
+        if len(self._indices) == len(self):
+            yield from self._iterate_diffs()
+            return
+        for t in range(len(self)):
+            yield (t, *self._frame_state(t))
+
+    @property
+    def frames(self) -> np.ndarray:
+        """
+        (T, C, H, W) int32 stack of all frames, channels are listed in `FRAME_CHANNELS`.
+        For replays stored with `frames=True` it is a read-only memmap, which can also be opened directly
+        by `np.load(path, mmap_mode="r")`, other replays build it in memory.
+        """
+        if self._frames is not None:
+            return self._frames
+        frames = np.empty((len(self), len(FRAME_CHANNELS)) + self.grid.codes.shape, dtype=np.int32)
+        self._write_frames(frames)
+        return frames
+
+    def _write_frames(self, out: np.ndarray) -> None:
+        for t, armies, owners in self._iterate_frames():
+            out[t, 0].flat = armies
+            out[t, 1].flat = owners
+
+    def checksums(self) -> np.ndarray:
+        """
+        Returns checksums (see `frame_checksum`) of recorded frames.
+        """
+        if self._checksums is None:
+            checksums = [frame_checksum(armies, owners) for _, armies, owners in self._iterate_diffs()]
+            return np.array(checksums, dtype=np.uint32)
+        return self._checksums
 
-        self.game_states: list[Channels] = []
+    def keyframes(self) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns {t: (armies, owners)} of flat arrays of every `keyframe_interval`-th frame.
+        """
+        if not self._keyframes:
+            return {
+                t: (armies.copy(), owners.copy())
+                for t, armies, owners in self._iterate_diffs()
+                if t % self.keyframe_interval == 0
+            }
+        return self._keyframes
 
-    def add_state(self, state):
-        self.game_states.append(state)
+    def verify(self) -> list[int]:
+        """
+        Re-simulates the game from its grid using recorded actions and returns frames
+        whose checksums do not match the recorded checksums, i.e. an empty list for a valid replay.
+        """
+        if not self.has_actions:
+            raise ValueError("Replay does not contain actions of all steps, so it cannot be re-simulated.")
+        checksums = self.checksums()
+        game = Game(self.grid, self.agents)
+        mismatches = set()
+        for t in range(len(self)):
+            if t > 0:
+                game.apply_actions(self._step_actions(t - 1))
+            if frame_checksum(game.channels.armies, game.channels.owners) != checksums[t]:
+                mismatches.add(t)
+        # Keyframes used for seeking must match the recorded frames as well
+        for t, (armies, owners) in self.keyframes().items():
+            if frame_checksum(armies, owners) != checksums[t]:
+                mismatches.add(t)
+        return sorted(mismatches)
 
-    def store(self):
-        path = self.name if self.name.endswith(".pkl") else self.name + ".pkl"
-        with open(path, "wb") as f:
-            pickle.dump(self, f)
+    def store(self, frames: bool = False) -> None:
+        """
+        Stores the replay as an action log if actions of all steps are known, otherwise as diffs.
+
+        Args:
+            frames: if True, all frames are stored also as a (T, C, H, W) `.frames.npy` stack (see `frames`)
+                next to the replay, so that loaded replays read frames directly from disk
+        """
+        base_path = self.name.removesuffix(".npz")
+        path = base_path + ".npz"
+        if frames:
+            # Frames are written one by one into the file, the stack is never held in memory
+            shape = (len(self), len(FRAME_CHANNELS)) + self.grid.codes.shape
+            stack = np.lib.format.open_memmap(base_path + ".frames.npy", mode="w+", dtype=np.int32, shape=shape)
+            self._write_frames(stack)
+            stack.flush()
+            del stack
+        arrays: dict[str, Any] = {
+            "version": REPLAY_FORMAT_VERSION,
+            "grid": self.grid.codes,
+            "agents": np.array(self.agents),
+            "colors": np.array([data["color"] for data in self.agent_data.values()], dtype=np.uint8),
+            "checksums": self.checksums(),
+        }
+        if self.has_actions:
+            keyframes = self.keyframes()
+            arrays["keyframe_interval"] = self.keyframe_interval
+            arrays["keyframe_armies"] = np.array([keyframes[t][0] for t in sorted(keyframes)], dtype=np.int32)
+            arrays["keyframe_owners"] = np.array([keyframes[t][1] for t in sorted(keyframes)], dtype=np.int8)
+            arrays["actions"] = np.array(self._actions, dtype=np.int16).reshape(-1, len(self.agents), 5)
+        else:
+            # Diffs of all frames are concatenated, frame t spans frame_offsets[t]:frame_offsets[t + 1]
+            arrays["frame_offsets"] = np.cumsum([0] + [len(indices) for indices in self._indices])
+            arrays["indices"] = np.concatenate([np.empty(0, dtype=np.int32)] + self._indices)
+            arrays["armies"] = np.concatenate([np.empty(0, dtype=np.int32)] + self._armies)
+            arrays["owners"] = np.concatenate([np.empty(0, dtype=np.int8)] + self._owners)
+        np.savez_compressed(path, **arrays)
         print(f"Replay successfully stored as {path}")
 
     @classmethod
-    def load(cls, path):
-        path = path if path.endswith(".pkl") else path + ".pkl"
-        with open(path, "rb") as f:
-            return pickle.load(f)
+    def load(cls, path: str) -> "Replay":
+        """
+        Loads a replay stored by `store`, or a replay pickled by older versions if `path` ends with `.pkl`.
+        Without an extension, `.npz` is preferred over `.pkl`.
+        """
+        if not path.endswith((".npz", ".pkl")):
+            path = path + ".npz" if os.path.exists(path + ".npz") else path + ".pkl"
+        if path.endswith(".pkl"):
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        replay = cls._load_npz(path)
+        frames_path = path.removesuffix(".npz") + ".frames.npy"
+        if os.path.exists(frames_path):
+            replay._frames = np.load(frames_path, mmap_mode="r")
+            assert replay._frames.shape[0] == len(replay), f"{frames_path} does not match {path}."
+        return replay
+
+    @classmethod
+    def _load_npz(cls, path: str) -> "Replay":
+        with np.load(path, allow_pickle=False) as data:
+            version = int(data["version"])
+            if version > REPLAY_FORMAT_VERSION:
+                raise ValueError(f"Replay format version {version} is not supported, update the package.")
+            agent_data = {
+                str(agent): {"color": tuple(int(c) for c in color)}
+                for agent, color in zip(data["agents"], data["colors"])
+            }
+            replay = cls(path.removesuffix(".npz"), Grid(data["grid"]), agent_data)
+            replay._checksums = _read_array(data, "checksums")
+
+            actions = _read_array(data, "actions")
+            if actions is None and "keyframe_interval" in data.files:
+                # Archives of `ReplayWriter` hold only the header until the first frames are flushed
+                replay.keyframe_interval = int(data["keyframe_interval"])
+                return replay
+            if actions is not None:
+                replay.keyframe_interval = int(data["keyframe_interval"])
+                replay._actions = list(actions)
+                replay._n_frames = len(replay._actions) + 1
+                keyframes = zip(_read_array(data, "keyframe_armies"), _read_array(data, "keyframe_owners"))  # type: ignore[arg-type]
+                replay._keyframes = {i * replay.keyframe_interval: keyframe for i, keyframe in enumerate(keyframes)}
+                return replay
+
+            # Replays stored as diffs do not contain actions
+            offsets = data["frame_offsets"]
+            replay._n_frames = len(offsets) - 1
+            if len(replay) > 0:
+                replay._indices = np.split(data["indices"], offsets[1:-1])
+                replay._armies = np.split(data["armies"], offsets[1:-1])
+                replay._owners = np.split(data["owners"], offsets[1:-1])
+            if len(replay) > 1:
+                replay._actions = None
+        if len(replay) > 0:
+            replay._last_armies, replay._last_owners = (array.copy() for array in replay._frame_state(len(replay) - 1))
+        return replay
+
+    def rgb_frames(self, start: int = 0, stop: int | None = None, step: int = 1) -> Iterator[np.ndarray]:
+        """
+        Yields frames `start:stop:step` rendered offscreen as (height, width, 3) uint8 RGB images,
+        e.g. to encode the replay to a video. No window is opened, so this works on headless servers.
+        """
+        game = Game(self.grid, self.agents)
+        renderer = Renderer(Properties(game, self.agent_data, GuiMode.REPLAY), offscreen=True)
+        for t in range(*slice(start, stop, step).indices(len(self))):
+            game.channels = self.frame(t)
+            game.time = t
+            yield renderer.rgb_array()
 
     def play(self):
-        agents = [agent for agent in self.agent_data.keys()]
-        game = Game(self.grid, agents)
+        game = Game(self.grid, self.agents)
         gui = GUI(game, self.agent_data, mode=GuiMode.REPLAY)
         gui_properties = gui.properties
 
@@ -52,17 +435,138 @@ class Replay:
             if command.restart:
                 game_step = 0
             # If we control replay, change game state
-            game_step = max(0, min(len(self.game_states) - 1, game_step + command.frame_change))
+            game_step = max(0, min(len(self) - 1, game_step + command.frame_change))
             if gui_properties.paused and game_step != game.time:
-                game.channels = deepcopy(self.game_states[game_step])
+                game.channels = self.frame(game_step)
                 game.time = game_step
                 last_move_time = _t
             # If we are not paused, play the game
             elif _t - last_move_time > (1 / gui_properties.game_speed) * 0.512 and not gui_properties.paused:
                 if game.is_done():
                     gui_properties.paused = True
-                game_step = min(len(self.game_states) - 1, game_step + 1)
-                game.channels = deepcopy(self.game_states[game_step])
+                game_step = min(len(self) - 1, game_step + 1)
+                game.channels = self.frame(game_step)
                 game.time = game_step
                 last_move_time = _t
             gui_properties.clock.tick(60)
+
+
+class ReplayWriter:
+    """
+    Writes an action log replay (see `Replay`) while the game is played.
+
+    Frames are buffered and every `flush_interval` frames handed over to a background thread, which appends
+    them as new chunks to the `.npz` archive. So memory does not grow with the length of the game and the file
+    is a valid replay, loadable by `Replay.load`, after every flush. `close` writes the remaining frames.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        grid: Grid,
+        agent_data: dict[str, Any],
+        keyframe_interval: int = 50,
+        flush_interval: int = 100,
+    ):
+        """
+        Args:
+            keyframe_interval: see `Replay`
+            flush_interval: number of frames after which buffered frames are written
+        """
+        assert keyframe_interval >= 1 and flush_interval >= 1, "Intervals must be positive."
+        self.path = name.removesuffix(".npz") + ".npz"
+        self.agents = list(agent_data.keys())
+        self.keyframe_interval = keyframe_interval
+        self.flush_interval = flush_interval
+        self._n_frames = 0
+        self._n_chunks = 0
+        self._buffer: dict[str, list] = {"actions": [], "checksums": [], "keyframe_armies": [], "keyframe_owners": []}
+        self._closed = False
+        self._error: OSError | None = None
+
+        # Arrays describing the game are written right away, so the file is a valid replay from the start
+        with zipfile.ZipFile(self.path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            _write_array(archive, "version", REPLAY_FORMAT_VERSION)
+            _write_array(archive, "grid", grid.codes)
+            _write_array(archive, "agents", np.array(self.agents))
+            _write_array(archive, "colors", np.array([data["color"] for data in agent_data.values()], dtype=np.uint8))
+            _write_array(archive, "keyframe_interval", keyframe_interval)
+
+        # Bounded queue blocks the game only if the disk cannot keep up
+        self._queue: queue.Queue[dict[str, np.ndarray] | None] = queue.Queue(maxsize=8)
+        self._thread = threading.Thread(target=self._write_chunks, daemon=True)
+        self._thread.start()
+
+    def __len__(self) -> int:
+        return self._n_frames
+
+    def _write_chunks(self) -> None:
+        while (chunk := self._queue.get()) is not None:
+            if self._error is None:
+                try:
+                    with zipfile.ZipFile(self.path, "a", compression=zipfile.ZIP_DEFLATED) as archive:
+                        for key, array in chunk.items():
+                            _write_array(archive, key, array)
+                except OSError as error:
+                    self._error = error
+            self._queue.task_done()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def add_state(self, state: Channels, actions: dict[str, Action] | None = None) -> None:
+        """
+        Records channels of the next frame, see `Replay.add_state`. Actions are required for all frames but the first.
+        """
+        assert not self._closed, "Replay writer is closed."
+        self._raise_error()
+        if self._n_frames > 0:
+            if actions is None:
+                raise ValueError("Actions that led to a frame are required for all frames but the first.")
+            self._buffer["actions"].append([actions.get(agent, PASS_ACTION) for agent in self.agents])
+        self._buffer["checksums"].append(frame_checksum(state.armies, state.owners))
+        if self._n_frames % self.keyframe_interval == 0:
+            self._buffer["keyframe_armies"].append(state.armies.ravel().astype(np.int32))
+            self._buffer["keyframe_owners"].append(state.owners.ravel().astype(np.int8))
+        self._n_frames += 1
+        if self._n_frames % self.flush_interval == 0:
+            self.flush()
+
+    def flush(self, wait: bool = False) -> None:
+        """
+        Hands buffered frames over to the writing thread.
+
+        Args:
+            wait: if True, blocks until all frames handed over so far are written
+        """
+        if self._buffer["checksums"]:
+            self._hand_over()
+        if wait:
+            self._queue.join()
+            self._raise_error()
+
+    def _hand_over(self) -> None:
+        chunk: dict[str, np.ndarray] = {
+            "actions": np.array(self._buffer["actions"], dtype=np.int16).reshape(-1, len(self.agents), 5),
+            "checksums": np.array(self._buffer["checksums"], dtype=np.uint32),
+        }
+        if self._buffer["keyframe_armies"]:
+            chunk["keyframe_armies"] = np.array(self._buffer["keyframe_armies"])
+            chunk["keyframe_owners"] = np.array(self._buffer["keyframe_owners"])
+        self._queue.put({f"{key}_{self._n_chunks:05d}": array for key, array in chunk.items()})
+        self._n_chunks += 1
+        self._buffer = {key: [] for key in self._buffer}
+
+    def close(self) -> None:
+        """
+        Writes remaining frames and waits until everything is written.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+        print(f"Replay successfully stored as {self.path}")
@@ -0,0 +1,6 @@
+from generals.data.dataset import Dataset, DatasetBuilder
+
+__all__ = [
+    "Dataset",
+    "DatasetBuilder",
+]
@@ -0,0 +1,244 @@
+import json
+import multiprocessing
+import os
+import time
+from collections.abc import Iterator, Sequence
+from copy import deepcopy
+from typing import Any
+
+import numpy as np
+
+from generals.agents import AgentFactory
+from generals.core.game import Game
+from generals.core.grid import GridFactory
+from generals.core.grid_pool import GridPool
+from generals.core.observation import OBSERVATION_CHANNELS
+
+DATASET_FORMAT_VERSION = 1
+INDEX_FILE = "index.json"
+# Arrays stored for every sample, i.e. for every step of every recorded agent
+SAMPLE_KEYS = ["observations", "action_masks", "actions", "rewards", "dones", "games", "players", "timesteps"]
+
+
+class DatasetBuilder:
+    """
+    Plays games between agents created by `AgentFactory` in parallel worker processes and stores
+    what every agent saw and did in every step: its (H, W, C) observation tensor (see `Game.agent_observation_tensor`),
+    action mask, action, reward and whether the game ended.
+
+    Samples are written into shards of `shard_size` samples, every shard is an `.npz` file split into
+    chunks of `chunk_size` samples, so that readers hold only one chunk in memory. Shards are described
+    by `index.json` in the dataset directory, see `Dataset`.
+    """
+
+    def __init__(
+        self,
+        agent_types: Sequence[str] = ("Expander", "Random"),
+        grid_factory: GridFactory | None = None,
+        truncation: int = 500,
+        channels: Sequence[str] = OBSERVATION_CHANNELS,
+        normalization: dict[str, float] | None = None,
+        observation_dtype: type = np.float32,
+        shard_size: int = 10_000,
+        chunk_size: int = 1_000,
+        n_workers: int = 1,
+        compress: bool = True,
+        seed: int = 0,
+        context: str | None = None,
+    ):
+        """
+        Args:
+            agent_types: types of both players, i-th player has id `player_i`
+            truncation: games are cut after this many steps
+            channels, normalization, observation_dtype: see `Game.agent_observation_tensor`
+            shard_size: number of samples in a shard (the last shard of each worker may be smaller)
+            chunk_size: number of samples in a chunk of a shard
+            n_workers: number of processes playing games, games are split among them evenly
+            compress: if False, shards are stored uncompressed, which is faster to write and read
+            seed: seed of grids and agents, game `i` is the same in every dataset built with the same seed
+            context: multiprocessing start method, e.g. "fork", "spawn" or "forkserver"
+        """
+        assert len(agent_types) == 2, "Games are played by exactly two agents."
+        assert shard_size >= chunk_size >= 1, "Shards must consist of at least one chunk."
+        self.agent_types = list(agent_types)
+        self.grid_factory = grid_factory if grid_factory is not None else GridFactory()
+        self.truncation = truncation
+        self.channels = channels
+        self.normalization = normalization
+        self.observation_dtype = np.dtype(observation_dtype)
+        self.shard_size = shard_size
+        self.chunk_size = chunk_size
+        self.n_workers = n_workers
+        self.compress = compress
+        self.seed = seed
+        self.context = context
+
+    def build(self, path: str, n_games: int) -> dict[str, Any]:
+        """
+        Plays `n_games` games and stores their samples in directory `path`. Returns the index of the dataset.
+        """
+        os.makedirs(path, exist_ok=True)
+        start = time.perf_counter()
+        game_splits = [split.tolist() for split in np.array_split(np.arange(n_games), self.n_workers) if len(split)]
+        if self.n_workers == 1:
+            shards = [_build_shards(self, path, 0, game_splits[0])] if game_splits else []
+        else:
+            with multiprocessing.get_context(self.context).Pool(self.n_workers) as pool:
+                shards = pool.starmap(_build_shards, [(self, path, i, games) for i, games in enumerate(game_splits)])
+
+        index = {
+            "version": DATASET_FORMAT_VERSION,
+            "agent_types": self.agent_types,
+            "grid_dims": [self.grid_factory.grid_height, self.grid_factory.grid_width],
+            "channels": self.channels,
+            "observation_dtype": self.observation_dtype.name,
+            "seed": self.seed,
+            "n_games": n_games,
+            "n_samples": sum(shard["n_samples"] for worker_shards in shards for shard in worker_shards),
+            "shards": [shard for worker_shards in shards for shard in worker_shards],
+        }
+        with open(os.path.join(path, INDEX_FILE), "w") as f:
+            json.dump(index, f, indent=2)
+        samples_per_second = index["n_samples"] / (time.perf_counter() - start)
+        print(f"Dataset of {index['n_samples']} samples stored in {path} ({samples_per_second:.0f} samples/s)")
+        return index
+
+    def play_game(self, game_index: int) -> dict[str, np.ndarray]:
+        """
+        Plays game `game_index` and returns its samples, samples of both agents alternate in every step.
+        """
+        grid_seed, *agent_seeds = np.random.SeedSequence([self.seed, game_index]).generate_state(3)
+        if isinstance(self.grid_factory, GridPool):
+            # Every game draws a single grid from its own generator, a copied pool would leak its producer thread
+            factory = self.grid_factory
+            grid_factory = GridFactory(
+                grid_dims=(factory.grid_height, factory.grid_width),
+                mountain_density=factory.mountain_density,
+                city_density=factory.city_density,
+                general_positions=factory.general_positions,
+                max_attempts=factory.max_attempts,
+            )
+        else:
+            grid_factory = deepcopy(self.grid_factory)
+        grid_factory.rng = np.random.default_rng(grid_seed)
+        agents = [
+            AgentFactory.make_agent(agent_type, id=f"player_{i}", seed=int(agent_seed))
+            for i, (agent_type, agent_seed) in enumerate(zip(self.agent_types, agent_seeds))
+        ]
+        game = Game(grid_factory.grid_from_generator(), [agent.id for agent in agents])
+
+        samples: dict[str, list] = {key: [] for key in SAMPLE_KEYS}
+        observation_shape = game.grid_dims + (len(self.channels),)
+        done = False
+        while not done:
+            actions = {}
+            for agent in agents:
+                observation = np.empty(observation_shape, dtype=self.observation_dtype)
+                tensor = game.agent_observation_tensor(agent.id, self.channels, self.normalization, out=observation)
+                samples["observations"].append(tensor["observation"])
+                samples["action_masks"].append(tensor["action_mask"])
+                actions[agent.id] = agent.act(game.agent_observation(agent.id).as_dict())
+
+            timestep = game.time
+            game.apply_actions(actions)
+            terminated = game.is_done()
+            done = terminated or game.time >= self.truncation
+            for player, agent in enumerate(agents):
+                samples["actions"].append(actions[agent.id])
+                samples["rewards"].append((1 if game.agent_won(agent.id) else -1) if terminated else 0)
+                samples["dones"].append(done)
+                samples["games"].append(game_index)
+                samples["players"].append(player)
+                samples["timesteps"].append(timestep)
+
+        return {
+            "observations": np.stack(samples["observations"]),
+            "action_masks": np.stack(samples["action_masks"]),
+            "actions": np.array(samples["actions"], dtype=np.int16),
+            "rewards": np.array(samples["rewards"], dtype=np.float32),
+            "dones": np.array(samples["dones"], dtype=bool),
+            "games": np.array(samples["games"], dtype=np.int32),
+            "players": np.array(samples["players"], dtype=np.int8),
+            "timesteps": np.array(samples["timesteps"], dtype=np.int32),
+        }
+
+
+def _build_shards(builder: DatasetBuilder, path: str, worker: int, game_indices: list[int]) -> list[dict[str, Any]]:
+    """
+    Plays games of one worker and writes their samples into shards, returns index entries of the shards.
+    """
+    shards: list[dict[str, Any]] = []
+    buffer: list[dict[str, np.ndarray]] = []
+    n_buffered = 0
+
+    def write_shard(n_samples: int) -> None:
+        nonlocal buffer, n_buffered
+        samples = {key: np.concatenate([game[key] for game in buffer]) for key in SAMPLE_KEYS}
+        arrays: dict[str, Any] = {}
+        chunks = []
+        for chunk, start in enumerate(range(0, n_samples, builder.chunk_size)):
+            stop = min(start + builder.chunk_size, n_samples)
+            chunks.append(stop - start)
+            for key in SAMPLE_KEYS:
+                arrays[f"{key}_{chunk:04d}"] = samples[key][start:stop]
+        file = f"shard-{worker:03d}-{len(shards):05d}.npz"
+        if builder.compress:
+            np.savez_compressed(os.path.join(path, file), **arrays)
+        else:
+            np.savez(os.path.join(path, file), **arrays)
+        shards.append({"file": file, "n_samples": n_samples, "chunks": chunks})
+        # Samples that did not fit into the shard start the next one
+        buffer = [{key: samples[key][n_samples:] for key in SAMPLE_KEYS}]
+        n_buffered -= n_samples
+
+    for game_index in game_indices:
+        buffer.append(builder.play_game(game_index))
+        n_buffered += len(buffer[-1]["actions"])
+        while n_buffered >= builder.shard_size:
+            write_shard(builder.shard_size)
+    if n_buffered > 0:
+        write_shard(n_buffered)
+    return shards
+
+
+class Dataset:
+    """
+    Reads a dataset built by `DatasetBuilder`. Data are streamed chunk by chunk, every chunk is a dictionary
+    of arrays listed in `SAMPLE_KEYS` with a leading sample dimension.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        if self.index["version"] > DATASET_FORMAT_VERSION:
+            raise ValueError(f"Dataset format version {self.index['version']} is not supported, update the package.")
+
+    def __len__(self) -> int:
+        return self.index["n_samples"]
+
+    def __iter__(self) -> Iterator[dict[str, np.ndarray]]:
+        return self.iter_chunks()
+
+    @property
+    def n_shards(self) -> int:
+        return len(self.index["shards"])
+
+    def iter_chunks(
+        self, shards: Sequence[int] | None = None, shuffle: bool = False, seed: int | None = None
+    ) -> Iterator[dict[str, np.ndarray]]:
+        """
+        Yields chunks of given shards (all by default), e.g. data loader workers may read disjoint sets of shards.
+
+        Args:
+            shards: indices of shards to read
+            shuffle: if True, shards are read in random order, chunks of a shard are still read in order
+        """
+        order = list(range(self.n_shards)) if shards is None else list(shards)
+        if shuffle:
+            np.random.default_rng(seed).shuffle(order)
+        for shard in order:
+            shard_info = self.index["shards"][shard]
+            with np.load(os.path.join(self.path, shard_info["file"]), allow_pickle=False) as data:
+                for chunk in range(len(shard_info["chunks"])):
+                    yield {key: data[f"{key}_{chunk:04d}"] for key in SAMPLE_KEYS}
@@ -1,7 +1,11 @@
 from generals.envs.gymnasium_generals import GymnasiumGenerals
 from generals.envs.pettingzoo_generals import PettingZooGenerals
+from generals.envs.shared_memory_vector_generals import GeneralsSharedMemoryVectorEnv
+from generals.envs.vector_generals import GeneralsVectorEnv
 
 __all__ = [
     "PettingZooGenerals",
     "GymnasiumGenerals",
+    "GeneralsVectorEnv",
+    "GeneralsSharedMemoryVectorEnv",
 ]
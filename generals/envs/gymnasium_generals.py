@@ -1,16 +1,17 @@
-from collections.abc import Callable
-from copy import deepcopy
+from collections.abc import Callable, Sequence
 from typing import Any, SupportsFloat, TypeAlias
 
 import gymnasium as gym
+import numpy as np
 
 from generals.agents import Agent, AgentFactory
 from generals.core.game import Action, Game, Info
 from generals.core.grid import GridFactory
-from generals.core.observation import Observation
-from generals.core.replay import Replay
+from generals.core.observation import OBSERVATION_CHANNELS, Observation
+from generals.core.replay import ReplayWriter
 from generals.gui import GUI
-from generals.gui.properties import GuiMode
+from generals.gui.properties import GuiMode, Properties
+from generals.gui.rendering import Renderer
 
 Reward: TypeAlias = float
 RewardFn: TypeAlias = Callable[[Observation, Action, bool, Info], Reward]
@@ -18,7 +19,7 @@ RewardFn: TypeAlias = Callable[[Observation, Action, bool, Info], Reward]
 
 class GymnasiumGenerals(gym.Env):
     metadata = {
-        "render_modes": ["human"],
+        "render_modes": ["human", "rgb_array"],
         "render_fps": 6,
     }
 
@@ -30,8 +31,37 @@ class GymnasiumGenerals(gym.Env):
         truncation: int | None = None,
         reward_fn: RewardFn | None = None,
         render_mode: str | None = None,
+        reuse_observation_buffers: bool = False,
+        observation_mode: str = "dict",
+        observation_channels: Sequence[str] | None = None,
+        observation_normalization: dict[str, float] | None = None,
+        observation_dtype: type = np.float32,
     ):
+        """
+        Args:
+            reuse_observation_buffers: if True, observations are written into buffers owned by
+                the environment instead of being allocated on every step. Returned observations are
+                then overwritten by the next `step`/`reset`, so copy them if you need to keep them.
+                Observations are then built without allocating numpy arrays, what remains per step are
+                the returned dictionaries and scalars and constant-size scratch of numpy calls. The game
+                itself still allocates arrays as large as the number of cities when their armies grow
+                (every other step) and arrays of the grid size when land armies grow (every 50 steps).
+            observation_mode: "dict" for dictionary observations, "tensor" for observations stacked
+                into a (H, W, C) tensor, written directly from the game state
+            observation_channels: channels of tensor observations, `OBSERVATION_CHANNELS` by default
+            observation_normalization: divisors of tensor observation channels, see
+                `Game.agent_observation_tensor`; pass an empty dict to get raw values
+            observation_dtype: dtype of tensor observations, e.g. np.float32 or np.uint8
+        """
+        assert observation_mode in ["dict", "tensor"], f"Unknown observation mode: {observation_mode}"
         self.render_mode = render_mode
+        self.reuse_observation_buffers = reuse_observation_buffers
+        self.observation_mode = observation_mode
+        self.observation_channels = OBSERVATION_CHANNELS if observation_channels is None else observation_channels
+        self.observation_normalization = observation_normalization
+        self.observation_dtype = observation_dtype
+        self._tensor_buffers: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self._observation_buffers: dict[str, Observation] = {}
         self.grid_factory = grid_factory if grid_factory is not None else GridFactory()
         self.reward_fn = reward_fn if reward_fn is not None else GymnasiumGenerals._default_reward
 
@@ -53,13 +83,16 @@ class GymnasiumGenerals(gym.Env):
         # Game
         grid = self.grid_factory.grid_from_generator()
         self.game = Game(grid, [self.agent_id, self.npc.id])
-        self.observation_space = self.game.observation_space
+        self.observation_space = self._observation_space()
         self.action_space = self.game.action_space
         self.truncation = truncation
 
-    def render(self):
+    def render(self) -> np.ndarray | None:
         if self.render_mode == "human":
             _ = self.gui.tick(fps=self.metadata["render_fps"])
+        elif self.render_mode == "rgb_array":
+            return self.renderer.rgb_array()
+        return None
 
     def reset(
         self, seed: int | None = None, options: dict[str, Any] | None = None
@@ -67,6 +100,8 @@ class GymnasiumGenerals(gym.Env):
         super().reset(seed=seed)
         if options is None:
             options = {}
+        if seed is not None:
+            self.npc.seed(seed)
 
         if "grid" in options:
             grid = self.grid_factory.grid_from_string(options["grid"])
@@ -80,35 +115,62 @@ class GymnasiumGenerals(gym.Env):
         # Create GUI for current render run
         if self.render_mode == "human":
             self.gui = GUI(self.game, self.agent_data, GuiMode.TRAIN)
+        elif self.render_mode == "rgb_array":
+            self.renderer = Renderer(Properties(self.game, self.agent_data, GuiMode.TRAIN), offscreen=True)
 
+        # An unfinished replay of the previous game is finalized before a new one starts
+        self._close_replay()
         if "replay_file" in options:
-            self.replay = Replay(
+            self.replay = ReplayWriter(
                 name=options["replay_file"],
                 grid=grid,
                 agent_data=self.agent_data,
             )
-            self.replay.add_state(deepcopy(self.game.channels))
-        elif hasattr(self, "replay"):
-            del self.replay
+            self.replay.add_state(self.game.channels)
 
-        self.observation_space = self.game.observation_space
+        self.observation_space = self._observation_space()
         self.action_space = self.game.action_space
 
-        observation = self.game.agent_observation(self.agent_id).as_dict()
+        observation = self._observation(self.agent_id)
         info: dict[str, Any] = {}
         return observation, info
 
+    def _observation_space(self) -> gym.spaces.Dict:
+        if self.observation_mode == "tensor":
+            return self.game.observation_tensor_space(
+                self.observation_channels, self.observation_normalization, self.observation_dtype
+            )
+        return self.game.observation_space
+
+    def _observation(self, agent: str) -> Any:
+        # Observation returned by the environment, NPC always receives dictionary observations
+        if self.observation_mode == "tensor":
+            buffers = self._tensor_buffers if self.reuse_observation_buffers else None
+            return self.game.buffered_observation_tensor(
+                agent, self.observation_channels, self.observation_normalization, self.observation_dtype, buffers
+            )
+        return self._agent_observation(agent)
+
+    def _agent_observation(self, agent: str) -> Observation:
+        out = None
+        if self.reuse_observation_buffers:
+            out = self._observation_buffers.get(agent)
+            # Buffers are reallocated only when a new game has different grid dimensions
+            if out is None or out.armies.shape != self.game.grid_dims:
+                out = self._observation_buffers[agent] = Observation.allocate(self.game.grid_dims)
+        return self.game.agent_observation(agent, out=out).as_dict()
+
     def step(self, action: Action) -> tuple[Observation, SupportsFloat, bool, bool, dict[str, Any]]:
         # Get action of NPC
-        npc_observation = self.game.agent_observation(self.npc.id).as_dict()
+        npc_observation = self._agent_observation(self.npc.id)
         npc_action = self.npc.act(npc_observation)
         actions = {self.agent_id: action, self.npc.id: npc_action}
 
-        observations, infos = self.game.step(actions)
+        self.game.apply_actions(actions)
 
-        # From observations of all agents, pick only those relevant for the main agent
-        obs = observations[self.agent_id].as_dict()
-        info = infos[self.agent_id]
+        # Only the observation of the main agent is relevant
+        obs = self._observation(self.agent_id)
+        info = self.game.get_infos()[self.agent_id]
         reward = self.reward_fn(obs, action, self.game.is_done(), info)
         terminated = self.game.is_done()
         truncated = False
@@ -116,11 +178,10 @@ class GymnasiumGenerals(gym.Env):
             truncated = self.game.time >= self.truncation
 
         if hasattr(self, "replay"):
-            self.replay.add_state(deepcopy(self.game.channels))
+            self.replay.add_state(self.game.channels, actions)
 
         if terminated or truncated:
-            if hasattr(self, "replay"):
-                self.replay.store()
+            self._close_replay()
         return obs, reward, terminated, truncated, info
 
     @staticmethod
@@ -134,6 +195,13 @@ class GymnasiumGenerals(gym.Env):
             return 1 if info["is_winner"] else -1
         return 0
 
+    def _close_replay(self) -> None:
+        if hasattr(self, "replay"):
+            self.replay.close()
+            del self.replay
+
     def close(self) -> None:
+        self._close_replay()
+        self.grid_factory.close()
         if self.render_mode == "human":
             self.gui.close()
@@ -1,6 +1,8 @@
 import gymnasium as gym
 import numpy as np
 
+from generals.core.observation import OBSERVATION_CHANNELS
+
 
 class RemoveActionMaskWrapper(gym.ObservationWrapper):
     def __init__(self, env):
@@ -15,8 +17,12 @@ class RemoveActionMaskWrapper(gym.ObservationWrapper):
 class ObservationAsImageWrapper(gym.ObservationWrapper):
     def __init__(self, env):
         super().__init__(env)
-        n_obs_keys = len(self.observation_space["observation"].items())
+        # Image channels follow the observation layout, see `OBSERVATION_CHANNELS`
+        n_obs_keys = len(OBSERVATION_CHANNELS)
         self.game = env.game
+        # Reuse one image buffer if the wrapped environment reuses its observation buffers
+        self.reuse_observation_buffers = getattr(env.unwrapped, "reuse_observation_buffers", False)
+        self._image = np.zeros(self.game.grid_dims + (n_obs_keys,), dtype=np.float32)
         self.observation_space = gym.spaces.Dict(
             {
                 "observation": gym.spaces.Box(
@@ -27,29 +33,23 @@ class ObservationAsImageWrapper(gym.ObservationWrapper):
         )
 
     def observation(self, observation):
-        game = self.game
+        game = self.env.unwrapped.game
         _obs = observation["observation"] if "observation" in observation else observation
-        _obs = (
-            np.stack(
-                [
-                    _obs["armies"] / game.max_army_value,
-                    _obs["generals"],
-                    _obs["cities"],
-                    _obs["mountains"],
-                    _obs["neutral_cells"],
-                    _obs["owned_cells"],
-                    _obs["opponent_cells"],
-                    _obs["fog_cells"],
-                    _obs["structures_in_fog"],
-                    np.ones(game.grid_dims) * _obs["owned_land_count"] / game.max_land_value,
-                    np.ones(game.grid_dims) * _obs["owned_army_count"] / game.max_army_value,
-                    np.ones(game.grid_dims) * _obs["opponent_land_count"] / game.max_land_value,
-                    np.ones(game.grid_dims) * _obs["opponent_army_count"] / game.max_army_value,
-                    np.ones(game.grid_dims) * _obs["timestep"] / game.max_timestep,
-                    np.ones(game.grid_dims) * _obs["priority"],
-                ]
-            )
-            .astype(np.float32)
-            .transpose(1, 2, 0)
-        )
-        return _obs
+        if self.reuse_observation_buffers and self._image.shape[:2] == game.grid_dims:
+            image = self._image
+        else:
+            image = np.empty(game.grid_dims + (self._image.shape[-1],), dtype=np.float32)
+            if self.reuse_observation_buffers:
+                self._image = image
+
+        normalization = game.observation_normalization()
+        for i, key in enumerate(OBSERVATION_CHANNELS):
+            divisor = normalization.get(key, 1)
+            if np.ndim(_obs[key]) == 0:
+                image[..., i].fill(_obs[key] / divisor)
+            else:
+                # Casting copy and division in place, casting in the division would allocate temporary buffers
+                np.copyto(image[..., i], _obs[key])
+                if divisor != 1:
+                    np.divide(image[..., i], divisor, out=image[..., i])
+        return image
@@ -1,17 +1,20 @@
 import functools
-from collections.abc import Callable
+from collections.abc import Callable, Sequence
 from copy import deepcopy
 from typing import Any, TypeAlias
 
+import numpy as np
 import pettingzoo  # type: ignore
 from gymnasium import spaces
 
 from generals.agents.agent import Agent
 from generals.core.game import Action, Game, Info, Observation
 from generals.core.grid import GridFactory
-from generals.core.replay import Replay
+from generals.core.observation import OBSERVATION_CHANNELS
+from generals.core.replay import ReplayWriter
 from generals.gui import GUI
-from generals.gui.properties import GuiMode
+from generals.gui.properties import GuiMode, Properties
+from generals.gui.rendering import Renderer
 
 AgentID: TypeAlias = str
 Reward: TypeAlias = float
@@ -20,7 +23,7 @@ RewardFn: TypeAlias = Callable[[Observation, Action, bool, Info], Reward]
 
 class PettingZooGenerals(pettingzoo.ParallelEnv):
     metadata: dict[str, Any] = {
-        "render_modes": ["human"],
+        "render_modes": ["human", "rgb_array"],
         "render_fps": 6,
     }
 
@@ -31,8 +34,37 @@ class PettingZooGenerals(pettingzoo.ParallelEnv):
         truncation: int | None = None,
         reward_fn: RewardFn | None = None,
         render_mode=None,
+        reuse_observation_buffers: bool = False,
+        observation_mode: str = "dict",
+        observation_channels: Sequence[str] | None = None,
+        observation_normalization: dict[str, float] | None = None,
+        observation_dtype: type = np.float32,
     ):
+        """
+        Args:
+            reuse_observation_buffers: if True, observations are written into buffers owned by
+                the environment instead of being allocated on every step. Returned observations are
+                then overwritten by the next `step`/`reset`, so copy them if you need to keep them.
+                Observations are then built without allocating numpy arrays, what remains per step are
+                the returned dictionaries and scalars and constant-size scratch of numpy calls. The game
+                itself still allocates arrays as large as the number of cities when their armies grow
+                (every other step) and arrays of the grid size when land armies grow (every 50 steps).
+            observation_mode: "dict" for dictionary observations, "tensor" for observations stacked
+                into a (H, W, C) tensor, written directly from the game state
+            observation_channels: channels of tensor observations, `OBSERVATION_CHANNELS` by default
+            observation_normalization: divisors of tensor observation channels, see
+                `Game.agent_observation_tensor`; pass an empty dict to get raw values
+            observation_dtype: dtype of tensor observations, e.g. np.float32 or np.uint8
+        """
+        assert observation_mode in ["dict", "tensor"], f"Unknown observation mode: {observation_mode}"
         self.render_mode = render_mode
+        self.reuse_observation_buffers = reuse_observation_buffers
+        self.observation_mode = observation_mode
+        self.observation_channels = OBSERVATION_CHANNELS if observation_channels is None else observation_channels
+        self.observation_normalization = observation_normalization
+        self.observation_dtype = observation_dtype
+        self._tensor_buffers: dict[AgentID, tuple[np.ndarray, np.ndarray]] = {}
+        self._observation_buffers: dict[AgentID, Observation] = {}
         self.grid_factory = grid_factory if grid_factory is not None else GridFactory()
         self.reward_fn = reward_fn if reward_fn is not None else self._default_reward
 
@@ -49,6 +81,10 @@ class PettingZooGenerals(pettingzoo.ParallelEnv):
     @functools.cache
     def observation_space(self, agent: AgentID) -> spaces.Space:
         assert agent in self.possible_agents, f"Agent {agent} not in possible agents"
+        if self.observation_mode == "tensor":
+            return self.game.observation_tensor_space(
+                self.observation_channels, self.observation_normalization, self.observation_dtype
+            )
         return self.game.observation_space
 
     @functools.cache
@@ -56,9 +92,12 @@ class PettingZooGenerals(pettingzoo.ParallelEnv):
         assert agent in self.possible_agents, f"Agent {agent} not in possible agents"
         return self.game.action_space
 
-    def render(self):
+    def render(self) -> np.ndarray | None:
         if self.render_mode == "human":
             _ = self.gui.tick(fps=self.metadata["render_fps"])
+        elif self.render_mode == "rgb_array":
+            return self.renderer.rgb_array()
+        return None
 
     def reset(
         self, seed: int | None = None, options: dict | None = None
@@ -75,21 +114,40 @@ class PettingZooGenerals(pettingzoo.ParallelEnv):
 
         if self.render_mode == "human":
             self.gui = GUI(self.game, self.agent_data, GuiMode.TRAIN)
+        elif self.render_mode == "rgb_array":
+            self.renderer = Renderer(Properties(self.game, self.agent_data, GuiMode.TRAIN), offscreen=True)
 
+        # An unfinished replay of the previous game is finalized before a new one starts
+        self._close_replay()
         if "replay_file" in options:
-            self.replay = Replay(
+            self.replay = ReplayWriter(
                 name=options["replay_file"],
                 grid=grid,
                 agent_data=self.agent_data,
             )
-            self.replay.add_state(deepcopy(self.game.channels))
-        elif hasattr(self, "replay"):
-            del self.replay
+            self.replay.add_state(self.game.channels)
 
-        observations = {agent: self.game.agent_observation(agent).as_dict() for agent in self.agents}
+        observations = {agent: self._observation(agent) for agent in self.agents}
         infos: dict[str, Any] = {agent: {} for agent in self.agents}
         return observations, infos
 
+    def _observation(self, agent: AgentID) -> Any:
+        if self.observation_mode == "tensor":
+            buffers = self._tensor_buffers if self.reuse_observation_buffers else None
+            return self.game.buffered_observation_tensor(
+                agent, self.observation_channels, self.observation_normalization, self.observation_dtype, buffers
+            )
+        return self._agent_observation(agent)
+
+    def _agent_observation(self, agent: AgentID) -> Observation:
+        out = None
+        if self.reuse_observation_buffers:
+            out = self._observation_buffers.get(agent)
+            # Buffers are reallocated only when a new game has different grid dimensions
+            if out is None or out.armies.shape != self.game.grid_dims:
+                out = self._observation_buffers[agent] = Observation.allocate(self.game.grid_dims)
+        return self.game.agent_observation(agent, out=out).as_dict()
+
     def step(
         self, actions: dict[AgentID, Action]
     ) -> tuple[
@@ -99,8 +157,9 @@ class PettingZooGenerals(pettingzoo.ParallelEnv):
         dict[AgentID, bool],
         dict[AgentID, Info],
     ]:
-        observations, infos = self.game.step(actions)
-        observations = {agent: observation.as_dict() for agent, observation in observations.items()}
+        self.game.apply_actions(actions)
+        observations = {agent: self._observation(agent) for agent in self.agents}
+        infos = self.game.get_infos()
         # You probably want to set your truncation based on self.game.time
         truncation = False if self.truncation is None else self.game.time >= self.truncation
         truncated = {agent: truncation for agent in self.agents}
@@ -116,14 +175,14 @@ class PettingZooGenerals(pettingzoo.ParallelEnv):
         }
 
         if hasattr(self, "replay"):
-            self.replay.add_state(deepcopy(self.game.channels))
+            self.replay.add_state(self.game.channels, actions)
 
         # if any agent dies, all agents are terminated
         terminate = any(terminated.values())
         if terminate:
             self.agents = []
-            if hasattr(self, "replay"):
-                self.replay.store()
+        if terminate or any(truncated.values()):
+            self._close_replay()
         return observations, rewards, terminated, truncated, infos
 
     @staticmethod
@@ -135,6 +194,13 @@ class PettingZooGenerals(pettingzoo.ParallelEnv):
     ) -> Reward:
         return 0
 
+    def _close_replay(self) -> None:
+        if hasattr(self, "replay"):
+            self.replay.close()
+            del self.replay
+
     def close(self) -> None:
+        self._close_replay()
+        self.grid_factory.close()
         if self.render_mode == "human":
             self.gui.close()
@@ -0,0 +1,278 @@
+import math
+import multiprocessing
+import os
+import pickle
+import traceback
+from copy import deepcopy
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any
+
+import gymnasium as gym
+import numpy as np
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+
+from generals.envs.gymnasium_generals import GymnasiumGenerals
+
+# Message that tells workers to step their games, all other messages are pickled commands
+_STEP = b"step"
+_INFO_KEYS = ["army", "land", "is_winner"]
+
+
+def _buffer_layout(observation_space: gym.Space, action_space: gym.Space, n_envs: int) -> dict:
+    """
+    Returns {path: (shape, dtype)} of all arrays placed in the shared memory block,
+    where path is a tuple of keys of an observation leaf or a single name of another array.
+    """
+    layout: dict[tuple[str, ...], tuple[tuple[int, ...], np.dtype]] = {}
+
+    def add_space(space: gym.Space, path: tuple[str, ...]) -> None:
+        if isinstance(space, gym.spaces.Dict):
+            for key, subspace in space.items():
+                add_space(subspace, path + (key,))
+        else:
+            layout[path] = ((n_envs,) + tuple(space.shape or ()), np.dtype(space.dtype))
+
+    add_space(observation_space, ("observation_space",))
+    layout[("actions",)] = ((n_envs,) + tuple(action_space.shape or ()), np.dtype(np.int64))
+    layout[("rewards",)] = ((n_envs,), np.dtype(np.float64))
+    layout[("terminated",)] = ((n_envs,), np.dtype(bool))
+    layout[("truncated",)] = ((n_envs,), np.dtype(bool))
+    layout[("army",)] = ((n_envs,), np.dtype(np.int64))
+    layout[("land",)] = ((n_envs,), np.dtype(np.int64))
+    layout[("is_winner",)] = ((n_envs,), np.dtype(bool))
+    return layout
+
+
+def _buffer_views(layout: dict, buffer: Any) -> dict[tuple[str, ...], np.ndarray]:
+    """
+    Creates numpy views of arrays of a given layout into a shared buffer.
+    Arrays are aligned to 64 bytes, so they do not share cache lines.
+    """
+    views, offset = {}, 0
+    for path, (shape, dtype) in layout.items():
+        views[path] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+        offset += math.ceil(views[path].nbytes / 64) * 64
+    return views
+
+
+def _buffer_size(layout: dict) -> int:
+    sizes = [math.ceil(math.prod(shape) * dtype.itemsize / 64) * 64 for shape, dtype in layout.values()]
+    return max(sum(sizes), 1)
+
+
+def _write_observation(views: dict, index: int, observation: Any, path: tuple[str, ...] = ("observation_space",)):
+    for key, value in observation.items():
+        if isinstance(value, dict):
+            _write_observation(views, index, value, path + (key,))
+        else:
+            views[path + (key,)][index] = value
+
+
+def _worker(
+    shared_memory: SharedMemory,
+    layout: dict,
+    env_indices: range,
+    env_kwargs: dict[str, Any],
+    cpu: int | None,
+    connection: Connection,
+) -> None:
+    """
+    Runs games of `env_indices`, reading their actions from and writing their results into the shared memory.
+    """
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    views = _buffer_views(layout, shared_memory.buf)
+    envs = [GymnasiumGenerals(**deepcopy(env_kwargs)) for _ in env_indices]
+    autoreset = np.zeros(len(envs), dtype=bool)
+
+    def write_reset(i: int, index: int, observation: Any) -> None:
+        _write_observation(views, index, observation)
+        views[("rewards",)][index] = 0
+        views[("terminated",)][index] = False
+        views[("truncated",)][index] = False
+        for key in _INFO_KEYS:
+            views[(key,)][index] = 0
+        autoreset[i] = False
+
+    try:
+        while True:
+            message = connection.recv_bytes()
+            if message == _STEP:
+                actions = views[("actions",)]
+                for i, (index, env) in enumerate(zip(env_indices, envs)):
+                    # Games finished in the previous step are reset and their actions ignored
+                    if autoreset[i]:
+                        write_reset(i, index, env.reset()[0])
+                        continue
+                    observation, reward, terminated, truncated, info = env.step(actions[index])
+                    _write_observation(views, index, observation)
+                    views[("rewards",)][index] = reward
+                    views[("terminated",)][index] = terminated
+                    views[("truncated",)][index] = truncated
+                    for key in _INFO_KEYS:
+                        views[(key,)][index] = info[key]
+                    autoreset[i] = terminated or truncated
+                connection.send_bytes(b"")
+                continue
+
+            command, seed, options = pickle.loads(message)
+            if command == "close":
+                connection.send_bytes(b"")
+                break
+            for i, (index, env) in enumerate(zip(env_indices, envs)):
+                write_reset(i, index, env.reset(seed=None if seed is None else seed + index, options=options)[0])
+            connection.send_bytes(b"")
+    except Exception:
+        connection.send_bytes(traceback.format_exc().encode())
+        raise
+    finally:
+        for env in envs:
+            env.close()
+        # Drop views before the shared memory is closed, numpy views keep the buffer exported
+        views.clear()
+        shared_memory.close()
+
+
+class GeneralsSharedMemoryVectorEnv(VectorEnv):
+    """
+    Vector environment that runs `GymnasiumGenerals` games in a pool of worker processes.
+
+    Every worker owns a contiguous slice of `games_per_worker` games. Actions, observations, rewards,
+    termination flags and infos are exchanged through one `multiprocessing.shared_memory` block,
+    so nothing is pickled per step, workers only receive a short wake-up message.
+    Finished games are reset on the next step (NEXT_STEP autoreset), actions for such games are ignored.
+    """
+
+    metadata = {
+        "render_modes": [],
+        "autoreset_mode": AutoresetMode.NEXT_STEP,
+    }
+
+    def __init__(
+        self,
+        num_envs: int,
+        games_per_worker: int = 1,
+        worker_cpus: list[int] | None = None,
+        copy: bool = False,
+        context: str | None = None,
+        **env_kwargs: Any,
+    ):
+        """
+        Args:
+            num_envs: total number of games
+            games_per_worker: number of games stepped sequentially by every worker process
+            worker_cpus: if given, i-th worker is pinned to CPU `worker_cpus[i % len(worker_cpus)]`
+            copy: if False, returned observations are views into the shared memory that are
+                overwritten by the next `step`/`reset`, so copy them if you need to keep them
+            context: multiprocessing start method, e.g. "fork", "spawn" or "forkserver"
+            env_kwargs: arguments of `GymnasiumGenerals` of every game
+        """
+        assert games_per_worker >= 1, "Every worker must run at least one game."
+        if worker_cpus is not None:
+            assert hasattr(os, "sched_setaffinity"), "Pinning workers to CPUs is not supported on this platform."
+        self.num_envs = num_envs
+        self.copy = copy
+        # Workers reuse observation buffers of their games, because observations are copied into shared memory
+        env_kwargs.setdefault("reuse_observation_buffers", True)
+
+        # Spaces are the same for all games, so they are taken from a single game
+        env = GymnasiumGenerals(**deepcopy(env_kwargs))
+        self.single_observation_space = env.observation_space
+        self.single_action_space = env.action_space
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        env.close()
+
+        layout = _buffer_layout(self.single_observation_space, self.single_action_space, num_envs)
+        self._shared_memory = SharedMemory(create=True, size=_buffer_size(layout))
+        self._views = _buffer_views(layout, self._shared_memory.buf)
+
+        ctx: Any = multiprocessing.get_context(context)
+        self._connections: list[Connection] = []
+        self._processes = []
+        for worker, start in enumerate(range(0, num_envs, games_per_worker)):
+            env_indices = range(start, min(start + games_per_worker, num_envs))
+            cpu = None if worker_cpus is None else worker_cpus[worker % len(worker_cpus)]
+            parent_connection, child_connection = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker,
+                args=(self._shared_memory, layout, env_indices, env_kwargs, cpu, child_connection),
+                daemon=True,
+            )
+            process.start()
+            child_connection.close()
+            self._connections.append(parent_connection)
+            self._processes.append(process)
+        self._closed = False
+
+    @property
+    def n_workers(self) -> int:
+        return len(self._processes)
+
+    def _send(self, message: bytes) -> None:
+        for connection in self._connections:
+            connection.send_bytes(message)
+        errors = []
+        for worker, connection in enumerate(self._connections):
+            response = connection.recv_bytes()
+            if response:
+                errors.append(f"Worker {worker} failed:\n{response.decode()}")
+        if errors:
+            raise RuntimeError("\n".join(errors))
+
+    def _observation(self) -> dict[str, Any]:
+        def build(space: Any, path: tuple[str, ...]) -> dict[str, Any]:
+            observation: dict[str, Any] = {}
+            for key, subspace in space.items():
+                if isinstance(subspace, gym.spaces.Dict):
+                    observation[key] = build(subspace, path + (key,))
+                else:
+                    view = self._views[path + (key,)]
+                    observation[key] = view.copy() if self.copy else view
+            return observation
+
+        return build(self.single_observation_space, ("observation_space",))
+
+    def reset(self, *, seed: int | None = None, options: dict[str, Any] | None = None) -> tuple[Any, dict[str, Any]]:
+        """
+        Resets all games, i-th game is seeded with `seed + i` if seed is given.
+        """
+        super().reset(seed=seed)
+        self._send(pickle.dumps(("reset", seed, options)))
+        return self._observation(), {}
+
+    def step(self, actions: np.ndarray) -> tuple[Any, np.ndarray, np.ndarray, np.ndarray, dict[str, Any]]:
+        np.copyto(self._views[("actions",)], actions, casting="unsafe")
+        self._send(_STEP)
+
+        # Vector env infos mark which games each value belongs to in "_key" masks
+        info: dict[str, Any] = {}
+        for key in _INFO_KEYS:
+            info[key] = self._views[(key,)].copy()
+            info[f"_{key}"] = np.ones(self.num_envs, dtype=bool)
+        return (
+            self._observation(),
+            self._views[("rewards",)].copy(),
+            self._views[("terminated",)].copy(),
+            self._views[("truncated",)].copy(),
+            info,
+        )
+
+    def close_extras(self, **kwargs: Any) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        for connection in self._connections:
+            try:
+                connection.send_bytes(pickle.dumps(("close", None, None)))
+                connection.recv_bytes()
+            except (BrokenPipeError, EOFError):
+                pass
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._views.clear()
+        self._shared_memory.close()
+        self._shared_memory.unlink()
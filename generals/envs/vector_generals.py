@@ -0,0 +1,153 @@
+from collections.abc import Callable
+from typing import Any, TypeAlias
+
+import numpy as np
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+
+from generals.agents import Agent, AgentFactory
+from generals.core.batched_game import BatchedAction, BatchedGame, BatchedInfo
+from generals.core.game import Game
+from generals.core.grid import Grid, GridFactory
+
+BatchedObservation: TypeAlias = dict[str, Any]
+BatchedRewardFn: TypeAlias = Callable[[BatchedObservation, BatchedAction, np.ndarray, BatchedInfo], np.ndarray]
+
+
+class GeneralsVectorEnv(VectorEnv):
+    """
+    Vectorized version of `GymnasiumGenerals` that steps `num_envs` games together in a `BatchedGame`.
+
+    Observations are stacked, i.e. the same dictionaries as in `GymnasiumGenerals`, where every
+    array has an extra leading batch dimension. The NPC acts on stacked observations via `Agent.act_batch`.
+    Finished games are reset with new grids from the grid factory on the next step (NEXT_STEP autoreset),
+    actions for such games are ignored.
+    """
+
+    metadata = {
+        "render_modes": [],
+        "autoreset_mode": AutoresetMode.NEXT_STEP,
+    }
+
+    def __init__(
+        self,
+        num_envs: int,
+        grid_factory: GridFactory | None = None,
+        npc: Agent | None = None,
+        agent: Agent | None = None,  # Optional, just to obtain id
+        truncation: int | None = None,
+        reward_fn: BatchedRewardFn | None = None,
+    ):
+        """
+        Args:
+            num_envs: number of games stepped together
+            reward_fn: function computing (B,) rewards from stacked observations, (B, 5) actions,
+                (B,) done mask and infos with (B,) arrays
+        """
+        self.num_envs = num_envs
+        self.grid_factory = grid_factory if grid_factory is not None else GridFactory()
+        self.reward_fn = reward_fn if reward_fn is not None else GeneralsVectorEnv._default_reward
+        self.truncation = truncation
+
+        # Agents
+        if npc is None:
+            print('No NPC agent provided. Creating "Random" NPC as a fallback.')
+            npc = AgentFactory.make_agent("Random")
+        else:
+            assert isinstance(npc, Agent), "NPC must be an instance of Agent class."
+        self.npc = npc
+        self.agent_id = "Agent" if agent is None else agent.id
+        self.agent_ids = [self.agent_id, self.npc.id]
+        assert self.agent_id != npc.id, "Agent ids must be unique - you can pass custom ids to agent constructors."
+
+        # Games
+        grids = [self.grid_factory.grid_from_generator() for _ in range(num_envs)]
+        self.game = BatchedGame(grids, self.agent_ids)
+
+        # Spaces are the same for all games, so they are taken from a single game
+        game = Game(grids[0], self.agent_ids)
+        self.single_observation_space = game.observation_space
+        self.single_action_space = game.action_space
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+
+        self._grid: Grid | None = None
+        self._autoreset_envs = np.zeros(num_envs, dtype=bool)
+
+    def reset(
+        self, *, seed: int | None = None, options: dict[str, Any] | None = None
+    ) -> tuple[BatchedObservation, dict[str, Any]]:
+        super().reset(seed=seed)
+        if options is None:
+            options = {}
+        if seed is not None:
+            self.npc.seed(seed)
+
+        # Grid given in options is used also for games started by autoreset
+        self._grid = self.grid_factory.grid_from_string(options["grid"]) if "grid" in options else None
+        if self._grid is not None:
+            grids = [self._grid] * self.num_envs
+        else:
+            self.grid_factory.rng = self.np_random
+            grids = [self.grid_factory.grid_from_generator() for _ in range(self.num_envs)]
+        self.game = BatchedGame(grids, self.agent_ids)
+        self._autoreset_envs = np.zeros(self.num_envs, dtype=bool)
+
+        observation = self._agent_observation(self.agent_id)
+        info: dict[str, Any] = {}
+        return observation, info
+
+    def _agent_observation(self, agent: str) -> BatchedObservation:
+        return {
+            "observation": self.game.agent_observation(agent),
+            "action_mask": self.game.action_mask(agent),
+        }
+
+    def step(
+        self, actions: BatchedAction
+    ) -> tuple[BatchedObservation, np.ndarray, np.ndarray, np.ndarray, dict[str, Any]]:
+        # Games finished in the previous step are reset and their actions ignored
+        reset_envs = self._autoreset_envs
+        for index in np.flatnonzero(reset_envs):
+            grid = self._grid if self._grid is not None else self.grid_factory.grid_from_generator()
+            self.game.reset_game(int(index), grid)
+
+        # Get actions of NPC
+        npc_actions = self.npc.act_batch(self._agent_observation(self.npc.id))
+        agent_actions = {self.agent_id: actions, self.npc.id: npc_actions}
+
+        infos = self.game.step(agent_actions, active=~reset_envs)
+
+        # Only the observation of the main agent is relevant
+        observation = self._agent_observation(self.agent_id)
+        info = infos[self.agent_id]
+        terminated = self.game.is_done()
+        truncated = np.zeros(self.num_envs, dtype=bool)
+        if self.truncation is not None:
+            truncated = self.game.time >= self.truncation
+        rewards = np.asarray(self.reward_fn(observation, actions, terminated, info), dtype=float)
+
+        # Games reset in this step return their initial observations
+        rewards[reset_envs] = 0
+        terminated[reset_envs] = False
+        truncated[reset_envs] = False
+        self._autoreset_envs = terminated | truncated
+
+        # Vector env infos mark which games each value belongs to in "_key" masks
+        vector_info: dict[str, Any] = {}
+        for key, value in info.items():
+            vector_info[key] = value
+            vector_info[f"_{key}"] = np.ones(self.num_envs, dtype=bool)
+        return observation, rewards, terminated, truncated, vector_info
+
+    def close_extras(self, **kwargs: Any) -> None:
+        self.grid_factory.close()
+
+    @staticmethod
+    def _default_reward(
+        observation: BatchedObservation,
+        action: BatchedAction,
+        done: np.ndarray,
+        info: BatchedInfo,
+    ) -> np.ndarray:
+        return np.where(done, np.where(info["is_winner"], 1, -1), 0)
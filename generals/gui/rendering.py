@@ -1,8 +1,10 @@
+from collections.abc import Sequence
 from typing import TypeAlias
 
 import numpy as np
 import pygame
 
+from generals.core.channels import CITY_STRUCTURE, GENERAL_STRUCTURE, MOUNTAIN_STRUCTURE, NEUTRAL_OWNER
 from generals.core.config import Dimension, Path
 from generals.gui.properties import GuiMode, Properties
 
@@ -14,15 +16,29 @@ VISIBLE_MOUNTAIN: Color = (187, 187, 187)
 BLACK: Color = (0, 0, 0)
 WHITE: Color = (230, 230, 230)
 
+# Images drawn in tiles, indices into `Renderer._tile_images`
+NO_IMAGE, GENERAL_IMAGE, MOUNTAIN_IMAGE, CITY_IMAGE = -1, 0, 1, 2
+
+# Rendered texts are cached, the cache is cleared when it grows over this size
+TEXT_CACHE_SIZE = 4096
+
 
 class Renderer:
-    def __init__(self, properties: Properties):
+    def __init__(self, properties: Properties, offscreen: bool = False):
         """
         Initialize the pygame GUI
+
+        Args:
+            offscreen: if True, no window is opened and frames are drawn into an offscreen surface,
+                see `rgb_array`. Drawing into surfaces needs no video driver, so it works on headless servers.
         """
-        pygame.init()
-        pygame.display.set_caption("Generals")
-        pygame.key.set_repeat(500, 64)
+        self.offscreen = offscreen
+        if offscreen:
+            pygame.font.init()
+        else:
+            pygame.init()
+            pygame.display.set_caption("Generals")
+            pygame.key.set_repeat(500, 64)
 
         self.properties = properties
 
@@ -48,7 +64,10 @@ class Renderer:
         height = Dimension.GUI_CELL_HEIGHT.value
 
         # Main window
-        self.screen = pygame.display.set_mode((window_width, window_height), pygame.HWSURFACE | pygame.DOUBLEBUF)
+        if offscreen:
+            self.screen = pygame.Surface((window_width, window_height))
+        else:
+            self.screen = pygame.display.set_mode((window_width, window_height), pygame.HWSURFACE | pygame.DOUBLEBUF)
         # Scoreboard
         self.right_panel = pygame.Surface((self.right_panel_width, window_height))
         self.score_cols = {}
@@ -62,26 +81,46 @@ class Renderer:
             "time": pygame.Surface((self.right_panel_width / 2, height)),
             "speed": pygame.Surface((self.right_panel_width / 2, height)),
         }
-        # Game area and tiles
-        self.game_area = pygame.Surface((self.display_grid_width, self.display_grid_height))
-        self.tiles = [
-            [pygame.Surface((Dimension.SQUARE_SIZE.value, Dimension.SQUARE_SIZE.value)) for _ in range(self.grid_width)]
-            for _ in range(self.grid_height)
-        ]
-
-        self._mountain_img = pygame.image.load(str(Path.MOUNTAIN_PATH), "png").convert_alpha()
-        self._general_img = pygame.image.load(str(Path.GENERAL_PATH), "png").convert_alpha()
-        self._city_img = pygame.image.load(Path.CITY_PATH, "png").convert_alpha()
+        # Offscreen rendering draws the whole game area at once, on screen only changed tiles are redrawn
+        if offscreen:
+            self.game_area = pygame.Surface((self.display_grid_width, self.display_grid_height))
+            self._tile_colors = pygame.Surface((self.grid_width, self.grid_height))
+        # Appearance of tiles drawn in the previous frame, see `render_grid`
+        self._appearance: np.ndarray | None = None
+
+        self._mountain_img = pygame.image.load(str(Path.MOUNTAIN_PATH), "png")
+        self._general_img = pygame.image.load(str(Path.GENERAL_PATH), "png")
+        self._city_img = pygame.image.load(Path.CITY_PATH, "png")
+        if not offscreen:
+            # Converting to the pixel format of the display requires a window
+            self._mountain_img = self._mountain_img.convert_alpha()
+            self._general_img = self._general_img.convert_alpha()
+            self._city_img = self._city_img.convert_alpha()
+        self._tile_images = [self._general_img, self._mountain_img, self._city_img]
 
         self._font = pygame.font.Font(Path.FONT_PATH, self.properties.font_size)
+        self._text_cache: dict[tuple[str, Color], pygame.Surface] = {}
 
     def render(self, fps=None):
-        self.render_grid()
-        self.render_stats()
-        pygame.display.flip()
+        if self.offscreen:
+            self.render_grid_offscreen()
+            self.render_stats()
+        else:
+            rects = self.render_grid()
+            self.render_stats()
+            rects.append(pygame.Rect(self.display_grid_width, 0, *self.right_panel.get_size()))
+            pygame.display.update(rects)
         if fps:
             self.properties.clock.tick(fps)
 
+    def rgb_array(self) -> np.ndarray:
+        """
+        Renders the current state of the game and returns it as a (height, width, 3) uint8 RGB image.
+        """
+        self.render()
+        width, height = self.screen.get_size()
+        return np.frombuffer(pygame.image.tobytes(self.screen, "RGB"), dtype=np.uint8).reshape(height, width, 3)
+
     def render_cell_text(
         self,
         cell: pygame.Surface,
@@ -100,11 +139,22 @@ class Renderer:
         """
         center = (cell.get_width() // 2, cell.get_height() // 2)
 
-        text_surface = self._font.render(text, True, fg_color)
+        text_surface = self.render_text(text, fg_color)
         if bg_color:
             cell.fill(bg_color)
         cell.blit(text_surface, text_surface.get_rect(center=center))
 
+    def render_text(self, text: str, color: Color) -> pygame.Surface:
+        """
+        Returns surface with a rendered text, surfaces are cached as the same army counts and stats repeat.
+        """
+        key = (text, color)
+        if key not in self._text_cache:
+            if len(self._text_cache) >= TEXT_CACHE_SIZE:
+                self._text_cache.clear()
+            self._text_cache[key] = self._font.render(text, True, color)
+        return self._text_cache[key]
+
     def render_stats(self):
         """
         Draw player stats and additional info on the right panel
@@ -168,76 +218,118 @@ class Renderer:
         # Render right_panel on the screen
         self.screen.blit(self.right_panel, (self.display_grid_width, 0))
 
-    def render_grid(self):
+    def render_grid(self) -> list[pygame.Rect]:
         """
-        Render the game grid
+        Render the game grid on the screen. Only tiles whose appearance changed since the previous frame,
+        i.e. their army, owner, visibility or structure, are redrawn. Returns screen rects of redrawn tiles.
+        """
+        appearance = self.tile_appearance()
+        if self._appearance is None:
+            changed = np.ones(appearance.shape[1:], dtype=bool)
+        else:
+            changed = (appearance != self._appearance).any(axis=0)
+        self._appearance = appearance
+
+        colors, images = self.tile_colors(appearance), self.tile_images(appearance)
+        rects = []
+        for i, j in np.argwhere(changed):
+            rects.append(self.draw_tile(i, j, colors[i, j].tolist(), images[i, j], appearance[2, i, j]))
+        return rects
+
+    def draw_tile(self, i: int, j: int, color: Sequence[int], image: int, army: int) -> pygame.Rect:
+        """
+        Draw background, borders (left and top), image and army count of a single tile on the screen,
+        color and image are given by `tile_colors` and `tile_images`
+        """
+        square_size = Dimension.SQUARE_SIZE.value
+        rect = pygame.Rect(j * square_size, i * square_size, square_size, square_size)
+        self.screen.fill(color, rect)
+        self.screen.fill(BLACK, (rect.x, rect.y, square_size, 1))
+        self.screen.fill(BLACK, (rect.x, rect.y, 1, square_size))
+        if image != NO_IMAGE:
+            self.screen.blit(self._tile_images[image], (rect.x + 3, rect.y + 2))
+        if army != 0:
+            text_surface = self.render_text(str(int(army)), WHITE)
+            self.screen.blit(text_surface, text_surface.get_rect(center=rect.center))
+        return rect
+
+    def visible_map(self) -> np.ndarray:
+        """
+        Returns mask of cells visible to agents whose field of view is shown
         """
-        agents = self.game.agents
-        # Maps of all owned and visible cells
-        owned_map = np.zeros((self.grid_height, self.grid_width), dtype=bool)
         visible_map = np.zeros((self.grid_height, self.grid_width), dtype=bool)
-        for agent in agents:
-            ownership = self.game.channels.ownership[agent]
-            owned_map = np.logical_or(owned_map, ownership)
+        for agent in self.game.agents:
             if self.agent_fov[agent]:
-                visibility = self.game.channels.get_visibility(agent)
-                visible_map = np.logical_or(visible_map, visibility)
-
-        # Helper maps for not owned and invisible cells
-        not_owned_map = np.logical_not(owned_map)
-        invisible_map = np.logical_not(visible_map)
-
-        # Draw background of visible owned squares
-        for agent in agents:
-            ownership = self.game.channels.ownership[agent]
-            visible_ownership = np.logical_and(ownership, visible_map)
-            self.draw_channel(visible_ownership, self.agent_data[agent]["color"])
-
-        # Draw visible generals
-        visible_generals = np.logical_and(self.game.channels.generals, visible_map)
-        self.draw_images(visible_generals, self._general_img)
-
-        # Draw background of visible but not owned squares
-        visible_not_owned = np.logical_and(visible_map, not_owned_map)
-        self.draw_channel(visible_not_owned, WHITE)
-
-        # Draw background of squares in fog of war
-        self.draw_channel(invisible_map, FOG_OF_WAR)
+                visible_map |= self.game.channels.get_visibility(agent)
+        return visible_map
 
-        # Draw background of visible mountains
-        visible_mountain = np.logical_and(self.game.channels.mountains, visible_map)
-        self.draw_channel(visible_mountain, VISIBLE_MOUNTAIN)
-
-        # Draw mountains (even if they are not visible)
-        self.draw_images(self.game.channels.mountains, self._mountain_img)
-
-        # Draw background of visible neutral cities
-        visible_cities = np.logical_and(self.game.channels.cities, visible_map)
-        visible_cities_neutral = np.logical_and(visible_cities, self.game.channels.ownership_neutral)
-        self.draw_channel(visible_cities_neutral, NEUTRAL_CASTLE)
+    def tile_appearance(self) -> np.ndarray:
+        """
+        Returns (4, H, W) array of what is shown in every tile: visibility, owner index, army and structure type.
+        Armies and owners of cells in fog of war are not shown, so they are zero there.
+        """
+        channels = self.game.channels
+        visible_map = self.visible_map()
+        return np.stack(
+            [visible_map, channels.owners * visible_map, channels.armies * visible_map, channels.structure_types]
+        )
 
-        # Draw invisible cities as mountains
-        invisible_cities = np.logical_and(self.game.channels.cities, invisible_map)
-        self.draw_images(invisible_cities, self._mountain_img)
+    def tile_colors(self, appearance: np.ndarray) -> np.ndarray:
+        """
+        Returns (H, W, 3) uint8 background colors of tiles with the given `tile_appearance`.
+        """
+        visible, owner, _, structure = appearance
+        channels = self.game.channels
+        palette = np.empty((len(self.game.agents) + 1, 3), dtype=np.uint8)
+        palette[NEUTRAL_OWNER] = WHITE
+        for agent in self.game.agents:
+            palette[channels.owner_index(agent)] = self.agent_data[agent]["color"]
+        # Later assignments take precedence
+        colors = palette[owner]
+        colors[(structure == CITY_STRUCTURE) & (owner == NEUTRAL_OWNER)] = NEUTRAL_CASTLE
+        colors[structure == MOUNTAIN_STRUCTURE] = VISIBLE_MOUNTAIN
+        colors[visible == 0] = FOG_OF_WAR
+        return colors
+
+    def tile_images(self, appearance: np.ndarray) -> np.ndarray:
+        """
+        Returns (H, W) indices of images drawn in tiles with the given `tile_appearance`
+        (GENERAL_IMAGE, MOUNTAIN_IMAGE, CITY_IMAGE or NO_IMAGE). Cities in fog of war are drawn as mountains.
+        """
+        visible, owner, _, structure = appearance
+        images = np.full(structure.shape, NO_IMAGE, dtype=np.int8)
+        images[structure == CITY_STRUCTURE] = CITY_IMAGE
+        images[(structure == MOUNTAIN_STRUCTURE) | ((structure == CITY_STRUCTURE) & (visible == 0))] = MOUNTAIN_IMAGE
+        images[(structure == GENERAL_STRUCTURE) & (visible != 0) & (owner != NEUTRAL_OWNER)] = GENERAL_IMAGE
+        return images
+
+    def render_grid_offscreen(self):
+        """
+        Render the game grid as `render_grid` does, but write colors of all tiles into the game area in one go,
+        images and army counts are blitted on top.
+        """
+        appearance = self.tile_appearance()
 
-        # Draw visible cities
-        self.draw_images(visible_cities, self._city_img)
+        # Scale a surface with one pixel per tile to the game area and draw left and top borders of every tile
+        square_size = Dimension.SQUARE_SIZE.value
+        pygame.surfarray.blit_array(self._tile_colors, self.tile_colors(appearance).transpose(1, 0, 2))
+        pygame.transform.scale(self._tile_colors, self.game_area.get_size(), self.game_area)
+        for i in range(self.grid_height):
+            self.game_area.fill(BLACK, (0, i * square_size, self.display_grid_width, 1))
+        for j in range(self.grid_width):
+            self.game_area.fill(BLACK, (j * square_size, 0, 1, self.display_grid_height))
+
+        images = self.tile_images(appearance)
+        for index, image in enumerate(self._tile_images):
+            for i, j in self.channel_to_indices(images == index):
+                self.game_area.blit(image, (j * square_size + 3, i * square_size + 2))
 
         # Draw nonzero army counts on visible squares
-        visible_army = self.game.channels.armies * visible_map
-        visible_army_indices = self.channel_to_indices(visible_army)
-        for i, j in visible_army_indices:
-            self.render_cell_text(
-                self.tiles[i][j],
-                str(int(visible_army[i, j])),
-                fg_color=WHITE,
-                bg_color=None,  # Transparent background
-            )
-
-        # Blit tiles to the self.game_area
-        square_size = Dimension.SQUARE_SIZE.value
-        for i, j in np.ndindex(self.grid_height, self.grid_width):
-            self.game_area.blit(self.tiles[i][j], (j * square_size, i * square_size))
+        armies = appearance[2]
+        for i, j in self.channel_to_indices(armies):
+            text_surface = self.render_text(str(int(armies[i, j])), WHITE)
+            center = (j * square_size + square_size // 2, i * square_size + square_size // 2)
+            self.game_area.blit(text_surface, text_surface.get_rect(center=center))
         self.screen.blit(self.game_area, (0, 0))
 
     def channel_to_indices(self, channel: np.ndarray) -> np.ndarray:
@@ -245,20 +337,3 @@ class Renderer:
         Returns a list of indices of cells with non-zero values from specified a channel.
         """
         return np.argwhere(channel != 0)
-
-    def draw_channel(self, channel: np.ndarray, color: Color):
-        """
-        Draw background and borders (left and top) for grid tiles of a given channel
-        """
-        square_size = Dimension.SQUARE_SIZE.value
-        for i, j in self.channel_to_indices(channel):
-            self.tiles[i][j].fill(color)
-            pygame.draw.line(self.tiles[i][j], BLACK, (0, 0), (0, square_size), 1)
-            pygame.draw.line(self.tiles[i][j], BLACK, (0, 0), (square_size, 0), 1)
-
-    def draw_images(self, channel: np.ndarray, image: pygame.Surface):
-        """
-        Draw images on grid tiles of a given channel
-        """
-        for i, j in self.channel_to_indices(channel):
-            self.tiles[i][j].blit(image, (3, 2))
@@ -0,0 +1,123 @@
+"""
+Compares allocations of environment steps with and without reused observation buffers,
+for image observations created by `ObservationAsImageWrapper` and for native tensor observations.
+
+For every step we count the numpy arrays it creates: code of the `generals` package is traced
+instruction by instruction and new data blocks of numpy (traced by `tracemalloc` in its own domain)
+are counted after each instruction. Memory allocated and freed within a single instruction,
+e.g. temporary buffers of a numpy call, is not an array of its own, so we also report how many bytes
+a step allocates on top of the memory that is alive between steps.
+Agents only pass their turns, so the measurement is not polluted by allocations of agents.
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import generals
+from generals import GridFactory
+from generals.agents import Agent
+from generals.envs import GymnasiumGenerals
+from generals.envs.gymnasium_wrappers import ObservationAsImageWrapper
+
+PACKAGE_PATH = os.path.dirname(generals.__file__)
+PASS_ACTION = np.array([1, 0, 0, 0, 0])
+
+
+class PassingAgent(Agent):
+    def __init__(self, id: str = "Passer"):
+        super().__init__(id)
+
+    def act(self, observation):
+        return PASS_ACTION
+
+    def reset(self):
+        pass
+
+
+def count_arrays(step, n_steps: int) -> float:
+    """
+    Returns the mean number of numpy arrays created by a call of `step`.
+    """
+    state = {"created": 0, "blocks": 0, "current": 0}
+
+    def numpy_blocks() -> int:
+        return sum(1 for trace in tracemalloc._get_traces() if trace[0] == np.lib.tracemalloc_domain)
+
+    def trace(frame, event, arg):
+        if not frame.f_code.co_filename.startswith(PACKAGE_PATH):
+            return None
+        frame.f_trace_opcodes = True
+        current, peak = tracemalloc.get_traced_memory()
+        # Traces are listed only if something was allocated since the previous instruction
+        if peak > state["current"]:
+            blocks = numpy_blocks()
+            state["created"] += max(blocks - state["blocks"], 0)
+            state["blocks"] = blocks
+            tracemalloc.reset_peak()
+        state["current"] = current
+        return trace
+
+    tracemalloc.start()
+    state["blocks"] = numpy_blocks()
+    sys.settrace(trace)
+    for _ in range(n_steps):
+        step()
+    sys.settrace(None)
+    tracemalloc.stop()
+    return state["created"] / n_steps
+
+
+def measure_bytes(step, n_steps: int) -> float:
+    """
+    Returns the mean number of bytes a call of `step` allocates on top of the memory alive before it.
+    """
+    tracemalloc.start()
+    allocated = 0
+    for _ in range(n_steps):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        step()
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - current
+    tracemalloc.stop()
+    return allocated / n_steps
+
+
+def measure(
+    reuse_observation_buffers: bool, observation_mode: str, grid_dims: tuple[int, int], n_steps: int
+) -> tuple[float, float, float]:
+    env = GymnasiumGenerals(
+        grid_factory=GridFactory(grid_dims=grid_dims, seed=0),
+        npc=PassingAgent(),
+        reuse_observation_buffers=reuse_observation_buffers,
+        observation_mode=observation_mode,
+    )
+    image_env = ObservationAsImageWrapper(env) if observation_mode == "dict" else env
+    image_env.reset(seed=0)
+
+    def step():
+        image_env.step(PASS_ACTION)
+
+    step()  # warm up, buffers are allocated here
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        step()
+    step_time = (time.perf_counter() - start) / n_steps
+    return count_arrays(step, n_steps), measure_bytes(step, n_steps), step_time
+
+
+if __name__ == "__main__":
+    # Armies of cities grow every other step, so the number of steps is even
+    n_steps = 50
+    for grid_dims in [(10, 10), (20, 20), (30, 30)]:
+        for mode, reuse in [("dict", False), ("dict", True), ("tensor", False), ("tensor", True)]:
+            arrays, allocated, step_time = measure(reuse, mode, grid_dims, n_steps)
+            print(
+                f"grid {grid_dims}, observation_mode={mode}, reuse_observation_buffers={reuse}: "
+                f"{arrays:.1f} arrays and {allocated / 1024:.1f} KiB allocated per step, "
+                f"{step_time * 1e6:.0f} us per step"
+            )
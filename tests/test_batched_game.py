@@ -0,0 +1,137 @@
+import numpy as np
+
+from generals.agents import ExpanderAgent, RandomAgent
+from generals.core.batched_game import BatchedGame
+from generals.core.config import DIRECTIONS
+from generals.core.game import Game
+from generals.core.grid import Grid, GridFactory
+
+
+def get_games(n_games=8, seed=0):
+    grid_factory = GridFactory(grid_dims=(6, 6), mountain_density=0.1, city_density=0.1, seed=seed)
+    grids = [grid_factory.grid_from_generator() for _ in range(n_games)]
+    agents = ["red", "blue"]
+    games = [Game(grid, agents, check_stats=True) for grid in grids]
+    return games, BatchedGame(grids, agents)
+
+
+def assert_same_state(games, batched_game):
+    for b, game in enumerate(games):
+        assert (game.channels.armies == batched_game.armies[b]).all()
+        for i, agent in enumerate(game.agents):
+            assert (game.channels.ownership[agent] == (batched_game.owners[b] == i + 1)).all()
+        assert game.time == batched_game.time[b]
+        assert game.is_done() == batched_game.is_done()[b]
+
+
+def test_batched_game_matches_game():
+    """
+    Stepping a batch of games must give the same states as stepping each game separately.
+    """
+    games, batched_game = get_games()
+    agents = {"red": ExpanderAgent(seed=0), "blue": RandomAgent(seed=0)}
+    assert_same_state(games, batched_game)
+
+    for _ in range(300):
+        actions = {
+            agent: np.array([agents[agent].act(game.agent_observation(agent).as_dict()) for game in games])
+            for agent in batched_game.agents
+        }
+        for b, game in enumerate(games):
+            game.step({agent: actions[agent][b] for agent in game.agents})
+        infos = batched_game.step(actions)
+        assert_same_state(games, batched_game)
+
+        for b, game in enumerate(games):
+            game_infos = game.get_infos()
+            for agent in game.agents:
+                for key in ["army", "land", "is_winner"]:
+                    assert game_infos[agent][key] == infos[agent][key][b]
+
+
+def test_batched_observation_matches_game():
+    games, batched_game = get_games(n_games=4, seed=1)
+    for agent in batched_game.agents:
+        batched_observation = batched_game.agent_observation(agent)
+        for b, game in enumerate(games):
+            observation = game.agent_observation(agent).as_dict(with_mask=False)
+            for key, value in observation.items():
+                assert (np.asarray(value) == batched_observation[key][b]).all(), key
+            assert (game.agent_observation(agent).action_mask() == batched_game.action_mask(agent)[b]).all()
+
+
+def test_reset_game():
+    games, batched_game = get_games(n_games=2)
+    batched_game.armies[0] += 5
+    batched_game.time[0] = 10
+    grid = GridFactory(grid_dims=(6, 6), seed=3).grid_from_generator()
+    batched_game.reset_game(0, grid)
+    assert_same_state([Game(grid, batched_game.agents)] + games[1:], batched_game)
+
+
+def test_batched_game_end():
+    """
+    Capturing a general ends only the game where it happened.
+    """
+    grid = Grid("A.B\n...")
+    agents = ["red", "blue"]
+    games = [Game(grid, agents, check_stats=True), Game(grid, agents, check_stats=True)]
+    batched_game = BatchedGame([grid, grid], agents)
+    for game in games:
+        game.channels.set_cell(0, 1, 3, 1)
+    batched_game.armies[:, 0, 1] = 3
+    batched_game.owners[:, 0, 1] = 1
+
+    actions = {"red": np.array([[0, 0, 1, 3, 0], [1, 0, 1, 3, 0]]), "blue": np.array([[1, 0, 0, 0, 0]] * 2)}
+    for b, game in enumerate(games):
+        game.step({agent: actions[agent][b] for agent in agents})
+    infos = batched_game.step(actions)
+    assert_same_state(games, batched_game)
+    assert (batched_game.is_done() == [True, False]).all()
+    assert (infos["red"]["is_winner"] == [True, False]).all()
+    assert (batched_game.owners[0] == [[1, 1, 1], [0, 0, 0]]).all()
+
+
+def test_act_batch():
+    """
+    Batched agents must select valid actions of the same priority class as their per-game versions.
+    """
+    games, batched_game = get_games(n_games=16, seed=2)
+    expander = ExpanderAgent(seed=0)
+    for _ in range(100):
+        actions = {}
+        for agent, npc in zip(batched_game.agents, [expander, RandomAgent(seed=0)]):
+            observation = {
+                "observation": batched_game.agent_observation(agent),
+                "action_mask": batched_game.action_mask(agent),
+            }
+            actions[agent] = npc.act_batch(observation)
+            for b, action in enumerate(actions[agent]):
+                mask = observation["action_mask"][b]
+                if mask.any():
+                    assert mask[action[1], action[2], action[3]]
+                else:
+                    assert action[0] == 1
+        batched_game.step(actions)
+
+        # Expander captures the same kind of cell as the per-game version would
+        observation = {
+            "observation": batched_game.agent_observation("red"),
+            "action_mask": batched_game.action_mask("red"),
+        }
+        batched_actions = expander.act_batch(observation)
+        for b in range(batched_game.n_games):
+            game_observation = {key: value[b] for key, value in observation["observation"].items()}
+            action = expander.act({"observation": game_observation, "action_mask": observation["action_mask"][b]})
+            assert capture_kind(game_observation, action) == capture_kind(game_observation, batched_actions[b])
+
+
+def capture_kind(observation, action):
+    if action[0] == 1:
+        return "pass"
+    di, dj = np.array(action[1:3]) + DIRECTIONS[action[3]].value
+    if observation["armies"][action[1], action[2]] <= observation["armies"][di, dj] + 1:
+        return "none"
+    if observation["opponent_cells"][di, dj]:
+        return "opponent"
+    return "neutral" if observation["neutral_cells"][di, dj] else "none"
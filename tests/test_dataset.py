@@ -0,0 +1,50 @@
+import threading
+
+import numpy as np
+
+from generals import GridFactory, GridPool
+from generals.data import Dataset, DatasetBuilder
+
+
+def test_dataset(tmp_path):
+    builder = DatasetBuilder(
+        agent_types=["Expander", "Random"],
+        grid_factory=GridFactory(grid_dims=(6, 6)),
+        truncation=40,
+        shard_size=50,
+        chunk_size=20,
+        n_workers=2,
+        seed=3,
+    )
+    index = builder.build(str(tmp_path), n_games=3)
+    dataset = Dataset(str(tmp_path))
+    assert len(dataset) == index["n_samples"] == sum(len(builder.play_game(game)["actions"]) for game in range(3))
+    assert all(shard["n_samples"] <= 50 and max(shard["chunks"]) <= 20 for shard in index["shards"])
+
+    chunks = list(dataset)
+    samples = {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+    assert samples["observations"].shape == (len(dataset), 6, 6, len(builder.channels))
+    assert samples["action_masks"].shape == (len(dataset), 6, 6, 4)
+
+    # Samples of a game are the observations and actions of both players in every step
+    game = builder.play_game(1)
+    in_game = samples["games"] == 1
+    for key, value in game.items():
+        assert (samples[key][in_game] == value).all(), key
+    assert game["dones"][-2:].all() and not game["dones"][:-2].any()
+
+    # Selected actions are valid
+    for action, mask in zip(samples["actions"], samples["action_masks"]):
+        assert action[0] == 1 or mask[action[1], action[2], action[3]]
+
+    # Shards can be read separately
+    assert sum(len(chunk["actions"]) for chunk in dataset.iter_chunks(shards=[0])) == index["shards"][0]["n_samples"]
+
+    # Games from a pool are the same as from a factory and do not leave producer threads behind
+    pool = GridPool(grid_dims=(6, 6), pool_size=2)
+    pool_builder = DatasetBuilder(agent_types=["Expander", "Random"], grid_factory=pool, truncation=40, seed=3)
+    threads = threading.active_count()
+    for key, value in pool_builder.play_game(1).items():
+        assert (game[key] == value).all(), key
+    assert threading.active_count() == threads
+    pool.close()
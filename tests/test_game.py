@@ -2,9 +2,13 @@ import itertools
 
 import numpy as np
 import pytest
+from scipy.ndimage import maximum_filter
 
 import generals.core.game as game
+from generals.agents import ExpanderAgent, RandomAgent
+from generals.core.config import DIRECTIONS
 from generals.core.grid import Grid, GridFactory
+from generals.core.observation import compute_action_mask, compute_passable_directions
 
 
 def get_game(grid=None):
@@ -854,3 +858,264 @@ def test_channel_to_indices():
 # #
 # #     # Game should be done
 # #     assert game.is_done()
+
+
+def test_owners_channel():
+    """
+    Ownership masks are derived from the owners channel and writing them updates it.
+    """
+    map = """...#
+#..A
+#..#
+.#.B
+"""
+    game = get_game(Grid(map))
+    channels = game.channels
+    assert channels.owners[1, 3] == channels.owner_index("red") == 1
+    assert channels.owners[3, 3] == channels.owner_index("blue") == 2
+    assert (channels.ownership["red"] == (channels.owners == 1)).all()
+    # mountains are not owned by anyone, but they are not neutral cells either
+    assert not channels.ownership_neutral[0, 3]
+
+    red = np.zeros((4, 4), dtype=bool)
+    red[0, 0] = red[1, 3] = True
+    channels.ownership["red"] = red
+    assert (channels.ownership["red"] == red).all()
+    assert channels.ownership_neutral.sum() == channels.passable.sum() - 3
+    # Masks are derived copies, writing into them must not pass silently
+    with pytest.raises(ValueError):
+        channels.ownership["red"][2, 2] = 1
+
+    army, land = channels.player_stats()
+    assert land[1] == 2 and land[2] == 1
+    assert army[1] == channels.armies[0, 0] + channels.armies[1, 3]
+
+
+def test_legacy_channels_unpickling():
+    """
+    Channels pickled with a dictionary of ownership masks are converted to the owners channel.
+    """
+    game = get_game()
+    channels = game.channels
+    excluded = ["_owners", "_owner_indices", "_state"]
+    state = {key: value for key, value in channels.__dict__.items() if key not in excluded}
+    state["_ownership"] = {owner: channels.ownership[owner] for owner in ["neutral"] + game.agents}
+    legacy = channels.__class__.__new__(channels.__class__)
+    legacy.__setstate__(state)
+    assert (legacy.owners == channels.owners).all()
+    assert legacy.owner_indices == channels.owner_indices
+
+
+def test_running_player_stats():
+    """
+    Player stats maintained by steps must match stats computed from scratch.
+    """
+    grid = GridFactory(grid_dims=(8, 8), city_density=0.2, seed=0).grid_from_generator()
+    game = get_game(grid)
+    game.check_stats = True
+    agents = {"red": ExpanderAgent(seed=0), "blue": RandomAgent(seed=0)}
+    for _ in range(120):  # covers land increment at t=50 and t=100
+        actions = {agent: agents[agent].act(game.agent_observation(agent).as_dict()) for agent in game.agents}
+        game.step(actions)  # raises if running stats diverge
+
+    army, land = game.channels.recompute_player_stats()
+    infos = game.get_infos()
+    assert infos["red"]["army"] == army[1] and infos["blue"]["land"] == land[2]
+
+    # In-place writes would bypass the running stats, cells change only through `set_cell` and the setters
+    with pytest.raises(ValueError):
+        game.channels.armies[0, 0] += 10
+    with pytest.raises(ValueError):
+        game.channels.owners[0, 0] = 1
+    game.channels.armies = game.channels.armies + 10
+    game.step({})
+
+
+def test_incremental_visibility():
+    """
+    Incrementally maintained visibility must match visibility computed from the ownership masks.
+    """
+    grid = GridFactory(grid_dims=(7, 9), seed=1).grid_from_generator()
+    game = get_game(grid)
+    agents = {"red": ExpanderAgent(seed=1), "blue": ExpanderAgent(seed=2)}
+    for _ in range(100):
+        actions = {agent: agents[agent].act(game.agent_observation(agent).as_dict()) for agent in game.agents}
+        game.step(actions)
+        for agent in game.agents:
+            reference = maximum_filter(game.channels.ownership[agent], size=3)
+            assert (game.channels.get_visibility(agent) == reference).all()
+
+    with pytest.raises(ValueError):
+        game.channels.get_visibility("red")[0, 0] = True
+
+
+def test_action_mask():
+    """
+    Action mask must allow moves from owned cells with more than 1 army
+    that stay in the grid and do not bump into a mountain.
+    """
+    rng = np.random.default_rng(0)
+    armies = rng.integers(0, 4, size=(3, 5, 6))
+    owned_cells = rng.random((3, 5, 6)) < 0.5
+    mountains = rng.random((3, 5, 6)) < 0.3
+
+    reference = np.zeros((3, 5, 6, 4), dtype=bool)
+    for b, i, j in np.ndindex(3, 5, 6):
+        for k, direction in enumerate(DIRECTIONS):
+            di, dj = i + direction.value[0], j + direction.value[1]
+            if not (0 <= di < 5 and 0 <= dj < 6) or mountains[b, di, dj]:
+                continue
+            reference[b, i, j, k] = owned_cells[b, i, j] and armies[b, i, j] > 1
+
+    # batched masks
+    mask = compute_action_mask(armies, owned_cells, compute_passable_directions(~mountains))
+    assert (mask == reference).all()
+
+    # masks of single observations
+    for b in range(3):
+        empty = np.zeros((5, 6), dtype=bool)
+        observation = game.Observation(
+            armies=armies[b],
+            generals=empty,
+            cities=empty,
+            mountains=mountains[b],
+            neutral_cells=empty,
+            owned_cells=owned_cells[b],
+            opponent_cells=empty,
+            fog_cells=empty,
+            structures_in_fog=empty,
+            owned_land_count=0,
+            owned_army_count=0,
+            opponent_land_count=0,
+            opponent_army_count=0,
+            timestep=0,
+        )
+        assert (observation.action_mask() == reference[b]).all()
+
+
+def test_snapshot_restore():
+    """
+    Restoring a snapshot rolls the game back, forward models follow the same rules as games.
+    """
+    grid = GridFactory(grid_dims=(8, 8), city_density=0.2, seed=0).grid_from_generator()
+    game = get_game(grid)
+    agents = {"red": ExpanderAgent(seed=0), "blue": RandomAgent(seed=0)}
+    for _ in range(20):
+        game.step({agent: agents[agent].act(game.agent_observation(agent).as_dict()) for agent in game.agents})
+
+    snapshot = game.snapshot()
+    model = game.forward_model()
+    clone = model.clone()
+    armies, owners = game.channels.armies.copy(), game.channels.owners.copy()
+    for _ in range(40):
+        actions = {agent: agents[agent].act(game.agent_observation(agent).as_dict()) for agent in game.agents}
+        game.step(actions)
+        model.apply_actions(actions)
+    assert (model.channels.armies == game.channels.armies).all()
+    assert (model.channels.owners == game.channels.owners).all()
+    assert model.time == game.time and model.agent_order == game.agent_order
+    assert (clone.channels.armies == armies).all() and clone.time == 20
+
+    game.restore(snapshot)
+    assert game.time == 20 and (game.channels.armies == armies).all() and (game.channels.owners == owners).all()
+    army, land = game.channels.recompute_player_stats()
+    assert (game.channels.player_stats()[0] == army).all() and (game.channels.player_stats()[1] == land).all()
+    assert (game.channels.get_visibility("red") == maximum_filter(game.channels.ownership["red"], size=3)).all()
+
+
+def assert_lookahead(game, agent, actions=None):
+    """
+    Outcomes of a lookahead must match stepping a copy of the game with each candidate move.
+    """
+    outcomes = game.lookahead(agent, actions)
+    for n, action in enumerate(outcomes.actions):
+        model = game.forward_model()
+        model.apply_actions({agent: action})
+        channels = model.channels
+        (di, dj), si, sj = outcomes.destination[n], action[1], action[2]
+        assert outcomes.source_army[n] == channels.armies[si, sj]
+        assert outcomes.destination_army[n] == channels.armies[di, dj]
+        assert outcomes.destination_owner[n] == channels.owners[di, dj]
+        assert outcomes.won[n] == (model.agent_won(agent) and not game.is_done())
+        assert (outcomes.army[n] == channels.player_stats()[0]).all()
+        assert (outcomes.land[n] == channels.player_stats()[1]).all()
+    return outcomes
+
+
+def test_lookahead():
+    grid = GridFactory(grid_dims=(6, 6), city_density=0.2, seed=1).grid_from_generator()
+    game = get_game(grid)
+    agents = {"red": ExpanderAgent(seed=0), "blue": RandomAgent(seed=0)}
+    rng = np.random.default_rng(0)
+    for t in range(110):
+        if t in [0, 1, 48, 49, 99]:
+            for agent in game.agents:
+                assert_lookahead(game, agent)
+                # Random actions include passes and invalid moves
+                assert_lookahead(game, agent, rng.integers(0, [2, 6, 6, 4, 2], size=(50, 5)))
+        game.step({agent: agents[agent].act(game.agent_observation(agent).as_dict()) for agent in game.agents})
+
+    # Capturing the general of the opponent wins the game
+    game = get_game(Grid("A.B\n...\n..."))
+    game.channels.armies = np.array([[20, 0, 12], [0, 0, 0], [0, 0, 0]])
+    game.time = 1
+    outcomes = assert_lookahead(game, "red", [[0, 0, 0, 3, 0], [0, 0, 1, 3, 0]])
+    assert outcomes.valid.tolist() == [True, False] and outcomes.won.tolist() == [False, False]
+    game.apply_actions({"red": np.array([0, 0, 0, 3, 0])})
+    outcomes = assert_lookahead(game, "red", [[0, 0, 1, 3, 0], [0, 0, 1, 3, 1]])
+    assert outcomes.won.tolist() == [True, False] and outcomes.captured.tolist() == [True, False]
+    assert outcomes.land[0].tolist() == [6, 3, 0] and outcomes.destination_army.tolist() == [5, 4]
+
+
+def test_state_hash():
+    grid = GridFactory(grid_dims=(8, 8), city_density=0.2, seed=0).grid_from_generator()
+    game = get_game(grid)
+    game.check_stats = True  # checks the incremental hash against a full recompute after every step
+    agents = {"red": ExpanderAgent(seed=0), "blue": RandomAgent(seed=0)}
+    hashes = {game.state_hash}
+    for _ in range(110):
+        game.step({agent: agents[agent].act(game.agent_observation(agent).as_dict()) for agent in game.agents})
+        assert game.state_hash == game.recompute_state_hash()
+        hashes.add(game.state_hash)
+    assert len(hashes) == 111
+
+    # Equal states hash equally, restoring a snapshot restores the hash
+    snapshot, state_hash = game.snapshot(), game.state_hash
+    model = game.forward_model()
+    assert model.state_hash == state_hash
+    model.apply_actions({})
+    assert model.state_hash != state_hash
+    model.restore(snapshot)
+    assert model.state_hash == state_hash
+
+    # Observation hash ignores changes in fog of war
+    observation_hash = game.observation_hash("red")
+    hidden = game.channels.get_visibility("red") | (game.channels.owners != 0) | ~game.channels.passable
+    i, j = np.argwhere(~hidden)[0]
+    game.channels.set_cell(i, j, game.channels.armies[i, j] + 5, 0)
+    assert game.observation_hash("red") == observation_hash and game.observation_hash("blue") != observation_hash
+    assert game.state_hash != state_hash
+    game.channels.set_cell(i, j, game.channels.armies[i, j] - 5, 0)
+    assert game.state_hash == state_hash
+
+
+def test_advance():
+    """
+    Advancing k turns at once is the same as k steps in which both agents pass.
+    """
+    grid = GridFactory(grid_dims=(8, 8), city_density=0.2, seed=0).grid_from_generator()
+    game = get_game(grid)
+    game.check_stats = True
+    agents = {"red": ExpanderAgent(seed=0), "blue": RandomAgent(seed=0)}
+    for _ in range(37):
+        game.step({agent: agents[agent].act(game.agent_observation(agent).as_dict()) for agent in game.agents})
+
+    for k in [0, 1, 2, 13, 50, 101]:
+        model = game.forward_model()
+        for _ in range(k):
+            model.apply_actions({})
+        game.advance(k)
+        assert (game.channels.armies == model.channels.armies).all()
+        assert (game.channels.player_stats()[0] == model.channels.player_stats()[0]).all()
+        assert game.time == model.time and game.agent_order == model.agent_order
+        assert game.state_hash == model.state_hash
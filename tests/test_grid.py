@@ -1,6 +1,10 @@
 import numpy as np
+import pytest
 
+from generals.agents import RandomAgent
 from generals.core.grid import Grid, GridFactory
+from generals.core.grid_pool import GridPool
+from generals.envs import GymnasiumGenerals
 
 
 def test_grid_creation():
@@ -121,3 +125,93 @@ def test_stringify_map():
 .1#B#
     """
     assert map_str == reference_map.strip()
+
+
+def test_connected_components():
+    map = """
+.A#2.
+..#x.
+###..
+..#.B
+    """
+    components, n_components = Grid.connected_components(map)
+    assert n_components == 3
+    # Mountains and cities with digits block, the "x" city does not
+    assert (components == 0).sum() == 7
+    assert components[0, 0] == components[1, 1] != components[0, 4]
+    assert components[1, 3] == components[3, 4] == components[0, 4]
+    assert components[3, 0] not in [0, components[0, 0], components[0, 4]]
+
+
+def test_verify_large_grid():
+    """
+    Connectivity of large maps is checked without recursion, here along a 200x200 serpentine path.
+    """
+    map = np.full((200, 200), ".")
+    map[1::2, :] = "#"
+    map[1::4, -1] = "."
+    map[3::4, 0] = "."
+    map[0, 0], map[-1, -1] = "A", "B"
+    assert Grid.verify_grid_connectivity(map)
+    map[-3, -1] = "5"
+    assert not Grid.verify_grid_connectivity(map)
+
+    grid = GridFactory(grid_dims=(200, 200), seed=0).grid_from_generator()
+    assert Grid.verify_grid_connectivity(grid.grid)
+
+
+def test_grid_pool():
+    """
+    Pooled grids are generated in the background, but in the same order as by `GridFactory`.
+    """
+    kwargs = {"grid_dims": (8, 8), "mountain_density": 0.3, "city_density": 0.1}
+    factory, pool = GridFactory(**kwargs, seed=1), GridPool(**kwargs, seed=1, pool_size=4)
+    for _ in range(10):
+        assert pool.grid_from_generator() == factory.grid_from_generator()
+    stats = pool.stats()
+    assert stats["generated"] >= 10 and 0 < stats["acceptance_rate"] <= 1
+
+    # Reseeding restarts the pool, grids with other parameters are generated synchronously
+    pool.rng, factory.rng = np.random.default_rng(2), np.random.default_rng(2)
+    assert pool.grid_from_generator() == factory.grid_from_generator()
+    assert pool.grid_from_generator(grid_dims=(5, 5)) == factory.grid_from_generator(grid_dims=(5, 5))
+    assert pool.grid_from_generator() == factory.grid_from_generator()
+
+    # Environments close their pool, the producer thread stops and restarts if the pool is used again
+    env = GymnasiumGenerals(grid_factory=pool, npc=RandomAgent(seed=0))
+    env.reset(seed=3)
+    producer = pool._producer
+    env.close()
+    assert pool._producer is None and not producer.is_alive()
+    factory.rng = np.random.default_rng(3)
+    factory.grid_from_generator()
+    assert pool.grid_from_generator() == factory.grid_from_generator()
+    pool.close()
+
+    with pytest.raises(AssertionError):
+        GridPool(max_attempts=0)
+
+    # Errors of the producer are raised by the caller, as by `GridFactory`
+    pool = GridPool(mountain_density=0.9, city_density=0.2)
+    with pytest.raises(ValueError):
+        pool.grid_from_generator()
+    pool.close()
+
+
+def test_grid_codes():
+    map = """
+.3.#
+#.xA
+#..#
+.#.B
+    """
+    grid = Grid(map)
+    assert grid.codes.dtype == np.int8
+    assert (grid.codes == [[0, 43, 0, -1], [-1, 0, 50, -2], [-1, 0, 0, -1], [0, -1, 0, -3]]).all()
+    assert Grid(grid.codes) == grid
+    assert str(grid) == map.strip()
+    assert (Grid.decode_grid(grid.codes) == Grid.numpify_grid(map)).all()
+
+    grid = GridFactory(seed=0).grid_from_generator()
+    assert grid.codes.dtype == np.int8
+    assert Grid(str(grid)) == grid
@@ -1,7 +1,11 @@
 import gymnasium as gym
 import gymnasium.utils.env_checker as env_checker
+import numpy as np
 
-from generals.agents import AgentFactory
+from generals import GridFactory
+from generals.agents import Agent, AgentFactory, ExpanderAgent, RandomAgent
+from generals.envs import GeneralsSharedMemoryVectorEnv, GeneralsVectorEnv, GymnasiumGenerals
+from generals.envs.gymnasium_wrappers import ObservationAsImageWrapper
 
 
 def test_gym_runs():
@@ -13,3 +17,210 @@ def test_gym_runs():
     )
     env_checker.check_env(env.unwrapped)
     print("Gymnasium check passed!")
+
+
+def image_reference(observation, game):
+    _obs = observation["observation"]
+    grid_keys = ["generals", "cities", "mountains", "neutral_cells", "owned_cells", "opponent_cells", "fog_cells"]
+    ones = np.ones(game.grid_dims)
+    return (
+        np.stack(
+            [_obs["armies"] / game.max_army_value]
+            + [_obs[key] for key in grid_keys + ["structures_in_fog"]]
+            + [
+                ones * _obs["owned_land_count"] / game.max_land_value,
+                ones * _obs["owned_army_count"] / game.max_army_value,
+                ones * _obs["opponent_land_count"] / game.max_land_value,
+                ones * _obs["opponent_army_count"] / game.max_army_value,
+                ones * _obs["timestep"] / game.max_timestep,
+                ones * _obs["priority"],
+            ]
+        )
+        .astype(np.float32)
+        .transpose(1, 2, 0)
+    )
+
+
+def test_reused_observation_buffers():
+    """
+    Environments reusing observation buffers must produce the same observations as
+    environments allocating new ones, while returning the same arrays on every step.
+    """
+    envs = [
+        GymnasiumGenerals(npc=RandomAgent(), reuse_observation_buffers=reuse, grid_factory=GridFactory(seed=0))
+        for reuse in [False, True]
+    ]
+    image_wrapper = ObservationAsImageWrapper(envs[1])
+    agent = ExpanderAgent(seed=0)
+    observations = [env.reset(seed=0)[0] for env in envs]
+    first_armies = observations[1]["observation"]["armies"]
+    for _ in range(50):
+        action = agent.act(observations[0])
+        observations = []
+        for env in envs:
+            observations.append(env.step(action)[0])
+        for key, value in observations[0]["observation"].items():
+            assert (np.asarray(value) == observations[1]["observation"][key]).all(), key
+        assert (observations[0]["action_mask"] == observations[1]["action_mask"]).all()
+        assert observations[1]["observation"]["armies"] is first_armies
+
+        assert observations[1]["observation"]["fog_cells"].dtype == bool
+        image = image_wrapper.observation(observations[1])
+        assert (image == image_reference(observations[0], envs[0].game)).all()
+
+
+def test_tensor_observation_mode():
+    """
+    Tensor observations must match images created by `ObservationAsImageWrapper`
+    from dictionary observations of the same game.
+    """
+    dict_env = GymnasiumGenerals(npc=RandomAgent(), grid_factory=GridFactory(seed=0))
+    image_env = ObservationAsImageWrapper(dict_env)
+    tensor_envs = [
+        GymnasiumGenerals(
+            npc=RandomAgent(),
+            grid_factory=GridFactory(seed=0),
+            observation_mode="tensor",
+            reuse_observation_buffers=reuse,
+        )
+        for reuse in [False, True]
+    ]
+    raw_env = GymnasiumGenerals(
+        npc=RandomAgent(),
+        grid_factory=GridFactory(seed=0),
+        observation_mode="tensor",
+        observation_channels=["armies", "owned_cells", "timestep"],
+        observation_normalization={},
+        observation_dtype=np.uint8,
+    )
+    envs = [image_env, *tensor_envs, raw_env]
+    agent = ExpanderAgent(seed=0)
+    observations = [env.reset(seed=0)[0] for env in envs]
+    for _ in range(100):
+        action = agent.act(dict_env._agent_observation(dict_env.agent_id))
+        observations = []
+        for env in envs:
+            observations.append(env.step(action)[0])
+        image, tensor, reused_tensor, raw_tensor = observations
+        for observation in [tensor, reused_tensor]:
+            assert observation["observation"].dtype == np.float32
+            assert (observation["observation"] == image).all()
+            assert (observation["action_mask"] == dict_env._agent_observation(dict_env.agent_id)["action_mask"]).all()
+        assert tensor_envs[0].observation_space.contains(tensor)
+
+        dict_observation = dict_env._agent_observation(dict_env.agent_id)["observation"]
+        assert raw_tensor["observation"].dtype == np.uint8
+        assert (raw_tensor["observation"][..., 0] == np.minimum(dict_observation["armies"], 255)).all()
+        assert (raw_tensor["observation"][..., 1] == dict_observation["owned_cells"]).all()
+        assert (raw_tensor["observation"][..., 2] == min(dict_observation["timestep"], 255)).all()
+        assert raw_env.observation_space.contains(raw_tensor)
+
+
+def test_vector_env():
+    env = gym.make_vec(
+        "gym-generals-v0", num_envs=8, grid_factory=GridFactory(grid_dims=(4, 4), seed=0), npc=ExpanderAgent()
+    )
+    assert isinstance(env, GeneralsVectorEnv)
+    agent = ExpanderAgent(seed=0)
+    observation, _ = env.reset(seed=0)
+    assert observation["action_mask"].shape == (8, 4, 4, 4)
+    assert observation["observation"]["armies"].shape == (8, 4, 4)
+    finished = np.zeros(8, dtype=bool)
+    n_finished = 0
+    for _ in range(300):
+        observation, reward, terminated, truncated, info = env.step(agent.act_batch(observation))
+        # Games finished in the previous step are reset
+        assert (env.unwrapped.game.time[finished] == 0).all()
+        assert (reward[finished] == 0).all() and not terminated[finished].any()
+        assert (reward[terminated] == np.where(info["is_winner"][terminated], 1, -1)).all()
+        assert (reward[~terminated] == 0).all()
+        finished = terminated | truncated
+        n_finished += finished.sum()
+    assert n_finished > 0
+
+
+def test_vector_env_grid_option():
+    env = GeneralsVectorEnv(num_envs=2, npc=RandomAgent(), truncation=3)
+    observation, _ = env.reset(options={"grid": "A..\n..B"})
+    pass_actions = np.array([[1, 0, 0, 0, 0]] * 2)
+    for step in range(6):
+        _, _, _, truncated, _ = env.step(pass_actions)
+        assert env.game.grid_dims == (2, 3)
+        assert truncated.all() == (step % 4 == 2)
+
+
+class PassingAgent(Agent):
+    def __init__(self, id: str = "Passer"):
+        super().__init__(id)
+
+    def act(self, observation):
+        return np.array([1, 0, 0, 0, 0])
+
+    def reset(self):
+        pass
+
+
+def test_shared_memory_vector_env():
+    """
+    Games run by worker processes must give the same results as games run in this process.
+    """
+    n_envs = 5
+    kwargs = {"npc": PassingAgent(), "truncation": 15}
+    env = GeneralsSharedMemoryVectorEnv(
+        n_envs, games_per_worker=2, worker_cpus=[0], grid_factory=GridFactory(grid_dims=(5, 5)), **kwargs
+    )
+    assert env.n_workers == 3
+    reference_envs = [GymnasiumGenerals(grid_factory=GridFactory(grid_dims=(5, 5)), **kwargs) for _ in range(n_envs)]
+    agent = ExpanderAgent(seed=0)
+    try:
+        observation, _ = env.reset(seed=0)
+        reference_observations = [reference_env.reset(seed=i)[0] for i, reference_env in enumerate(reference_envs)]
+        done = np.zeros(n_envs, dtype=bool)
+        for _ in range(40):
+            assert env.observation_space.contains(observation)
+            for i, reference_observation in enumerate(reference_observations):
+                for key, value in reference_observation["observation"].items():
+                    assert (observation["observation"][key][i] == value).all(), key
+                assert (observation["action_mask"][i] == reference_observation["action_mask"]).all()
+
+            actions = np.array([agent.act(reference_observation) for reference_observation in reference_observations])
+            observation, reward, terminated, truncated, info = env.step(actions)
+            for i, reference_env in enumerate(reference_envs):
+                if done[i]:
+                    reference_observations[i] = reference_env.reset()[0]
+                    assert reward[i] == 0 and not terminated[i] and not truncated[i]
+                    continue
+                reference_observations[i], *results, reference_info = reference_env.step(actions[i])
+                assert results == [reward[i], terminated[i], truncated[i]]
+                assert reference_info["land"] == info["land"][i]
+            done = terminated | truncated
+    finally:
+        env.close()
+
+
+def test_reproducible_npc():
+    """
+    Environments reset with the same seed must play the same games, regardless of the global numpy random state.
+    """
+    trajectories = []
+    for global_seed in [0, 1]:
+        np.random.seed(global_seed)
+        env = GymnasiumGenerals(npc=ExpanderAgent(), grid_factory=GridFactory(grid_dims=(6, 6)))
+        agent = RandomAgent(seed=3)
+        observation, _ = env.reset(seed=7)
+        trajectory = []
+        for _ in range(50):
+            observation, *_ = env.step(agent.act(observation))
+            trajectory.append(observation["observation"]["armies"].copy())
+        trajectories.append(trajectory)
+    assert all((a == b).all() for a, b in zip(*trajectories))
+
+
+def test_act_batch_reproducible():
+    env = GeneralsVectorEnv(num_envs=4, npc=RandomAgent())
+    observation, _ = env.reset(seed=0)
+    state = np.random.get_state()[1].copy()
+    for agent_class in [RandomAgent, ExpanderAgent]:
+        actions = [agent_class(seed=5).act_batch(observation) for _ in range(2)]
+        assert (actions[0] == actions[1]).all()
+    assert (np.random.get_state()[1] == state).all(), "Agents must not use the global random state"
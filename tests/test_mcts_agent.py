@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from generals import AgentFactory, GridFactory
+from generals.agents import ExpanderAgent, MCTSAgent
+from generals.core.game import Game
+from generals.core.grid import Grid
+
+
+def test_mcts_captures_general():
+    """
+    With a large army two cells from the opponent general, the search must head for it.
+    """
+    game = Game(Grid("..#..\nA.B..\n....."), ["red", "blue"])
+    game.channels.armies = np.where(game.channels.generals, [[0] * 5, [20, 0, 12, 0, 0], [0] * 5], 0)
+    game.channels.set_cell(1, 1, 1, 1)  # red sees the blue general
+    agent = MCTSAgent("red", time_budget=None, max_iterations=60, seed=0)
+    action = agent.act(game.agent_observation("red").as_dict())
+    assert list(action[:4]) == [0, 1, 0, 3]
+
+    # The determinized model keeps the seen cells, cells in fog are empty in this game anyway
+    model = agent.determinize(game.agent_observation("red").as_dict())
+    assert (model.channels.armies == game.channels.armies).all()
+    assert (model.channels.owners == game.channels.owners).all()
+
+
+def test_mcts_agent_plays():
+    """
+    Actions are valid, the subtree of the chosen move is reused on the next turn and rollouts run in parallel.
+    """
+    grid = GridFactory(grid_dims=(8, 8), seed=1).grid_from_generator()
+    game = Game(grid, ["red", "blue"])
+    agent = AgentFactory.make_agent("MCTS", id="red", time_budget=None, max_iterations=16, n_workers=2, seed=0)
+    npc = ExpanderAgent("blue", seed=0)
+    for _ in range(20):
+        observation = game.agent_observation("red").as_dict()
+        previous_root = agent.root
+        action = agent.act(observation)
+        assert agent.iterations == 16
+        if action[0] == 0:
+            assert observation["action_mask"][action[1], action[2], action[3]]
+        if previous_root is not None and previous_root.children:
+            # The search continued from the subtree of the previous move
+            assert previous_root.visits > 16
+        game.step({"red": action, "blue": npc.act(game.agent_observation("blue").as_dict())})
+
+    # The thread pool of the agent is shut down on reset, an executor of the caller is left running
+    thread_pool = agent._thread_pool
+    agent.reset()
+    assert agent._thread_pool is None and thread_pool._shutdown
+    with ThreadPoolExecutor(2) as executor:
+        agent = MCTSAgent("red", time_budget=None, max_iterations=4, n_workers=2, executor=executor, seed=0)
+        agent.act(game.agent_observation("red").as_dict())
+        agent.close()
+        assert agent._thread_pool is None and not executor._shutdown
+
+
+def test_mcts_determinize_without_fog():
+    """
+    Without fog cells the unseen opponent general is guessed among visible cells, preferably cells not owned by us.
+    """
+    game = Game(Grid("A..#\n....\n...B"), ["red", "blue"])
+    observation = game.agent_observation("red").as_dict()
+    observation["observation"]["fog_cells"] = np.zeros((3, 4), dtype=bool)
+    agent = MCTSAgent("red", time_budget=None, max_iterations=8, seed=0)
+    model = agent.determinize(observation)
+    assert model.channels.owners[2, 3] == 2 and (model.channels.owners == 2).sum() == 1
+    action = agent.act(observation)
+    assert action[0] == 1 or observation["action_mask"][action[1], action[2], action[3]]
+
+    observation["observation"]["owned_cells"] = ~observation["observation"]["structures_in_fog"]
+    model = agent.determinize(observation)
+    assert model.channels.owners[2, 3] == 2 and (model.channels.owners == 1).sum() == 10
+    agent.act(observation)
@@ -0,0 +1,36 @@
+import numpy as np
+import pygame
+
+from generals import GridFactory
+from generals.agents import ExpanderAgent, RandomAgent
+from generals.core.game import Game
+from generals.gui.properties import GuiMode, Properties
+from generals.gui.rendering import Renderer
+
+
+def test_dirty_tiles_match_full_render(monkeypatch):
+    """
+    Window renderer redraws only changed tiles, the screen must still match the offscreen full render.
+    """
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+    grid = GridFactory(grid_dims=(8, 10), seed=3).grid_from_generator()
+    agents = {"red": ExpanderAgent("red", seed=0), "blue": RandomAgent("blue", seed=0)}
+    game = Game(grid, list(agents))
+    properties = Properties(game, {agent.id: {"color": agent.color} for agent in agents.values()}, GuiMode.TRAIN)
+    offscreen = Renderer(properties, offscreen=True)
+    window = Renderer(properties)
+    try:
+        assert len(window.render_grid()) == 8 * 10
+        assert window.render_grid() == []
+        for t in range(40):
+            actions = {id: agent.act(game.agent_observation(id).as_dict()) for id, agent in agents.items()}
+            game.step(actions)
+            if t == 20:
+                properties.agent_fov["blue"] = False
+            window.render()
+            if t % 10 == 0:
+                width, height = window.screen.get_size()
+                screen = np.frombuffer(pygame.image.tobytes(window.screen, "RGB"), dtype=np.uint8)
+                assert (screen.reshape(height, width, 3) == offscreen.rgb_array()).all()
+    finally:
+        pygame.quit()
@@ -0,0 +1,233 @@
+import pickle
+from copy import deepcopy
+
+import numpy as np
+
+from generals import GridFactory, Replay, ReplayWriter
+from generals.agents import ExpanderAgent, RandomAgent
+from generals.core.game import Game
+from generals.envs import GymnasiumGenerals, PettingZooGenerals
+
+
+def play_game(n_steps=80, idle_steps=()):
+    """
+    Returns a replay of a game and copies of channels of all its frames, both agents pass in `idle_steps`.
+    """
+    grid = GridFactory(grid_dims=(8, 8), seed=0).grid_from_generator()
+    agents = {"red": ExpanderAgent("red", seed=0), "blue": RandomAgent("blue", seed=0)}
+    agent_data = {agent.id: {"color": agent.color} for agent in agents.values()}
+    game = Game(grid, list(agents))
+    replay = Replay("game", grid, agent_data, keyframe_interval=16)
+    frames = [deepcopy(game.channels)]
+    replay.add_state(game.channels)
+    for t in range(n_steps):
+        actions = {id: agent.act(game.agent_observation(id).as_dict()) for id, agent in agents.items()}
+        if t in idle_steps:
+            actions = {id: np.array([1, 0, 0, 0, 0]) for id in agents}
+        game.step(actions)
+        frames.append(deepcopy(game.channels))
+        replay.add_state(game.channels, actions)
+    return replay, frames
+
+
+def assert_frames(replay, frames):
+    assert len(replay) == len(frames)
+    for t in [len(frames) - 1, 0, len(frames) // 2, len(frames) // 2 + 1]:
+        channels = replay.frame(t)
+        assert (channels.armies == frames[t].armies).all()
+        assert (channels.owners == frames[t].owners).all()
+        assert (channels.player_stats()[0] == frames[t].player_stats()[0]).all()
+
+
+def test_replay_store_load(tmp_path):
+    replay, frames = play_game()
+    assert_frames(replay, frames)
+
+    replay.name = str(tmp_path / "game")
+    replay.store()
+    loaded = Replay.load(str(tmp_path / "game"))
+    assert loaded.grid == replay.grid
+    assert loaded.agent_data == replay.agent_data
+    assert loaded.has_actions and loaded.keyframe_interval == 16
+    assert_frames(loaded, frames)
+    assert loaded.verify() == []
+
+    # A changed action makes re-simulated frames differ from recorded checksums
+    channels = loaded.frame(40)
+    movable = (channels.owners == 1) & (channels.armies > 1)
+    i, j, direction = np.argwhere(movable[..., None] & channels.passable_directions)[0]
+    loaded._actions[40] = np.array([[0, i, j, direction, 0], [1, 0, 0, 0, 0]])
+    assert loaded.verify()[0] == 41
+
+
+def play_finished_game(extra_steps, idle=False):
+    """
+    Returns a replay of a game played to its end and `extra_steps` further frames, and copies of channels of all frames.
+    Agents keep acting after the end of the game, unless `idle`.
+    """
+    grid = GridFactory(grid_dims=(6, 6), seed=4).grid_from_generator()
+    agents = {"red": ExpanderAgent("red", seed=0), "blue": RandomAgent("blue", seed=0)}
+    game = Game(grid, list(agents))
+    replay = Replay("game", grid, {id: {"color": agent.color} for id, agent in agents.items()}, keyframe_interval=16)
+    frames = [deepcopy(game.channels)]
+    replay.add_state(game.channels)
+    while extra_steps > 0:
+        extra_steps -= game.is_done()
+        actions = {id: agent.act(game.agent_observation(id).as_dict()) for id, agent in agents.items()}
+        if idle and game.is_done():
+            actions = {id: np.array([1, 0, 0, 0, 0]) for id in agents}
+        game.step(actions)
+        frames.append(deepcopy(game.channels))
+        replay.add_state(game.channels, actions)
+    return replay, frames
+
+
+def test_replay_after_game_end(tmp_path):
+    """
+    Frames recorded after the end of a game are re-simulated, although the game time does not advance.
+    """
+    replay, frames = play_finished_game(extra_steps=3)
+    replay.name = str(tmp_path / "game")
+    replay.store()
+    loaded = Replay.load(str(tmp_path / "game"))
+    assert len(loaded) == 66 + 3 + 1
+    assert_frames(loaded, frames)
+    assert (loaded[-1].armies == frames[-1].armies).all()
+    assert loaded.verify() == []
+
+
+def test_replay_idle_steps(tmp_path):
+    """
+    Seeking through turns in which both agents pass fast-forwards the game.
+    """
+    replay, frames = play_game(idle_steps=range(10, 60))
+    replay.name = str(tmp_path / "game")
+    replay.store()
+    loaded = Replay.load(str(tmp_path / "game"))
+    assert loaded._idle_steps(10, 80) == 50
+    for t in [55, 12, 70]:
+        assert (loaded.frame(t).armies == frames[t].armies).all()
+    assert loaded.verify() == []
+
+    # Passes after the end of a game are fast-forwarded too, while the game time stays
+    replay, frames = play_finished_game(extra_steps=20, idle=True)
+    replay.name = str(tmp_path / "finished")
+    replay.store()
+    loaded = Replay.load(str(tmp_path / "finished"))
+    assert loaded._idle_steps(67, len(loaded) - 1) == 19
+    assert_frames(loaded, frames)
+    assert loaded.verify() == []
+
+
+def test_legacy_replay(tmp_path):
+    """
+    Replays pickled by older versions stored a list of channels of all frames.
+    """
+    replay, frames = play_game(n_steps=20)
+    legacy = Replay.__new__(Replay)
+    legacy.__dict__.update(name="game", grid=replay.grid, agent_data=replay.agent_data, game_states=frames)
+    with open(tmp_path / "game.pkl", "wb") as f:
+        pickle.dump(legacy, f)
+    replay = Replay.load(str(tmp_path / "game"))
+    assert_frames(replay, frames)
+    assert not replay.has_actions
+
+    # Replays without actions are stored as diffs
+    replay.name = str(tmp_path / "converted")
+    replay.store()
+    assert "actions" not in np.load(str(tmp_path / "converted.npz"))
+    assert_frames(Replay.load(str(tmp_path / "converted")), frames)
+
+
+def test_env_replay(tmp_path):
+    path = str(tmp_path / "env_game")
+    env = GymnasiumGenerals(grid_factory=GridFactory(grid_dims=(6, 6), seed=1), npc=RandomAgent(seed=0), truncation=30)
+    agent = RandomAgent("Agent", seed=1)
+    observation, _ = env.reset(seed=0, options={"replay_file": path})
+    armies = [env.game.channels.armies.copy()]
+    terminated = truncated = False
+    while not (terminated or truncated):
+        observation, _, terminated, truncated, _ = env.step(agent.act(observation))
+        armies.append(env.game.channels.armies.copy())
+
+    replay = Replay.load(path)
+    assert len(replay) == len(armies)
+    assert all((replay.frame(t).armies == armies[t]).all() for t in range(len(armies)))
+    assert replay.verify() == []
+
+
+def test_replay_frames(tmp_path):
+    replay, frames = play_game(n_steps=40)
+    stack = replay.frames
+    assert stack.shape == (41, 2, 8, 8)
+    assert all((stack[t, 0] == frames[t].armies).all() and (stack[t, 1] == frames[t].owners).all() for t in [0, 40])
+
+    replay.name = str(tmp_path / "game")
+    replay.store(frames=True)
+    loaded = Replay.load(str(tmp_path / "game"))
+    assert isinstance(loaded.frames, np.memmap)
+    assert (loaded.frames == stack).all()
+    assert_frames(loaded, frames)
+    assert (loaded[-1].armies == frames[-1].armies).all()
+
+
+def test_replay_writer(tmp_path):
+    replay, frames = play_game(n_steps=60)
+    path = str(tmp_path / "game")
+    writer = ReplayWriter(path, replay.grid, replay.agent_data, keyframe_interval=16, flush_interval=25)
+    writer.add_state(frames[0])
+    # Before the first flush the file holds an empty replay
+    empty = Replay.load(path)
+    assert len(empty) == 0 and empty.has_actions and empty.keyframe_interval == 16
+    for t, channels in enumerate(frames[1:], start=1):
+        writer.add_state(channels, dict(zip(replay.agent_data, replay._actions[t - 1])))
+        if t == 30:
+            # Frames flushed so far form a valid replay while the game goes on
+            writer.flush(wait=True)
+            partial = Replay.load(path)
+            assert_frames(partial, frames[:31])
+            assert partial.verify() == []
+    writer.close()
+    writer.close()
+
+    loaded = Replay.load(path)
+    assert loaded.grid == replay.grid and loaded.keyframe_interval == 16
+    assert_frames(loaded, frames)
+    assert loaded.verify() == []
+
+
+def test_pettingzoo_replay(tmp_path):
+    path = str(tmp_path / "env_game")
+    agents = {id: RandomAgent(id, seed=i) for i, id in enumerate(["red", "blue"])}
+    env = PettingZooGenerals(agents=agents, grid_factory=GridFactory(grid_dims=(6, 6), seed=1), truncation=30)
+    observations, _ = env.reset(seed=0, options={"replay_file": path})
+    done = False
+    while not done:
+        actions = {id: agent.act(observations[id]) for id, agent in agents.items()}
+        observations, _, terminated, truncated, _ = env.step(actions)
+        done = any(terminated.values()) or any(truncated.values())
+
+    # Replay is finalized on truncation
+    assert not hasattr(env, "replay")
+    replay = Replay.load(path)
+    assert len(replay) == env.game.time + 1
+    assert replay.verify() == []
+
+
+def test_rgb_frames(tmp_path):
+    path = str(tmp_path / "env_game")
+    grid_factory = GridFactory(grid_dims=(5, 6), seed=1)
+    env = GymnasiumGenerals(grid_factory=grid_factory, npc=RandomAgent(seed=0), truncation=10, render_mode="rgb_array")
+    agent = RandomAgent("Agent", seed=1)
+    observation, _ = env.reset(seed=0, options={"replay_file": path})
+    images = [env.render()]
+    terminated = truncated = False
+    while not (terminated or truncated):
+        observation, _, terminated, truncated, _ = env.step(agent.act(observation))
+        images.append(env.render())
+    assert images[0].shape == (5 * 50 + 1, 6 * 50 + 4 * 70, 3) and images[0].dtype == np.uint8
+
+    # Offscreen rendering of the replay draws the same images
+    rgb_frames = list(Replay.load(path).rgb_frames(step=3))
+    assert len(rgb_frames) == 4
+    assert all((image == images[3 * i]).all() for i, image in enumerate(rgb_frames))
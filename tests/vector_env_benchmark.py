@@ -0,0 +1,63 @@
+"""
+Measures throughput (game steps per second) of vectorized environments.
+
+The shared memory vector env is measured with 1 to N worker processes, each pinned to its own core
+when the platform supports it, and compared with a `SyncVectorEnv` of `GymnasiumGenerals` and
+with the single-process `GeneralsVectorEnv`.
+"""
+
+import argparse
+import os
+import time
+
+import gymnasium as gym
+
+from generals import GridFactory
+from generals.agents import RandomAgent
+from generals.envs import GeneralsSharedMemoryVectorEnv, GeneralsVectorEnv, GymnasiumGenerals
+
+
+def measure(env: gym.vector.VectorEnv, n_steps: int) -> float:
+    agent = RandomAgent()
+    observation, _ = env.reset(seed=0)
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        observation, *_ = env.step(agent.act_batch(observation))
+    elapsed = time.perf_counter() - start
+    env.close()
+    return env.num_envs * n_steps / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games_per_worker", type=int, default=16)
+    parser.add_argument("--max_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--grid_size", type=int, default=10)
+    args = parser.parse_args()
+    grid_dims = (args.grid_size, args.grid_size)
+    can_pin = hasattr(os, "sched_setaffinity")
+    cpus = sorted(os.sched_getaffinity(0)) if can_pin else None
+
+    def env_kwargs():
+        return {"grid_factory": GridFactory(grid_dims=grid_dims), "npc": RandomAgent(), "truncation": 500}
+
+    n_envs = args.games_per_worker
+    sync_env = gym.vector.SyncVectorEnv([lambda: GymnasiumGenerals(**env_kwargs()) for _ in range(n_envs)])
+    print(f"SyncVectorEnv, {n_envs} games: {measure(sync_env, args.steps):.0f} steps/s")
+    batched_env = GeneralsVectorEnv(n_envs, **env_kwargs())
+    print(f"GeneralsVectorEnv, {n_envs} games: {measure(batched_env, args.steps):.0f} steps/s")
+
+    n_workers = 1
+    while n_workers <= args.max_workers:
+        env = GeneralsSharedMemoryVectorEnv(
+            n_workers * args.games_per_worker,
+            games_per_worker=args.games_per_worker,
+            worker_cpus=cpus,
+            **env_kwargs(),
+        )
+        print(
+            f"GeneralsSharedMemoryVectorEnv, {n_workers} workers x {args.games_per_worker} games: "
+            f"{measure(env, args.steps):.0f} steps/s"
+        )
+        n_workers *= 2